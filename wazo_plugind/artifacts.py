@@ -0,0 +1,121 @@
+# Copyright 2021 The Wazo Authors  (see the AUTHORS file)
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+from threading import Lock
+
+logger = logging.getLogger(__name__)
+
+_artifact_store = None
+_artifact_store_lock = Lock()
+
+
+class ArtifactStore:
+    """The ArtifactStore keeps the built debian packages of the plugins
+
+    Packages are stored by a key computed from everything that was used to build them.
+    The least recently used packages are removed when the store grows over
+    `max_size_mb`.
+    """
+
+    _suffix = '.deb'
+
+    def __init__(self, directory, max_size_mb):
+        self._directory = directory
+        self._max_size = max_size_mb * 1024 * 1024
+        self._lock = Lock()
+
+    def fetch(self, key, filename):
+        """Copies the package stored for key to filename, returns False if there is none"""
+        path = self._path(key)
+        with self._lock:
+            try:
+                _link_or_copy(path, filename)
+            except FileNotFoundError:
+                return False
+            os.utime(path)
+        return True
+
+    def add(self, key, filename):
+        os.makedirs(self._directory, exist_ok=True)
+        fd, tmp_filename = tempfile.mkstemp(dir=self._directory, prefix='.artifact-')
+        os.close(fd)
+        try:
+            shutil.copyfile(filename, tmp_filename)
+            with self._lock:
+                os.replace(tmp_filename, self._path(key))
+                self._evict()
+        except Exception:
+            if os.path.exists(tmp_filename):
+                os.unlink(tmp_filename)
+            raise
+
+    def _evict(self):
+        artifacts = []
+        for name in os.listdir(self._directory):
+            if not name.endswith(self._suffix):
+                continue
+            stat = os.stat(os.path.join(self._directory, name))
+            artifacts.append((stat.st_mtime, stat.st_size, name))
+
+        total_size = sum(size for _, size, _ in artifacts)
+        # The newest package is kept even if it is bigger than the store
+        for _, size, name in sorted(artifacts)[:-1]:
+            if total_size <= self._max_size:
+                break
+            logger.debug('removing the artifact %s (%s bytes)', name, size)
+            os.unlink(os.path.join(self._directory, name))
+            total_size -= size
+
+    def _path(self, key):
+        return os.path.join(self._directory, key + self._suffix)
+
+    @classmethod
+    def from_config(cls, config):
+        store_config = config['artifact_cache']
+        return cls(store_config['directory'], store_config['max_size_mb'])
+
+
+def get_artifact_store(config):
+    global _artifact_store
+    with _artifact_store_lock:
+        if not _artifact_store:
+            logger.debug('Creating a new artifact store...')
+            _artifact_store = ArtifactStore.from_config(config)
+    return _artifact_store
+
+
+def make_key(source_commit, metadata, wazo_version, config):
+    """Returns a key identifying all the inputs of a plugin package"""
+    hash_ = hashlib.sha256()
+    inputs = {
+        'source_commit': source_commit,
+        'metadata': metadata,
+        'wazo_version': wazo_version,
+        'debian_package_section': config['debian_package_section'],
+        'metadata_dir': config['metadata_dir'],
+        'backup_rules_dir': config['backup_rules_dir'],
+        'default_install_filename': config['default_install_filename'],
+    }
+    hash_.update(json.dumps(inputs, sort_keys=True, default=str).encode('utf-8'))
+
+    for name in ('control', 'postinst', 'postrm', 'prerm'):
+        template = os.path.join(config['template_dir'], config[name + '_template'])
+        with open(template, 'rb') as f:
+            hash_.update(f.read())
+
+    return hash_.hexdigest()
+
+
+def _link_or_copy(src, dst):
+    try:
+        os.link(src, dst)
+    except FileNotFoundError:
+        raise
+    except OSError:
+        shutil.copyfile(src, dst)
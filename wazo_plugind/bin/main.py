@@ -22,7 +22,9 @@ def main(args):
 
     os.chdir(conf['home_dir'])
 
-    with RootWorker() as root_worker:
+    with RootWorker(
+        conf['apt_update_freshness'], conf['root_worker_command_timeout']
+    ) as root_worker:
         if conf['user']:
             change_user(conf['user'])
 
@@ -5,6 +5,7 @@ import kombu
 import logging
 import xivo_bus
 from functools import partial
+from . import jobs
 from xivo_bus.resources.plugins.events import (
     PluginInstallProgressEvent,
     PluginUninstallProgressEvent,
@@ -14,8 +15,9 @@ logger = logging.getLogger(__name__)
 
 
 class StatusPublisher:
-    def __init__(self, publisher):
+    def __init__(self, publisher, job_registry=None):
         self._publisher = publisher
+        self._job_registry = job_registry
 
     def install(self, ctx, status):
         return self._publish(PluginInstallProgressEvent, ctx, status)
@@ -29,9 +31,14 @@ class StatusPublisher:
     def uninstall_error(self, *args, **kwargs):
         return self._publish_error(PluginUninstallProgressEvent, *args, **kwargs)
 
-    def _publish(self, Event, ctx, *args, **kwargs):
-        event = Event(ctx.uuid, *args, **kwargs)
+    def _publish(self, Event, ctx, status, errors=None):
+        kwargs = {'errors': errors} if errors else {}
+        event = Event(ctx.uuid, status, **kwargs)
         ctx.log(logger.debug, 'publishing %s', event)
+        ctx.write_log('%s', status)
+        if self._job_registry:
+            type_ = 'uninstall' if Event is PluginUninstallProgressEvent else 'install'
+            self._job_registry.update(ctx.uuid, type_, status, errors)
         self._publisher.publish(event)
 
     def _publish_error(self, Event, ctx, error_id, message, details=None):
@@ -42,6 +49,7 @@ class StatusPublisher:
             'resource': 'plugins',
             'details': details,
         }
+        ctx.write_log('%s: %s %s', error_id, message, details)
         return self._publish(Event, ctx, 'error', errors=errors)
 
     def run(self):
@@ -62,7 +70,7 @@ class StatusPublisher:
             _new_publisher, uuid, bus_url, exchange_name, exchange_type
         )
         publisher = xivo_bus.PublishingQueue(publisher_fcty)
-        return cls(publisher)
+        return cls(publisher, jobs.get_job_registry(config))
 
 
 def _new_publisher(uuid, url, exchange_name, exchange_type):
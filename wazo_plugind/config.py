@@ -8,7 +8,6 @@ from xivo.chain_map import ChainMap
 from xivo.config_helper import parse_config_file, read_config_file_hierarchy
 from xivo.xivo_logging import get_log_level_by_name
 
-
 _MAX_PLUGIN_FORMAT_VERSION = 2
 _DAEMONNAME = 'wazo-plugind'
 _DEFAULT_HTTP_PORT = 9503
@@ -19,7 +18,28 @@ _DEFAULT_CONFIG = dict(
     extra_config_files='/etc/{}/conf.d/'.format(_DAEMONNAME),
     home_dir=_HOME_DIR,
     download_dir='/var/lib/wazo-plugind/downloads',
+    git_cache={
+        'enabled': True,
+        'directory': '/var/lib/wazo-plugind/git-cache',
+        'max_size_mb': 1024,
+    },
     extract_dir='/var/lib/wazo-plugind/tmp',
+    artifact_cache={
+        'enabled': True,
+        'directory': '/var/lib/wazo-plugind/artifacts',
+        'max_size_mb': 2048,
+    },
+    job_log={
+        'directory': '/var/lib/wazo-plugind/jobs',
+        'max_files': 500,
+        'follow_timeout': 300,
+    },
+    job_history_size=100,
+    scheduler={
+        'max_jobs': 10,
+        'max_queued_jobs': 50,
+        'stages': {'download': 4, 'build': 2, 'install': 1},
+    },
     metadata_dir=os.path.join(_HOME_DIR, 'plugins'),
     template_dir=os.path.join(_HOME_DIR, 'templates'),
     backup_rules_dir='/var/lib/wazo-plugind/rules',
@@ -33,11 +53,18 @@ _DEFAULT_CONFIG = dict(
     default_install_filename=os.path.join(_PLUGIN_DATA_DIR, 'rules'),
     default_debian_package_prefix='wazo-plugind',
     debian_package_section='wazo-plugind-plugin',
+    dpkg_status_file='/var/lib/dpkg/status',
+    apt_update_freshness=60,
+    root_worker_command_timeout=3600,
     debug=False,
     log_level='info',
     log_file='/var/log/{}.log'.format(_DAEMONNAME),
     user=_DAEMONNAME,
     market={'host': 'apps.wazo.community'},
+    market_cache={
+        'ttl': 300,
+        'snapshot_file': '/var/lib/wazo-plugind/market.json',
+    },
     confd={
         'host': 'localhost',
         'port': 9486,
@@ -5,6 +5,8 @@ import logging
 from uuid import uuid4
 from functools import partial
 
+from .joblog import get_job_log_store
+
 logger = logging.getLogger(__name__)
 
 
@@ -14,6 +16,14 @@ class Context:
         self.config = config
         self.with_fields(**kwargs)
 
+    @property
+    def log_filename(self):
+        return get_job_log_store(self.config).filename(self.uuid)
+
+    def write_log(self, msg, *args):
+        """Writes a message to the log file of the job"""
+        get_job_log_store(self.config).write(self.uuid, msg, *args)
+
     def log(self, logger, msg, *args, **kwargs):
         log_msg = '[{}] {}'.format(self.uuid, msg)
         logger(log_msg, *args, **kwargs)
@@ -4,7 +4,6 @@
 import logging
 import signal
 import sys
-from concurrent.futures import ThreadPoolExecutor
 from threading import Thread
 from functools import partial
 from cheroot import wsgi
@@ -14,7 +13,7 @@ from xivo.consul_helpers import ServiceCatalogRegistration
 from xivo.http_helpers import ReverseProxied
 from xivo.token_renewer import TokenRenewer
 from wazo_auth_client import Client as AuthClient
-from wazo_plugind import http, bus, service
+from wazo_plugind import http, bus, scheduler, service
 from .service_discovery import self_check
 
 logger = logging.getLogger(__name__)
@@ -27,7 +26,7 @@ def _signal_handler(signum, frame):
 
 class Controller:
     def __init__(self, config, root_worker):
-        self._executor = ThreadPoolExecutor(max_workers=10)  # Make it configurable
+        self._executor = scheduler.get_scheduler(config)
         self._xivo_uuid = config.get('uuid')
         self._listen_addr = config['rest_api']['listen']
         self._listen_port = config['rest_api']['port']
@@ -1,15 +1,24 @@
 # Copyright 2017-2020 The Wazo Authors  (see the AUTHORS file)
 # SPDX-License-Identifier: GPL-3.0-or-later
 
+import copy
+import heapq
+import json
 import logging
 import os
 import re
+import requests
+import tempfile
+import time
 import yaml
+from threading import Lock, Thread
 from unidecode import unidecode
+from marshmallow import ValidationError
 from requests import HTTPError
 from wazo_market_client import Client as MarketClient
 from wazo_plugind.helpers import version
 from .exceptions import InvalidSortParamException, InvalidPackageNameException
+from .schema import MarketListResultSchema
 from . import debian
 
 logger = logging.getLogger(__name__)
@@ -41,90 +50,532 @@ def iin(left, right):
     return normalize_caseless(left) in normalize_caseless(right)
 
 
-class MarketProxy:
-    """The MarketProxy is an interface to the plugin market
+class MarketSearchIndex:
+    """Answers the `search` parameter of the market without scanning the whole content
 
-    The proxy should be used during the execution of an HTTP request. It will fetch the content
-    of the market and store it to allow multiple "queries" without having to do multiple HTTP
-    requests on the "real" market.
+    The values of each item are normalized once and the trigrams of the normalized values
+    are indexed. A search only checks the items having all the trigrams of the searched
+    value and gives the same results as `iin` on each value of each item.
+    """
 
-    The proxy will only fetch the content of the market once, it is meant to be instanciated at
-    each received HTTP request.
+    def __init__(self, items):
+        self._items = items
+        self._texts = []
+        self._keys = {}
+        self._ngrams = {}
+
+        for position, item in enumerate(items):
+            texts, keys = self._extract(item)
+            self._texts.append(texts)
+            for key in keys:
+                self._keys.setdefault(key, set()).add(position)
+            for text in texts:
+                for ngram in self._split(text):
+                    self._ngrams.setdefault(ngram, set()).add(position)
+
+    def search(self, value):
+        needle = normalize_caseless(value)
+        matches = set(self._keys.get(value, ()))
+        for position in self._candidates(needle):
+            if position in matches:
+                continue
+            if any(needle in text for text in self._texts[position]):
+                matches.add(position)
+
+        return [self._items[position] for position in sorted(matches)]
+
+    def _candidates(self, needle):
+        ngrams = self._split(needle)
+        if not ngrams:
+            return range(len(self._items))
+
+        postings = sorted((self._ngrams.get(ngram, set()) for ngram in ngrams), key=len)
+        return set.intersection(*postings)
+
+    @staticmethod
+    def _split(text):
+        return {a + b + c for a, b, c in zip(text, text[1:], text[2:])}
+
+    @staticmethod
+    def _extract(item):
+        # str values are matched on their content, other containers on their elements
+        texts, keys = [], set()
+
+        def add(value, nested):
+            if isinstance(value, str):
+                texts.append(normalize_caseless(value))
+            elif isinstance(value, dict):
+                keys.update(key for key in value if isinstance(key, str))
+            elif isinstance(value, (list, tuple)):
+                for element in value:
+                    if nested:
+                        add(element, nested=False)
+                    elif isinstance(element, str):
+                        keys.add(element)
+
+        for value in item.values():
+            add(value, nested=True)
+        return texts, keys
+
+
+class MarketSnapshot:
+    """An immutable copy of the market content at a given time"""
+
+    _indexed_orders = ('name', 'namespace', 'display_name', 'author')
+
+    def __init__(
+        self, items, fetched_at=None, etag=None, last_modified=None, stale=False
+    ):
+        self.items = items
+        self.fetched_at = time.time() if fetched_at is None else fetched_at
+        self.etag = etag
+        self.last_modified = last_modified
+        self.stale = stale
+        self._search_index = None
+        self._result_rows = {}
+        self._sort_keys = {}
+        self._upgradability = None
+        self._lock = Lock()
+
+    def age(self):
+        return time.time() - self.fetched_at
+
+    def result_row(self, item):
+        """Returns the item of this snapshot validated by the MarketListResultSchema
+
+        The validation is only done once for each item of the snapshot.
+        """
+        key = id(item)
+        if key not in self._result_rows:
+            # upgradable is a local value, it will be replaced when updating the row
+            versions = [dict(v, upgradable=False) for v in item.get('versions', [])]
+            try:
+                row = MarketListResultSchema().load(dict(item, versions=versions))
+            except ValidationError as e:
+                row = e
+            self._result_rows[key] = row
+
+        row = self._result_rows[key]
+        if isinstance(row, ValidationError):
+            raise ValidationError(row.messages)
+        return row
+
+    def upgradability(self, current_wazo_version, installed_versions):
+        with self._lock:
+            upgradability = self._upgradability
+            if (
+                upgradability is None
+                or upgradability.current_wazo_version != current_wazo_version
+                or upgradability.installed_versions != installed_versions
+            ):
+                upgradability = MarketUpgradability(
+                    self.items, current_wazo_version, installed_versions
+                )
+                self._upgradability = upgradability
+            return upgradability
+
+    def build_indexes(self):
+        for order in self._indexed_orders:
+            self.sort_keys(order)
+        return self.search_index
+
+    def sort_keys(self, order):
+        """Returns the sort key of each item by id or None if the order is not indexed
+
+        Missing values are sorted last, as LAST_ITEM does. Orders having values that are
+        not strings are not indexed since they may not be orderable.
+        """
+        if order not in self._indexed_orders:
+            return None
+
+        with self._lock:
+            if order not in self._sort_keys:
+                self._sort_keys[order] = self._make_sort_keys(order)
+            return self._sort_keys[order]
+
+    def _make_sort_keys(self, order):
+        sort_keys = {}
+        for item in self.items:
+            value = item.get(order, LAST_ITEM)
+            if value is LAST_ITEM:
+                sort_keys[id(item)] = (1, '')
+            elif isinstance(value, str):
+                sort_keys[id(item)] = (0, value)
+            else:
+                return None
+        return sort_keys
+
+    @property
+    def search_index(self):
+        with self._lock:
+            if self._search_index is None:
+                self._search_index = MarketSearchIndex(self.items)
+            return self._search_index
+
+    def dump(self, filename):
+        """Writes the snapshot to filename, replacing the previous file atomically"""
+        content = {
+            'fetched_at': self.fetched_at,
+            'etag': self.etag,
+            'last_modified': self.last_modified,
+            'items': self.items,
+        }
+        dirname = os.path.dirname(filename)
+        fd, tmp_filename = tempfile.mkstemp(dir=dirname, prefix='.market-')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(content, f, separators=(',', ':'))
+            os.replace(tmp_filename, filename)
+        except Exception:
+            os.unlink(tmp_filename)
+            raise
+
+    @classmethod
+    def load(cls, filename):
+        """Reads a snapshot written by dump, the snapshot is stale until refreshed"""
+        with open(filename) as f:
+            content = json.load(f)
+        return cls(
+            content['items'],
+            fetched_at=content['fetched_at'],
+            etag=content.get('etag'),
+            last_modified=content.get('last_modified'),
+            stale=True,
+        )
+
+
+class MarketCache:
+    """The MarketCache is a process wide cache of the market content
+
+    The content is kept for `ttl` seconds. Once expired, the stale content is still
+    returned while a background thread fetches the new content from the market. The
+    only time a caller has to wait for the market is when there is nothing in the
+    cache, at startup or after an invalidation.
+
+    When a `snapshot_file` is configured, each fetched content is written to it and
+    it is loaded at startup. The loaded content, or the last fetched content when the
+    market cannot be reached, is flagged as stale until the market answers again. A
+    failed refresh is not retried for `ttl` seconds.
     """
 
-    def __init__(self, market_config):
+    def __init__(self, market_config, ttl, snapshot_file=None):
         self._client = MarketClient(**market_config)
-        self._content = {}
+        self._ttl = ttl
+        self._snapshot_file = snapshot_file
+        self._snapshot = self._load()
+        self._snapshot_lock = Lock()
+        self._fetch_lock = Lock()
+        self._refreshing = False
+        self._refresh_failed_at = None
 
     def get_content(self):
-        if not self._content:
-            self._content = self._fetch_plugin_list()
-        return self._content
+        return self.get_snapshot().items
+
+    def get_snapshot(self):
+        with self._snapshot_lock:
+            snapshot = self._snapshot
+            expired = snapshot is not None and self._is_expired(snapshot)
+            start_refresh = (
+                expired and not self._refreshing and not self._is_refresh_delayed()
+            )
+            if start_refresh:
+                self._refreshing = True
+
+        if snapshot is None:
+            return self._fetch()
+
+        if start_refresh:
+            logger.debug('market cache expired, refreshing in the background')
+            thread = Thread(target=self._refresh, name='market-cache-refresh')
+            thread.daemon = True
+            thread.start()
+
+        return snapshot
+
+    def invalidate(self):
+        logger.info('invalidating the market cache')
+        with self._snapshot_lock:
+            self._snapshot = None
+
+    def _is_expired(self, snapshot):
+        return snapshot.stale or snapshot.age() >= self._ttl
+
+    def _is_refresh_delayed(self):
+        if self._refresh_failed_at is None:
+            return False
+        return time.monotonic() - self._refresh_failed_at < self._ttl
+
+    def _refresh(self):
+        failed = True
+        try:
+            # The stale content is returned when the market cannot be reached
+            failed = self._fetch().stale
+        except Exception:
+            logger.exception('failed to refresh the market cache')
+        finally:
+            with self._snapshot_lock:
+                self._refreshing = False
+                self._refresh_failed_at = time.monotonic() if failed else None
+
+    def _fetch(self):
+        with self._fetch_lock:
+            with self._snapshot_lock:
+                snapshot = self._snapshot
+            if snapshot is not None and not self._is_expired(snapshot):
+                # Another thread fetched the content while we were waiting
+                return snapshot
 
-    def _fetch_plugin_list(self):
+            try:
+                response = self._fetch_plugin_list(snapshot)
+            except requests.exceptions.RequestException:
+                # An empty content would read as "no such plugin"
+                fallback = snapshot or self._load()
+                if fallback is None:
+                    raise
+                logger.info('Failed to fetch the market content, serving stale content')
+                return self._use_stale(fallback)
+
+            if response.status_code == 304:
+                logger.debug('market content not modified')
+                # The parsed content and its indexes are still valid
+                snapshot.fetched_at = time.time()
+                snapshot.stale = False
+                return snapshot
+
+            snapshot = MarketSnapshot(
+                response.json()['items'],
+                etag=response.headers.get('ETag'),
+                last_modified=response.headers.get('Last-Modified'),
+            )
+            snapshot.build_indexes()
+            with self._snapshot_lock:
+                self._snapshot = snapshot
+            self._dump(snapshot)
+            return snapshot
+
+    def _use_stale(self, snapshot):
+        snapshot.stale = True
+        with self._snapshot_lock:
+            self._snapshot = snapshot
+        return snapshot
+
+    def _fetch_plugin_list(self, snapshot):
+        headers = {'Accept': 'application/json'}
+        if snapshot is not None:
+            # A conditional request, the market answers 304 if nothing changed
+            if snapshot.etag:
+                headers['If-None-Match'] = snapshot.etag
+            if snapshot.last_modified:
+                headers['If-Modified-Since'] = snapshot.last_modified
+
+        session = self._client.session()
+        url = self._client.url('plugins')
         try:
-            result = self._client.plugins.list()
-            return result['items']
+            response = session.get(url, headers=headers, timeout=self._client.timeout)
+            response.raise_for_status()
+            return response
         except HTTPError as e:
             logger.info(
                 'Failed to fetch plugins from the market %s', e.response.status_code
             )
+            raise
+
+    def _load(self):
+        if not self._snapshot_file:
+            return None
+
+        try:
+            snapshot = MarketSnapshot.load(self._snapshot_file)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            logger.info('Ignoring the market snapshot %s: %s', self._snapshot_file, e)
+            return None
+
+        logger.debug(
+            'loaded %s market plugins from %s', len(snapshot.items), self._snapshot_file
+        )
+        return snapshot
+
+    def _dump(self, snapshot):
+        if not self._snapshot_file:
+            return
+
+        try:
+            snapshot.dump(self._snapshot_file)
+        except (OSError, TypeError, ValueError) as e:
+            logger.info('Failed to write the market snapshot: %s', e)
+
+    @classmethod
+    def from_config(cls, config):
+        cache_config = config['market_cache']
+        return cls(
+            config['market'],
+            cache_config['ttl'],
+            snapshot_file=cache_config.get('snapshot_file'),
+        )
+
+
+_market_cache = None
+_market_cache_lock = Lock()
+
+
+def get_market_cache(config):
+    global _market_cache
+    with _market_cache_lock:
+        if not _market_cache:
+            logger.debug('Creating a new market cache...')
+            _market_cache = MarketCache.from_config(config)
+    return _market_cache
+
+
+class MarketProxy:
+    """The MarketProxy is an interface to the plugin market
+
+    The proxy should be used during the execution of an HTTP request. It will get the content
+    of the market from the shared market cache and keep it to allow multiple "queries" on the
+    same version of the content, even if the cache gets refreshed in the meantime.
+
+    The proxy will only get the content of the market once, it is meant to be instanciated at
+    each received HTTP request.
+    """
+
+    def __init__(self, market_cache):
+        self._market_cache = market_cache
+        self._snapshot = None
+
+    def get_content(self):
+        return self.get_snapshot().items
+
+    def get_snapshot(self):
+        if self._snapshot is None:
+            self._snapshot = self._market_cache.get_snapshot()
+        return self._snapshot
+
+
+class MarketUpgradability:
+    """The installed version and the upgradable versions of each plugin of the market
+
+    It is computed once for a snapshot, a Wazo version and a set of installed plugins.
+    """
+
+    def __init__(self, items, current_wazo_version, installed_versions):
+        self.current_wazo_version = current_wazo_version
+        self.installed_versions = installed_versions
+        self._plugins = {}
+
+        for item in items:
+            key = item.get('namespace'), item.get('name')
+            installed_version = installed_versions.get(key)
+            versions = item.get('versions', [])
+            upgradable = [
+                is_upgradable(version_info, current_wazo_version, installed_version)
+                for version_info in versions
+            ]
+            self._plugins[key] = versions, installed_version, upgradable
+
+    def get(self, namespace, name):
+        """Returns the installed version and the upgradable field of each version"""
+        if (namespace, name) not in self._plugins:
+            return None
+        _, installed_version, upgradable = self._plugins[(namespace, name)]
+        return installed_version, upgradable
+
+    def upgradable_versions(self, namespace, name):
+        versions, _, upgradable = self._plugins.get((namespace, name), ([], None, []))
+        return [
+            version_info
+            for version_info, upgradable_ in zip(versions, upgradable)
+            if upgradable_
+        ]
+
+
+def is_compatible(version_info, current_wazo_version):
+    min_wazo_version = version_info.get('min_wazo_version', current_wazo_version)
+    max_wazo_version = version_info.get('max_wazo_version', current_wazo_version)
+
+    if version.less_than(current_wazo_version, min_wazo_version):
+        return False
+    if version.less_than(max_wazo_version, current_wazo_version):
+        return False
+    return True
+
+
+def is_upgradable(version_info, current_wazo_version, installed_version):
+    if not is_compatible(version_info, current_wazo_version):
+        return False
+    if installed_version is None:
+        return True
+    return version.less_than(installed_version, version_info.get('version'))
 
 
 class MarketPluginUpdater:
-    def __init__(self, plugin_db, current_wazo_version):
+    def __init__(self, plugin_db, current_wazo_version, market_proxy=None):
         self._plugin_db = plugin_db
         self._current_wazo_version = current_wazo_version
+        self._market_proxy = market_proxy
+        self._upgradability = None
 
     def update(self, plugin_info):
         namespace, name = plugin_info['namespace'], plugin_info['name']
-        plugin = self._plugin_db.get_plugin(namespace, name)
+        versions = plugin_info.get('versions', [])
+
+        local_values = self._get_precomputed_values(namespace, name, versions)
+        if local_values:
+            installed_version, upgradable = local_values
+        else:
+            plugin = self._plugin_db.get_plugin(namespace, name)
+            installed_version = (
+                plugin.metadata()['version'] if plugin.is_installed() else None
+            )
+            upgradable = [
+                is_upgradable(
+                    version_info, self._current_wazo_version, installed_version
+                )
+                for version_info in versions
+            ]
 
-        self._add_installed_version(plugin_info, plugin)
-        self._add_upgradable_field(plugin_info, plugin)
+        plugin_info['installed_version'] = installed_version
+        for version_info, upgradable_ in zip(versions, upgradable):
+            version_info['upgradable'] = upgradable_
 
         return plugin_info
 
-    def _add_installed_version(self, plugin_info, plugin):
-        installed_version = (
-            plugin.metadata()['version'] if plugin.is_installed() else None
-        )
-        plugin_info['installed_version'] = installed_version
+    def upgradable_versions(self, namespace, name):
+        return self._get_upgradability().upgradable_versions(namespace, name)
 
-    def _add_upgradable_field(self, plugin_info, plugin):
-        for version_info in plugin_info.get('versions', []):
-            version_info['upgradable'] = True
+    def _get_precomputed_values(self, namespace, name, versions):
+        if not self._market_proxy:
+            return None
 
-            min_wazo_version = version_info.get(
-                'min_wazo_version', self._current_wazo_version
-            )
-            max_wazo_version = version_info.get(
-                'max_wazo_version', self._current_wazo_version
-            )
-            proposed_version = version_info.get('version')
+        local_values = self._get_upgradability().get(namespace, name)
+        if not local_values or len(local_values[1]) != len(versions):
+            return None
+        return local_values
 
-            if version.less_than(self._current_wazo_version, min_wazo_version):
-                version_info['upgradable'] = False
-            elif version.less_than(max_wazo_version, self._current_wazo_version):
-                version_info['upgradable'] = False
-            elif plugin.is_installed():
-                installed_version = plugin.metadata()['version']
-                if not version.less_than(installed_version, proposed_version):
-                    version_info['upgradable'] = False
+    def _get_upgradability(self):
+        if not self._upgradability:
+            snapshot = self._market_proxy.get_snapshot()
+            installed_versions = self._plugin_db.installed_versions()
+            self._upgradability = snapshot.upgradability(
+                self._current_wazo_version, installed_versions
+            )
+        return self._upgradability
 
 
 class MarketDB:
+
+    # Fields that are not part of the market content and have to be added locally
+    _local_fields = ('installed_version',)
+    # A partial sort is used when the page is this many times smaller than the content
+    _partial_sort_ratio = 4
+
     def __init__(self, market_proxy, current_wazo_version, plugin_db=None):
         self._market_proxy = market_proxy
-        self._updater = MarketPluginUpdater(plugin_db, current_wazo_version)
-
-    def count(self, *args, **kwargs):
-        content = self._market_proxy.get_content()
-        if kwargs.get('filtered', False):
-            filters = self._extract_strict_filters(**kwargs)
-            content = self._strict_filter(content, **filters)
-            content = list(self._filter(content, **kwargs))
-        return len(content)
+        self._plugin_db = plugin_db
+        self._updater = MarketPluginUpdater(
+            plugin_db, current_wazo_version, market_proxy
+        )
 
     def get(self, namespace, name):
         filters = dict(
@@ -132,32 +583,92 @@ class MarketDB:
             name=name,
         )
 
-        content = self._market_proxy.get_content()
-        content = self._add_local_values(content)
+        content = self._market_proxy.get_snapshot().items
         content = self._strict_filter(content, **filters)
 
         if not content:
             raise LookupError('No such plugin {}'.format(filters))
 
-        return content[0]
+        return self._add_local_values(content[:1])[0]
+
+    def upgradable_versions(self, namespace, name):
+        versions = self._updater.upgradable_versions(namespace, name)
+        return copy.deepcopy(versions)
 
     def list_(self, *args, **kwargs):
+        snapshot = self._market_proxy.get_snapshot()
+        content = self._filter_all(snapshot, **kwargs)
+        content = self._sort(snapshot, content, **kwargs)
+        content = self._paginate(content, **kwargs)
+
+        if not self._uses_local_values(**kwargs):
+            content = self._add_local_values(content)
+        return content
+
+    def query(self, *args, **kwargs):
+        """Lists the market content for the HTTP API
+
+        The items, the total and the filtered count are computed in a single pass on the
+        market content. The items are validated with the MarketListResultSchema.
+        """
+        snapshot = self._market_proxy.get_snapshot()
+        content = self._filter_all(snapshot, **kwargs)
+        filtered = len(content)
+        content = self._sort(snapshot, content, **kwargs)
+        content = self._paginate(content, **kwargs)
+
+        if self._uses_local_values(**kwargs):
+            items = MarketListResultSchema().load(content, many=True)
+        else:
+            rows = [snapshot.result_row(metadata) for metadata in content]
+            items = self._add_local_values(rows)
+
+        return {
+            'items': items,
+            'total': len(snapshot.items),
+            'filtered': filtered,
+            'stale': snapshot.stale,
+        }
+
+    def _filter_all(self, snapshot, installed=None, **kwargs):
         filters = self._extract_strict_filters(**kwargs)
+        local_filters = {
+            key: filters.pop(key) for key in self._local_fields if key in filters
+        }
 
-        content = self._market_proxy.get_content()
-        content = self._add_local_values(content)
+        content = self._filter(snapshot, **kwargs)
         content = self._strict_filter(content, **filters)
-        content = self._filter(content, **kwargs)
-        content = self._sort(content, **kwargs)
-        content = self._paginate(content, **kwargs)
+        content = self._installed_filter(content, installed)
 
+        if self._uses_local_values(**kwargs):
+            content = self._add_local_values(content)
+            content = self._strict_filter(content, **local_filters)
         return content
 
+    def _uses_local_values(self, order=None, **kwargs):
+        if order in self._local_fields:
+            return True
+        return any(field in kwargs for field in self._local_fields)
+
     def _add_local_values(self, content):
+        # The content is shared with other requests by the market cache
+        content = copy.deepcopy(content)
         for metadata in content:
             self._updater.update(metadata)
         return content
 
+    def _installed_filter(self, content, installed):
+        if installed is None:
+            return content
+
+        installed_plugins = self._plugin_db.installed_plugins()
+
+        def match(metadata):
+            key = metadata.get('namespace'), metadata.get('name')
+            return (key in installed_plugins) == installed
+
+        return [metadata for metadata in content if match(metadata)]
+
     @staticmethod
     def _extract_strict_filters(
         filtered=None,
@@ -169,41 +680,50 @@ class MarketDB:
         installed=None,
         **kwargs
     ):
-        if installed is not None and 'installed_version' not in kwargs:
-            kwargs['installed_version'] = InstalledVersionMatcher(installed)
         return kwargs
 
     @staticmethod
-    def _filter(content, search=None, **kwargs):
+    def _filter(snapshot, search=None, **kwargs):
         if not search:
-            return content
-
-        def f(item):
-            for v in item.values():
-                if iin(search, v):
-                    return True
-                if not isinstance(v, (list, tuple)):
-                    continue
-                for element in v:
-                    if iin(search, element):
-                        return True
-            return False
-
-        return filter(f, content)
+            return snapshot.items
+        return snapshot.search_index.search(search)
 
     @staticmethod
     def _paginate(content, limit=None, offset=0, **kwargs):
         end = limit + offset if limit else None
         return content[offset:end]
 
-    @staticmethod
-    def _sort(content, order=None, direction=None, **kwargs):
+    def _sort(
+        self,
+        snapshot,
+        content,
+        order=None,
+        direction=None,
+        limit=None,
+        offset=0,
+        **kwargs
+    ):
         reverse = direction == 'desc'
 
+        sort_keys = None
+        if not self._uses_local_values(order=order, **kwargs):
+            sort_keys = snapshot.sort_keys(order)
+
         def key(element):
-            return element.get(order, LAST_ITEM)
+            if sort_keys is None:
+                return element.get(order, LAST_ITEM)
+            return sort_keys[id(element)]
 
         try:
+            if (
+                sort_keys is not None
+                and limit
+                and (limit + offset) * self._partial_sort_ratio < len(content)
+            ):
+                # only the first items of the page are sorted, the indexed keys are
+                # totally ordered so ties and errors are the same as with sorted
+                select = heapq.nlargest if reverse else heapq.nsmallest
+                return select(limit + offset, content, key=key)
             return sorted(content, key=key, reverse=reverse)
         except TypeError:
             raise InvalidSortParamException(order)
@@ -220,38 +740,115 @@ class MarketDB:
 
 
 class PluginDB:
+    """The PluginDB keeps an index of the installed plugins
+
+    The index is rebuilt when the dpkg status file changes and the metadata of a plugin
+    is only parsed again when its metadata file changes.
+    """
+
     def __init__(self, config):
         self._config = config
         self._debian_package_section = config['debian_package_section']
-        self._debian_package_db = debian.PackageDB()
+        self._dpkg_status_file = config['dpkg_status_file']
+        self._debian_package_db = debian.PackageDB(
+            debian.DpkgStatusReader(
+                self._dpkg_status_file, self._debian_package_section
+            )
+        )
+        self._dpkg_status_mtime = None
+        self._debian_packages = []
+        self._index = {}
+        self._index_lock = Lock()
 
     def count(self):
-        return len(self.list_())
+        return len(self._get_index())
 
     def get_plugin(self, namespace, name):
-        return Plugin(self._config, namespace, name)
+        entry = self._get_index().get((namespace, name))
+        metadata = entry[1] if entry else None
+        return Plugin(self._config, namespace, name, metadata=metadata)
 
     def is_installed(self, namespace, name, version=None):
-        return Plugin(self._config, namespace, name).is_installed(version)
+        return self.get_plugin(namespace, name).is_installed(version)
+
+    def installed_plugins(self):
+        return set(self._get_index())
+
+    def installed_versions(self):
+        return {
+            key: metadata.get('version')
+            for key, (_, metadata) in self._get_index().items()
+        }
 
     def list_(self):
-        result = []
-        debian_packages = self._debian_package_db.list_installed_packages(
-            self._debian_package_section
-        )
-        for debian_package in debian_packages:
-            try:
-                plugin = Plugin.from_debian_package(self._config, debian_package)
-                result.append(plugin.metadata())
-            except (IOError, InvalidPackageNameException):
-                logger.info(
-                    'no metadata file found for %s/%s', plugin.namespace, plugin.name
+        return [metadata for _, metadata in self._get_index().values()]
+
+    def _get_index(self):
+        with self._index_lock:
+            mtime = _get_mtime(self._dpkg_status_file)
+            if mtime is None or mtime != self._dpkg_status_mtime:
+                self._debian_packages = list(
+                    self._debian_package_db.list_installed_packages(
+                        self._debian_package_section
+                    )
                 )
-        return result
+                self._dpkg_status_mtime = mtime
+
+            index = {}
+            for debian_package in self._debian_packages:
+                try:
+                    plugin = Plugin.from_debian_package(self._config, debian_package)
+                except InvalidPackageNameException:
+                    logger.info('invalid plugin package name %s', debian_package)
+                    continue
+
+                key = plugin.namespace, plugin.name
+                entry = self._index.get(key)
+                metadata_mtime = _get_mtime(plugin.metadata_filename)
+                if not entry or entry[0] != metadata_mtime:
+                    entry = self._load_metadata(plugin, metadata_mtime)
+                if entry:
+                    index[key] = entry
+
+            self._index = index
+            return index
+
+    @staticmethod
+    def _load_metadata(plugin, mtime):
+        try:
+            metadata = plugin.metadata()
+        except IOError:
+            logger.info(
+                'no metadata file found for %s/%s', plugin.namespace, plugin.name
+            )
+            return
+        if metadata is None:
+            return
+        return mtime, metadata
+
+
+_plugin_db = None
+_plugin_db_lock = Lock()
+
+
+def get_plugin_db(config):
+    global _plugin_db
+    with _plugin_db_lock:
+        if not _plugin_db:
+            logger.debug('Creating a new plugin db...')
+            _plugin_db = PluginDB(config)
+    return _plugin_db
+
+
+def _get_mtime(filename):
+    try:
+        return os.stat(filename).st_mtime_ns
+    except OSError:
+        return None
 
 
 class Plugin:
-    def __init__(self, config, namespace, name):
+    def __init__(self, config, namespace, name, metadata=None):
         self.namespace = namespace
         self.name = name
         self.debian_package_name = '{}-{}-{}'.format(
@@ -263,7 +860,7 @@ class Plugin:
             self.name,
             config['default_metadata_filename'],
         )
-        self._metadata = None
+        self._metadata = metadata
 
     def is_installed(self, version=None):
         try:
@@ -302,15 +899,3 @@ class Plugin:
             package_name_prefix, debian_package_name
         )
         return cls(config, namespace, name)
-
-
-class InstalledVersionMatcher:
-    def __init__(self, installed):
-        self._installed = installed
-
-    def __eq__(self, other):
-        is_installed = other is not None
-        return is_installed == self._installed
-
-    def __ne__(self, other):
-        return not self == other
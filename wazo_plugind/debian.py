@@ -1,21 +1,98 @@
 # Copyright 2017-2020 The Wazo Authors  (see the AUTHORS file)
 # SPDX-License-Identifier: GPL-3.0-or-later
 
+import mmap
 import os
-import subprocess
 import logging
+import re
 import jinja2
+from threading import Lock
 
 logger = logging.getLogger(__name__)
 
+_DPKG_STATUS_FILE = '/var/lib/dpkg/status'
 
-class PackageDB:
 
-    _package_and_section_format = "${binary:Package} ${Section}\n"
+class DpkgStatusReader:
+    """Generates "<package> <section>" lines from the dpkg status database
+
+    The status file is read without spawning dpkg-query. When a section is given, only
+    the packages of that section are parsed. The result is kept until the status file
+    is modified.
+    """
+
+    _field_pattern = re.compile(rb'^(Package|Section|Status): (.*)$', re.MULTILINE)
+    _not_installed_states = (b'not-installed', b'config-files')
+
+    def __init__(self, status_file=_DPKG_STATUS_FILE, section=None):
+        self._status_file = status_file
+        self._section = section
+        self._mtime = None
+        self._lines = []
+        self._lock = Lock()
+
+    def __call__(self):
+        with self._lock:
+            try:
+                mtime = os.stat(self._status_file).st_mtime_ns
+            except OSError as e:
+                logger.info('cannot read the dpkg status file: %s', e)
+                return iter([])
+
+            if mtime != self._mtime:
+                self._lines = self._read()
+                self._mtime = mtime
+
+            return iter(self._lines)
+
+    def _read(self):
+        with open(self._status_file, 'rb') as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return []
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as status:
+                return [line for line in self._scan(status) if line]
+
+    def _scan(self, status):
+        if not self._section:
+            start = 0
+            while start < len(status):
+                end = self._stanza_end(status, start)
+                yield self._parse(status[start:end])
+                start = end + 2
+            return
+
+        needle = '\nSection: {}\n'.format(self._section).encode('utf-8')
+        position = status.find(needle)
+        while position != -1:
+            start = status.rfind(b'\n\n', 0, position)
+            start = 0 if start == -1 else start + 2
+            end = self._stanza_end(status, position)
+            yield self._parse(status[start:end])
+            position = status.find(needle, end)
+
+    @staticmethod
+    def _stanza_end(status, position):
+        end = status.find(b'\n\n', position)
+        return len(status) if end == -1 else end
+
+    def _parse(self, stanza):
+        fields = dict(self._field_pattern.findall(stanza))
+        package = fields.get(b'Package')
+        if not package:
+            return
+
+        state = fields.get(b'Status', b'').rpartition(b' ')[2]
+        if state in self._not_installed_states:
+            return
+
+        section = fields.get(b'Section', b'')
+        return '{} {}'.format(package.decode('utf-8'), section.decode('utf-8'))
 
+
+class PackageDB:
     def __init__(self, package_section_generator=None):
         self._package_section_generator = (
-            package_section_generator or self._list_packages
+            package_section_generator or DpkgStatusReader()
         )
 
     def list_installed_packages(self, selected_section=None):
@@ -30,14 +107,6 @@ class PackageDB:
                 continue
             yield debian_package_name
 
-    @classmethod
-    def _list_packages(cls):
-        cmd = ['dpkg-query', '-W', '-f={}'.format(cls._package_and_section_format)]
-        p = subprocess.Popen(cmd, stdout=subprocess.PIPE)
-        out, _ = p.communicate()
-        for line in out.decode('utf-8').split('\n'):
-            yield line
-
 
 class Generator:
 
@@ -69,7 +138,7 @@ class Generator:
             ctx = self._generate_file(ctx, filename)
         return ctx
 
-    def _add_debian_depends_from_depends(self, ctx):
+    def add_debian_depends_from_depends(self, ctx):
         depends = ctx.metadata.get('depends')
         if not isinstance(depends, (list, tuple)):
             return ctx
@@ -89,7 +158,7 @@ class Generator:
         return ctx
 
     def _make_template_ctx(self, ctx):
-        ctx = self._add_debian_depends_from_depends(ctx)
+        ctx = self.add_debian_depends_from_depends(ctx)
         template_context = dict(
             ctx.metadata,
             rules_path=self._generate_rules_path(ctx),
@@ -0,0 +1,165 @@
+# Copyright 2021 The Wazo Authors  (see the AUTHORS file)
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+import logging
+from marshmallow import ValidationError
+from . import db
+from .download import already_satisfied
+from .exceptions import DependencyCycleException
+from .schema import DependencyMetadataSchema
+
+logger = logging.getLogger(__name__)
+
+
+class DependencyPlanner:
+    """The DependencyPlanner computes the installation order of the plugin dependencies
+
+    The dependency graph is built from the metadata of the plugins on the market. The
+    plan is a list of levels, each level only depends on the previous ones. The plugins
+    of a level can be built concurrently.
+    """
+
+    def __init__(self, market_db):
+        self._market_db = market_db
+
+    def plan(self, metadata):
+        root = metadata['namespace'], metadata['name']
+        return self._plan(metadata.get('depends', []), path=[root])
+
+    def plan_all(self, plugins):
+        """Returns the plan of a list of plugins, including the plugins themselves
+
+        The plugins and dependencies shared by more than one plugin are planned once.
+        """
+        return self._plan(plugins, path=[])
+
+    def _plan(self, depends, path):
+        dependencies = {}
+        levels = {}
+
+        def visit(dependency):
+            key = dependency['namespace'], dependency['name']
+            if key in path:
+                start = path.index(key)
+                raise DependencyCycleException(path[start:] + [key])
+
+            if key not in levels:
+                path.append(key)
+                children = self._valid_dependencies(self._get_depends(dependency))
+                child_levels = [visit(child) for child in children]
+                path.pop()
+                dependencies[key] = dependency
+                levels[key] = max(child_levels, default=-1) + 1
+            return levels[key]
+
+        for dependency in self._valid_dependencies(depends):
+            visit(dependency)
+
+        plan = [[] for _ in range(max(levels.values(), default=-1) + 1)]
+        for key, dependency in dependencies.items():
+            plan[levels[key]].append(dependency)
+        return plan
+
+    def install_plan(self, options, reinstall):
+        """Returns the plugins that would be installed for options, dependencies first
+
+        Nothing is downloaded, the versions and dependencies come from the market.
+        """
+        root = dict(options, depends=self._get_depends(options))
+        plan = self.plan(root)
+        dependencies = [(dep, False) for level in plan for dep in level]
+
+        items = []
+        debian_depends = set()
+        apt_get_update = False
+        for dependency, reinstall_ in dependencies + [(options, reinstall)]:
+            item, update = self._plan_item(dependency, reinstall_)
+            items.append(item)
+            debian_depends.update(item['debian_depends'])
+            apt_get_update = apt_get_update or update
+
+        return {
+            'items': items,
+            'total': len(items),
+            'debian_depends': sorted(debian_depends),
+            'apt_get_update': apt_get_update,
+        }
+
+    def _plan_item(self, dependency, reinstall):
+        """Returns the plan of a plugin and if its installation runs apt-get update"""
+        namespace, name = dependency['namespace'], dependency['name']
+        required_version = dependency.get('version')
+        item = {
+            'namespace': namespace,
+            'name': name,
+            'version': None,
+            'installed_version': None,
+            'satisfied': False,
+            'debian_depends': [],
+        }
+
+        try:
+            plugin_info = self._market_db.get(namespace=namespace, name=name)
+        except LookupError:
+            return item, False
+
+        item['installed_version'] = plugin_info.get('installed_version')
+        if already_satisfied(plugin_info, required_version, reinstall):
+            item['satisfied'] = True
+            return item, False
+
+        version_info = self._find_version(plugin_info, required_version)
+        if not version_info:
+            # Nothing to install, the installation would be ignored
+            item['satisfied'] = bool(item['installed_version'])
+            return item, False
+
+        debian_depends = version_info.get(
+            'debian_depends', plugin_info.get('debian_depends')
+        )
+        depends = version_info.get('depends', plugin_info.get('depends'))
+        item['version'] = version_info.get('version')
+        item['debian_depends'] = list(debian_depends or [])
+        # The debian depends generated from the plugin depends also trigger an update
+        return item, bool(debian_depends or depends)
+
+    def _find_version(self, plugin_info, required_version):
+        for version_info in plugin_info.get('versions', []):
+            if not version_info.get('upgradable'):
+                continue
+            if required_version and version_info.get('version') != required_version:
+                continue
+            return version_info
+
+    def _get_depends(self, dependency):
+        try:
+            plugin_info = self._market_db.get(
+                namespace=dependency['namespace'], name=dependency['name']
+            )
+        except LookupError:
+            # The download will fail with a proper error
+            return []
+
+        required_version = dependency.get('version')
+        for version_info in plugin_info.get('versions', []):
+            if required_version and version_info.get('version') != required_version:
+                continue
+            if 'depends' in version_info:
+                return version_info['depends']
+            break
+        return plugin_info.get('depends', [])
+
+    def _valid_dependencies(self, dependencies):
+        for dependency in dependencies or []:
+            try:
+                DependencyMetadataSchema().load(dependency)
+            except ValidationError:
+                logger.info('invalid dependency %s skipping', dependency)
+                continue
+            yield dependency
+
+    @classmethod
+    def from_config(cls, config, current_wazo_version):
+        market_proxy = db.MarketProxy(db.get_market_cache(config))
+        plugin_db = db.get_plugin_db(config)
+        return cls(db.MarketDB(market_proxy, current_wazo_version, plugin_db))
@@ -1,8 +1,13 @@
 # Copyright 2017-2020 The Wazo Authors  (see the AUTHORS file)
 # SPDX-License-Identifier: GPL-3.0-or-later
 
+import hashlib
 import os
 import logging
+import shutil
+import subprocess
+import time
+from threading import Lock
 from marshmallow import ValidationError
 from . import db
 from .exceptions import (
@@ -10,28 +15,179 @@ from .exceptions import (
     UnsupportedDownloadMethod,
     DependencyAlreadyInstalledException,
 )
+from .exceptions import CommandExecutionFailed
 from .helpers import exec_and_log
 from .schema import PluginInstallSchema
-from .db import PluginDB
 
 logger = logging.getLogger(__name__)
 
+_git_cache = None
+_git_cache_lock = Lock()
+
+
+class GitCache:
+    """The GitCache is a process wide cache of bare mirrors of the plugin repositories
+
+    Each repository URL gets its own mirror, that is fetched incrementally before each
+    checkout. Installs of the same repository are serialized by a per repository lock
+    and an install waiting for a fetch done by another one does not fetch again. The
+    least recently used mirrors are removed when the cache grows over `max_size_mb`.
+    """
+
+    def __init__(self, directory, max_size_mb):
+        self._directory = directory
+        self._max_size = max_size_mb * 1024 * 1024
+        self._locks = {}
+        self._fetched_at = {}
+        self._lock = Lock()
+
+    def clone(self, url, ref, filename):
+        mirror = self._mirror_path(url)
+        requested_at = time.monotonic()
+        with self._get_lock(mirror):
+            if self._fetched_at.get(mirror, 0) < requested_at:
+                self._fetch(url, mirror)
+                self._fetched_at[mirror] = time.monotonic()
+            os.utime(mirror)
+            # The file:// URL is required for --depth to apply to a local clone
+            mirror_url = 'file://{}'.format(mirror)
+            _clone(mirror_url, ref, filename)
+
+        self._evict(keep=mirror)
+
+    def _fetch(self, url, mirror):
+        if os.path.isdir(mirror):
+            cmd = ['git', '--git-dir', mirror, 'fetch', '--prune', 'origin']
+            try:
+                exec_and_log(logger.debug, logger.error, cmd)
+                return
+            except CommandExecutionFailed:
+                logger.info('failed to update the mirror of %s, cloning it again', url)
+                shutil.rmtree(mirror, ignore_errors=True)
+
+        os.makedirs(self._directory, exist_ok=True)
+        cmd = ['git', 'clone', '--mirror', url, mirror]
+        try:
+            exec_and_log(logger.debug, logger.error, cmd)
+        except CommandExecutionFailed:
+            shutil.rmtree(mirror, ignore_errors=True)
+            raise
+
+    def _evict(self, keep):
+        mirrors = []
+        for name in os.listdir(self._directory):
+            path = os.path.join(self._directory, name)
+            if path == keep or not os.path.isdir(path):
+                continue
+            mirrors.append((os.stat(path).st_mtime, path))
+
+        total_size = sum(_get_size(path) for _, path in mirrors) + _get_size(keep)
+        for _, path in sorted(mirrors):
+            if total_size <= self._max_size:
+                break
+
+            lock = self._get_lock(path)
+            if not lock.acquire(blocking=False):
+                continue
+            try:
+                size = _get_size(path)
+                logger.debug('removing the git mirror %s (%s bytes)', path, size)
+                shutil.rmtree(path, ignore_errors=True)
+                self._fetched_at.pop(path, None)
+                total_size -= size
+            finally:
+                lock.release()
+
+    def _get_lock(self, mirror):
+        with self._lock:
+            if mirror not in self._locks:
+                self._locks[mirror] = Lock()
+            return self._locks[mirror]
+
+    def _mirror_path(self, url):
+        name = hashlib.sha256(url.encode('utf-8')).hexdigest()
+        return os.path.join(self._directory, '{}.git'.format(name))
+
+    @classmethod
+    def from_config(cls, config):
+        git_cache_config = config['git_cache']
+        return cls(git_cache_config['directory'], git_cache_config['max_size_mb'])
+
+
+def get_git_cache(config):
+    global _git_cache
+    with _git_cache_lock:
+        if not _git_cache:
+            logger.debug('Creating a new git cache...')
+            _git_cache = GitCache.from_config(config)
+    return _git_cache
+
+
+def _clone(url, ref, filename):
+    cmd = ['git', 'clone', '--branch', ref, '--depth', '1', url, filename]
+
+    proc = exec_and_log(logger.debug, logger.error, cmd)
+    if proc.returncode:
+        raise Exception('Download failed {}'.format(url))
+
+
+def _get_commit(filename):
+    cmd = ['git', '-C', filename, 'rev-parse', 'HEAD']
+    try:
+        return subprocess.check_output(cmd).decode('utf-8').strip()
+    except (OSError, subprocess.CalledProcessError):
+        logger.debug('failed to find the commit of %s', filename)
+
+
+def _get_size(path):
+    size = 0
+    for root, _, filenames in os.walk(path):
+        for filename in filenames:
+            try:
+                size += os.lstat(os.path.join(root, filename)).st_size
+            except OSError:
+                continue
+    return size
+
 
 class _GitDownloader:
     def __init__(self, config):
         self._download_dir = config['download_dir']
+        self._git_cache = None
+        if config['git_cache']['enabled']:
+            self._git_cache = get_git_cache(config)
 
     def download(self, ctx):
         url, ref = ctx.install_options['url'], ctx.install_options['ref']
         filename = os.path.join(self._download_dir, ctx.uuid)
 
-        cmd = ['git', 'clone', '--branch', ref, '--depth', '1', url, filename]
+        self._clone(ctx, url, ref, filename)
+        source_commit = _get_commit(filename)
+        return ctx.with_fields(download_path=filename, source_commit=source_commit)
+
+    def _clone(self, ctx, url, ref, filename):
+        if self._git_cache:
+            try:
+                return self._git_cache.clone(url, ref, filename)
+            except (CommandExecutionFailed, OSError):
+                ctx.log(logger.info, 'git cache failed for %s, cloning directly', url)
+                shutil.rmtree(filename, ignore_errors=True)
+
+        _clone(url, ref, filename)
 
-        proc = exec_and_log(logger.debug, logger.error, cmd)
-        if proc.returncode:
-            raise Exception('Download failed {}'.format(url))
 
-        return ctx.with_fields(download_path=filename)
+def already_satisfied(plugin_info, required_version, reinstall):
+    if reinstall:
+        return False
+
+    installed_version = plugin_info.get('installed_version')
+    if not installed_version:
+        return False
+
+    if not required_version:
+        return True
+
+    return installed_version == required_version
 
 
 class _MarketDownloader:
@@ -39,7 +195,6 @@ class _MarketDownloader:
     _defaults = {'method': 'git'}
 
     def __init__(self, config, downloader):
-        self._market_config = config['market']
         self._downloader = downloader
 
     def download(self, ctx):
@@ -70,21 +225,12 @@ class _MarketDownloader:
         return self._downloader.download(ctx)
 
     def _already_satisfied(self, ctx, plugin_info, required_version):
-        if ctx.install_params['reinstall']:
-            return False
-
-        installed_version = plugin_info.get('installed_version')
-        if not installed_version:
-            return False
-
-        if not required_version:
-            return True
-
-        return installed_version == required_version
+        reinstall = ctx.install_params['reinstall']
+        return already_satisfied(plugin_info, required_version, reinstall)
 
     def _find_matching_plugin(self, ctx):
-        plugin_db = PluginDB(ctx.config)
-        market_proxy = db.MarketProxy(self._market_config)
+        plugin_db = db.get_plugin_db(ctx.config)
+        market_proxy = db.MarketProxy(db.get_market_cache(ctx.config))
         market_db = db.MarketDB(market_proxy, ctx.wazo_version, plugin_db)
         required_version = ctx.install_options.get('version')
         search_params = dict(ctx.install_options)
@@ -98,7 +244,7 @@ class _MarketDownloader:
             raise DependencyAlreadyInstalledException()
 
         if not required_version:
-            return self._find_first_upgradable_version(plugin_info)
+            return self._find_first_upgradable_version(market_db, plugin_info)
 
         return self._find_matching_version(plugin_info, required_version)
 
@@ -110,10 +256,12 @@ class _MarketDownloader:
             if version_info.get('version') == required_version:
                 return version_info
 
-    def _find_first_upgradable_version(self, plugin_info):
-        for version_info in plugin_info.get('versions', []):
-            if version_info['upgradable'] is True:
-                return version_info
+    def _find_first_upgradable_version(self, market_db, plugin_info):
+        versions = market_db.upgradable_versions(
+            plugin_info['namespace'], plugin_info['name']
+        )
+        for version_info in versions:
+            return version_info
 
 
 class _UndefinedDownloader:
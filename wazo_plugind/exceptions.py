@@ -5,9 +5,10 @@ from xivo.rest_api_helpers import APIException
 
 
 class CommandExecutionFailed(Exception):
-    def __init__(self, command, return_code):
+    def __init__(self, command, return_code, output_tail=None):
         self._command = command
         self._return_code = return_code
+        self.output_tail = output_tail or []
 
     def __str__(self):
         return '{} returned {}'.format(self._command, self._return_code)
@@ -108,6 +109,17 @@ class InvalidInstallQueryStringException(APIException, _MarshmallowDetailFormatt
         )
 
 
+class InvalidJobLogQueryStringException(APIException, _MarshmallowDetailFormatter):
+    def __init__(self, errors):
+        super().__init__(
+            status_code=400,
+            message='Invalid data',
+            error_id='invalid-data',
+            resource='jobs',
+            details=self.format_details(errors),
+        )
+
+
 class PluginValidationException(Exception, _MarshmallowDetailFormatter):
 
     error_id = 'validation-error'
@@ -118,6 +130,33 @@ class PluginValidationException(Exception, _MarshmallowDetailFormatter):
         self.details = self.format_details(errors)
 
 
+class DependencyCycleException(PluginValidationException):
+
+    error_id = 'dependency-cycle'
+    message = 'Dependency cycle'
+
+    def __init__(self, cycle):
+        names = ['{}/{}'.format(namespace, name) for namespace, name in cycle]
+        self.details = {
+            'depends': {
+                'constraint_id': 'acyclic',
+                'message': 'dependency cycle: {}'.format(' -> '.join(names)),
+                'cycle': names,
+            }
+        }
+
+
+class InvalidInstallPlanException(APIException):
+    def __init__(self, validation_error):
+        super().__init__(
+            status_code=400,
+            message=validation_error.message,
+            error_id=validation_error.error_id,
+            resource='plugins',
+            details=validation_error.details,
+        )
+
+
 class PluginNotFoundException(APIException):
     def __init__(self, namespace, name):
         super().__init__(
@@ -129,6 +168,58 @@ class PluginNotFoundException(APIException):
         )
 
 
+class JobQueueFullException(APIException):
+    def __init__(self):
+        super().__init__(
+            status_code=503,
+            message='Too many jobs are waiting, retry later',
+            error_id='job-queue-full',
+            resource='plugins',
+            details={},
+        )
+
+
+class JobNotFoundException(APIException):
+    def __init__(self, uuid):
+        super().__init__(
+            status_code=404,
+            message='Job not found {}'.format(uuid),
+            error_id='job-not-found',
+            resource='jobs',
+            details={'uuid': str(uuid)},
+        )
+
+
+class PluginVersionNotFoundException(APIException):
+    def __init__(self, namespace, name, version):
+        super().__init__(
+            status_code=404,
+            message='Plugin version not found {}/{} {}'.format(
+                namespace, name, version
+            ),
+            error_id='plugin-version-not-found',
+            resource='plugins',
+            details={'name': name, 'namespace': namespace, 'version': version},
+        )
+
+
+class IncompatiblePluginException(APIException):
+    def __init__(self, namespace, name, wazo_version):
+        super().__init__(
+            status_code=400,
+            message='No version of {}/{} is compatible with Wazo {}'.format(
+                namespace, name, wazo_version
+            ),
+            error_id='incompatible-plugin',
+            resource='plugins',
+            details={
+                'name': name,
+                'namespace': namespace,
+                'wazo_version': wazo_version,
+            },
+        )
+
+
 class PluginAlreadyInstalled(Exception):
 
     _fmt = '{}/{} is already installed'
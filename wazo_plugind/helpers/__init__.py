@@ -4,6 +4,9 @@
 import logging
 import os
 import subprocess
+from collections import deque
+from contextlib import contextmanager
+from threading import Lock, Thread
 from wazo_auth_client import Client as AuthClient
 from wazo_confd_client import Client as ConfdClient
 from xivo.token_renewer import TokenRenewer
@@ -15,21 +18,80 @@ _DEFAULT_PLUGIN_FORMAT_VERSION = 0
 logger = logging.getLogger(__name__)
 
 
-def exec_and_log(stdout_logger, stderr_logger, *args, **kwargs):
-    p = subprocess.Popen(
-        *args, stdout=subprocess.PIPE, stderr=subprocess.PIPE, **kwargs
-    )
-    out, err = p.communicate()
+def exec_and_log(stdout_logger, stderr_logger, *args, log_filename=None, **kwargs):
+    """Executes a command and logs its output as it is produced
+
+    The complete output is appended to log_filename. Only the last lines are kept in
+    memory, they are available on the CommandExecutionFailed exception.
+    """
     cmd = ' '.join(args[0])
-    if out:
-        stdout_logger('%s\n==== STDOUT ====\n%s==== END ====', cmd, out.decode('utf8'))
-    if err:
-        stdout_logger('%s\n==== STDERR====\n%s==== END ====', cmd, err.decode('utf8'))
+    output = _CommandOutput(stdout_logger)
+    stdout_logger('executing %s', cmd)
+    with _open_log_file(log_filename) as log_file:
+        if log_file:
+            log_file.write('$ {}\n'.format(cmd).encode('utf8'))
+        output.log_file = log_file
+        p = subprocess.Popen(
+            *args, stdout=subprocess.PIPE, stderr=subprocess.PIPE, **kwargs
+        )
+        readers = [
+            Thread(target=output.read, args=(p.stdout, 'STDOUT')),
+            Thread(target=output.read, args=(p.stderr, 'STDERR')),
+        ]
+        for reader in readers:
+            reader.start()
+        for reader in readers:
+            reader.join()
+        p.wait()
+
     if p.returncode != 0:
-        raise CommandExecutionFailed(args[0], p.returncode)
+        raise CommandExecutionFailed(args[0], p.returncode, list(output.tail))
     return p
 
 
+class _CommandOutput:
+
+    tail_size = 50
+    max_line_size = 64 * 1024
+
+    def __init__(self, logger):
+        self.log_file = None
+        self.tail = deque(maxlen=self.tail_size)
+        self._logger = logger
+        self._lock = Lock()
+
+    def read(self, pipe, name):
+        with pipe:
+            for line in iter(lambda: pipe.readline(self.max_line_size), b''):
+                self._write(name, line)
+
+    def _write(self, name, line):
+        decoded = line.decode('utf8', errors='replace').rstrip('\n')
+        self._logger('%s: %s', name, decoded)
+        with self._lock:
+            self.tail.append(decoded)
+            if self.log_file:
+                self.log_file.write(line)
+
+
+@contextmanager
+def _open_log_file(filename):
+    if not filename:
+        yield None
+        return
+
+    try:
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        log_file = open(filename, 'ab')
+    except OSError as e:
+        logger.info('cannot write the command output to %s: %s', filename, e)
+        yield None
+        return
+
+    with log_file:
+        yield log_file
+
+
 class WazoVersionFinder:
     def __init__(self, config):
         self._token = None
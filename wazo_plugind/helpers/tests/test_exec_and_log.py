@@ -0,0 +1,63 @@
+# Copyright 2021 The Wazo Authors  (see the AUTHORS file)
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+import os
+import tempfile
+
+from hamcrest import assert_that, contains, equal_to, has_item, has_length
+from mock import Mock
+from unittest import TestCase
+
+from wazo_plugind.exceptions import CommandExecutionFailed
+
+from .. import exec_and_log
+
+
+class TestExecAndLog(TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.log_filename = os.path.join(self.tmp_dir.name, 'jobs', 'job.log')
+        self.stdout_logger = Mock()
+        self.stderr_logger = Mock()
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_that_the_output_is_logged_and_written_to_the_log_file(self):
+        cmd = ['sh', '-c', 'echo out; echo err >&2']
+
+        exec_and_log(
+            self.stdout_logger, self.stderr_logger, cmd, log_filename=self.log_filename
+        )
+
+        logged = [args for args, _ in self.stdout_logger.call_args_list]
+        assert_that(logged, has_item(('%s: %s', 'STDOUT', 'out')))
+        assert_that(logged, has_item(('%s: %s', 'STDERR', 'err')))
+        with open(self.log_filename) as f:
+            lines = f.read().splitlines()
+        assert_that(lines[0], equal_to('$ sh -c echo out; echo err >&2'))
+        assert_that(sorted(lines[1:]), contains('err', 'out'))
+
+    def test_that_only_the_tail_of_the_output_is_kept_on_failure(self):
+        cmd = ['sh', '-c', 'seq 1 100; exit 2']
+
+        try:
+            exec_and_log(
+                self.stdout_logger,
+                self.stderr_logger,
+                cmd,
+                log_filename=self.log_filename,
+            )
+        except CommandExecutionFailed as e:
+            assert_that(e.output_tail, has_length(50))
+            assert_that(e.output_tail[-1], equal_to('100'))
+        else:
+            self.fail('CommandExecutionFailed not raised')
+
+        with open(self.log_filename) as f:
+            assert_that(f.read().splitlines(), has_length(101))
+
+    def test_without_a_log_file(self):
+        p = exec_and_log(self.stdout_logger, self.stderr_logger, ['true'])
+
+        assert_that(p.returncode, equal_to(0))
@@ -1,4 +1,4 @@
-# Copyright 2018-2020 The Wazo Authors  (see the AUTHORS file)
+# Copyright 2018-2021 The Wazo Authors  (see the AUTHORS file)
 # SPDX-License-Identifier: GPL-3.0-or-later
 
 from hamcrest import (
@@ -20,3 +20,13 @@ class TestLessThan(TestCase):
         assert_that(version.less_than('1.0.0', '1.0.0-1'), equal_to(True))
         assert_that(version.less_than('1.0.1', '1.0.0-1'), equal_to(False))
         assert_that(version.less_than('1.0.0-2', '1.0.0-10'), equal_to(True))
+
+    def test_that_versions_are_parsed_once(self):
+        version._make_comparable_version.cache_clear()
+
+        version.less_than('21.01', '21.02')
+        version.less_than('21.01', '21.02')
+
+        info = version._make_comparable_version.cache_info()
+        assert_that(info.misses, equal_to(2))
+        assert_that(info.hits, equal_to(2))
@@ -5,7 +5,7 @@ import logging
 import re
 
 from marshmallow import ValidationError
-from wazo_plugind.db import PluginDB
+from wazo_plugind.db import get_plugin_db
 from wazo_plugind.schema import PluginMetadataSchema as _PluginMetadataSchema
 from wazo_plugind.exceptions import (
     PluginAlreadyInstalled,
@@ -53,5 +53,5 @@ class Validator:
 
     @classmethod
     def new_from_config(cls, config, current_wazo_version, install_params):
-        plugin_db = PluginDB(config)
+        plugin_db = get_plugin_db(config)
         return cls(plugin_db, current_wazo_version, install_params)
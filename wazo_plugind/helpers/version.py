@@ -1,7 +1,8 @@
-# Copyright 2018 The Wazo Authors  (see the AUTHORS file)
+# Copyright 2018-2021 The Wazo Authors  (see the AUTHORS file)
 # SPDX-License-Identifier: GPL-3.0-or-later
 
 from distutils.version import LooseVersion
+from functools import lru_cache
 
 
 def less_than(left, right):
@@ -16,6 +17,7 @@ def less_than(left, right):
     return left < right
 
 
+@lru_cache(maxsize=4096)
 def _make_comparable_version(version):
     try:
         value_tmp = LooseVersion(version)
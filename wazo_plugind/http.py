@@ -2,10 +2,11 @@
 # SPDX-License-Identifier: GPL-3.0-or-later
 
 import logging
+import os
 import requests
 import yaml
 
-from flask import Flask, make_response, request
+from flask import Flask, Response, make_response, request, send_file
 from flask_cors import CORS
 from flask_restful import Api, Resource
 from marshmallow import ValidationError
@@ -17,14 +18,17 @@ from xivo.rest_api_helpers import handle_api_exception
 from werkzeug.local import LocalProxy as Proxy
 
 from .schema import (
+    JobLogQueryStringSchema,
     MarketListRequestSchema,
-    MarketListResultSchema,
+    PluginBulkInstallSchema,
+    PluginInstallPlanSchema,
     PluginInstallQueryStringSchema,
     PluginInstallSchema,
 )
 from .exceptions import (
     InvalidInstallParamException,
     InvalidInstallQueryStringException,
+    InvalidJobLogQueryStringException,
     InvalidListParamException,
     MarketNotFoundException,
     NotInitializedException,
@@ -98,6 +102,68 @@ class Config(_AuthentificatedResource):
         super().add_resource(api, *args, **kwargs)
 
 
+class Jobs(_AuthentificatedResource):
+
+    api_path = '/jobs'
+
+    @required_master_tenant()
+    @required_acl('plugind.jobs.read')
+    def get(self):
+        items = self.plugin_service.list_jobs()
+        return {'items': items, 'total': len(items)}
+
+    @classmethod
+    def add_resource(cls, api, *args, **kwargs):
+        cls.plugin_service = kwargs['plugin_service']
+        super().add_resource(api, *args, **kwargs)
+
+
+class JobsItem(_AuthentificatedResource):
+
+    api_path = '/jobs/<uuid:uuid>'
+
+    @required_master_tenant()
+    @required_acl('plugind.jobs.{uuid}.read')
+    def get(self, uuid):
+        return self.plugin_service.get_job(str(uuid))
+
+    @classmethod
+    def add_resource(cls, api, *args, **kwargs):
+        cls.plugin_service = kwargs['plugin_service']
+        super().add_resource(api, *args, **kwargs)
+
+
+class JobsItemLog(_AuthentificatedResource):
+
+    api_path = '/jobs/<uuid:uuid>/log'
+
+    @required_master_tenant()
+    @required_acl('plugind.jobs.{uuid}.log.read')
+    def get(self, uuid):
+        try:
+            params = JobLogQueryStringSchema().load(request.args)
+        except ValidationError as e:
+            raise InvalidJobLogQueryStringException(e.messages)
+
+        uuid = str(uuid)
+        filename = self.plugin_service.get_job_log(uuid)
+        if not params['follow']:
+            return send_file(filename, mimetype='text/plain', conditional=True)
+
+        offset = 0
+        if request.range:
+            range_ = request.range.range_for_length(os.path.getsize(filename))
+            if range_:
+                offset, _ = range_
+        content = self.plugin_service.follow_job_log(uuid, offset)
+        return Response(content, mimetype='text/plain', direct_passthrough=True)
+
+    @classmethod
+    def add_resource(cls, api, *args, **kwargs):
+        cls.plugin_service = kwargs['plugin_service']
+        super().add_resource(api, *args, **kwargs)
+
+
 class Market(_AuthentificatedResource):
 
     api_path = '/market'
@@ -117,19 +183,25 @@ class Market(_AuthentificatedResource):
 
         market_proxy = self.plugin_service.new_market_proxy()
         try:
-            plugin_list = self.plugin_service.list_from_market(
-                market_proxy, **list_params
-            )
-        except requests.exceptions.ConnectionError:
+            return self.plugin_service.query_market(market_proxy, **list_params)
+        except requests.exceptions.RequestException:
             raise MarketNotFoundException
-        items = MarketListResultSchema().load(plugin_list, many=True)
-        return {
-            'items': items,
-            'total': self.plugin_service.count_from_market(market_proxy, **list_params),
-            'filtered': self.plugin_service.count_from_market(
-                market_proxy, filtered=True, **list_params
-            ),
-        }
+
+    @classmethod
+    def add_resource(cls, api, *args, **kwargs):
+        cls.plugin_service = kwargs['plugin_service']
+        super().add_resource(api, *args, **kwargs)
+
+
+class MarketCache(_AuthentificatedResource):
+
+    api_path = '/market/cache'
+
+    @required_master_tenant()
+    @required_acl('plugind.market.cache.delete')
+    def delete(self):
+        self.plugin_service.invalidate_market_cache()
+        return '', 204
 
     @classmethod
     def add_resource(cls, api, *args, **kwargs):
@@ -145,7 +217,10 @@ class MarketItem(_AuthentificatedResource):
     @required_acl('plugind.market.read')
     def get(self, namespace, name):
         market_proxy = self.plugin_service.new_market_proxy()
-        return self.plugin_service.get_from_market(market_proxy, namespace, name)
+        try:
+            return self.plugin_service.get_from_market(market_proxy, namespace, name)
+        except requests.exceptions.RequestException:
+            raise MarketNotFoundException
 
     @classmethod
     def add_resource(cls, api, *args, **kwargs):
@@ -188,6 +263,60 @@ class Plugins(_AuthentificatedResource):
         super().add_resource(api, *args, **kwargs)
 
 
+class PluginsBulk(_AuthentificatedResource):
+
+    api_path = '/plugins/bulk'
+
+    @required_master_tenant()
+    @required_acl('plugind.plugins.create')
+    def post(self):
+        try:
+            body = PluginBulkInstallSchema().load(request.get_json())
+        except ValidationError as e:
+            raise InvalidInstallParamException(e.messages)
+
+        try:
+            params = PluginInstallQueryStringSchema().load(request.args)
+        except ValidationError as e:
+            raise InvalidInstallQueryStringException(e.messages)
+
+        return self.plugin_service.create_bulk(body['plugins'], params)
+
+    @classmethod
+    def add_resource(cls, api, *args, **kwargs):
+        cls.plugin_service = kwargs['plugin_service']
+        super().add_resource(api, *args, **kwargs)
+
+
+class PluginsPlan(_AuthentificatedResource):
+
+    api_path = '/plugins/plan'
+
+    @required_master_tenant()
+    @required_acl('plugind.plugins.plan.create')
+    def post(self):
+        try:
+            body = PluginInstallPlanSchema().load(request.get_json())
+        except ValidationError as e:
+            raise InvalidInstallParamException(e.messages)
+
+        try:
+            params = PluginInstallQueryStringSchema().load(request.args)
+        except ValidationError as e:
+            raise InvalidInstallQueryStringException(e.messages)
+
+        market_proxy = self.plugin_service.new_market_proxy()
+        try:
+            return self.plugin_service.plan(market_proxy, body['options'], params)
+        except requests.exceptions.RequestException:
+            raise MarketNotFoundException
+
+    @classmethod
+    def add_resource(cls, api, *args, **kwargs):
+        cls.plugin_service = kwargs['plugin_service']
+        super().add_resource(api, *args, **kwargs)
+
+
 class PluginsItem(_AuthentificatedResource):
 
     api_path = '/plugins/<namespace>/<name>'
@@ -266,8 +395,14 @@ def new_app(config, *args, **kwargs):
     )
     MultiAPI(APIv02).add_resource(Swagger)
     MultiAPI(APIv02).add_resource(Config)
+    MultiAPI(APIv02).add_resource(Jobs)
+    MultiAPI(APIv02).add_resource(JobsItem)
+    MultiAPI(APIv02).add_resource(JobsItemLog)
     MultiAPI(APIv02).add_resource(Market)
+    MultiAPI(APIv02).add_resource(MarketCache)
     MultiAPI(APIv02).add_resource(MarketItem)
+    MultiAPI(APIv02).add_resource(PluginsBulk)
+    MultiAPI(APIv02).add_resource(PluginsPlan)
     MultiAPI(APIv02).add_resource(PluginsItem)
     MultiAPI(APIv02).add_resource(Plugins)
 
@@ -0,0 +1,121 @@
+# Copyright 2021 The Wazo Authors  (see the AUTHORS file)
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+import logging
+import os
+import time
+from datetime import datetime
+from threading import Lock
+
+from .exceptions import JobNotFoundException
+
+logger = logging.getLogger(__name__)
+
+_job_log_store = None
+_job_log_store_lock = Lock()
+
+
+class JobLogStore:
+    """The JobLogStore keeps a log file for each install and uninstall job
+
+    The log of a job contains its steps and the output of the commands it executed.
+    Only the `max_files` most recent logs are kept.
+    """
+
+    _suffix = '.log'
+    _chunk_size = 64 * 1024
+    _follow_interval = 0.5
+
+    def __init__(self, directory, max_files, follow_timeout):
+        self._directory = directory
+        self._max_files = max_files
+        self._follow_timeout = follow_timeout
+
+    def filename(self, uuid):
+        return os.path.join(self._directory, '{}{}'.format(uuid, self._suffix))
+
+    def get_filename(self, uuid):
+        filename = self.filename(uuid)
+        if not os.path.isfile(filename):
+            raise JobNotFoundException(uuid)
+        return filename
+
+    def write(self, uuid, msg, *args):
+        line = '{} {}\n'.format(datetime.now().isoformat(), msg % args)
+        try:
+            os.makedirs(self._directory, exist_ok=True)
+            with open(self.filename(uuid), 'ab') as f:
+                f.write(line.encode('utf8'))
+        except OSError as e:
+            logger.info('[%s] cannot write the job log: %s', uuid, e)
+
+    def follow(self, uuid, offset=0, is_active=None):
+        """Returns the content of the log from offset and new content as it is written
+
+        The content stops at the end of the log once is_active returns False, or when
+        nothing was written for `follow_timeout` seconds.
+        """
+        f = open(self.get_filename(uuid), 'rb')
+        f.seek(offset)
+        return self._follow(f, is_active or (lambda: True))
+
+    def _follow(self, f, is_active):
+        with f:
+            written_at = time.monotonic()
+            while True:
+                active = is_active()
+                data = f.read(self._chunk_size)
+                if data:
+                    written_at = time.monotonic()
+                    yield data
+                    continue
+
+                if not active:
+                    return
+                if time.monotonic() - written_at >= self._follow_timeout:
+                    return
+                time.sleep(self._follow_interval)
+
+    def prune(self):
+        try:
+            names = [
+                name
+                for name in os.listdir(self._directory)
+                if name.endswith(self._suffix)
+            ]
+        except OSError:
+            return
+
+        logs = []
+        for name in names:
+            path = os.path.join(self._directory, name)
+            try:
+                logs.append((os.stat(path).st_mtime, path))
+            except FileNotFoundError:
+                continue
+
+        start = self._max_files
+        for _, path in sorted(logs, reverse=True)[start:]:
+            logger.debug('removing the job log %s', path)
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                continue
+
+    @classmethod
+    def from_config(cls, config):
+        store_config = config['job_log']
+        return cls(
+            store_config['directory'],
+            store_config['max_files'],
+            store_config['follow_timeout'],
+        )
+
+
+def get_job_log_store(config):
+    global _job_log_store
+    with _job_log_store_lock:
+        if not _job_log_store:
+            logger.debug('Creating a new job log store...')
+            _job_log_store = JobLogStore.from_config(config)
+    return _job_log_store
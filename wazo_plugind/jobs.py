@@ -0,0 +1,301 @@
+# Copyright 2021 The Wazo Authors  (see the AUTHORS file)
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+import logging
+import time
+from collections import defaultdict, deque
+from datetime import datetime, timezone
+from threading import Event, Lock
+
+from .exceptions import JobNotFoundException
+
+logger = logging.getLogger(__name__)
+
+_job_registry = None
+_job_registry_lock = Lock()
+
+_END_STATUSES = ('completed', 'error')
+
+
+class JobRegistry:
+    """The JobRegistry keeps the state and the step timings of the install and uninstall jobs
+
+    Jobs are registered when they are queued and follow the statuses published for them.
+    A step is queued when it is published and starts when its stage allows it. Only the
+    `history_size` most recently finished jobs are kept.
+
+    Installations are identified by a key, see `install_key`, and an installation
+    identical to a running one joins it instead of running again. The owner of a job is
+    the job whose thread runs it, a job waiting for another one blocks its owner. Only
+    the jobs whose owner has started are joined, a queued job may wait for the thread of
+    a job that waits for it.
+    """
+
+    def __init__(self, history_size):
+        self._lock = Lock()
+        self._active = {}
+        self._history = deque(maxlen=history_size)
+        self._keys = {}
+        self._waits = defaultdict(list)
+
+    def queue(self, uuid, type_, key=None, owner=None, **fields):
+        """Registers a queued job and returns its uuid
+
+        If an identical job is running, nothing is registered and the uuid of the running
+        job is returned.
+        """
+        with self._lock:
+            running = self._running(key)
+            if running:
+                return running
+            self._register(uuid, type_, key, owner, fields)
+            return uuid
+
+    def join(self, uuid, key, parent, **fields):
+        """Registers a dependency of parent, or returns the uuid of an identical job
+
+        The identical job is not joined if its owner has not started yet or if it is
+        waiting, directly or not, for the owner of parent. The dependency is then
+        registered and must be built.
+        """
+        with self._lock:
+            parent_job = self._active.get(parent)
+            owner = parent_job.owner if parent_job else parent
+            running = self._running(key)
+            if (
+                running
+                and self._is_started(running)
+                and not self._waits_for(self._active[running].owner, owner)
+            ):
+                self._waits[owner].append(running)
+                return running
+
+            key = None if running else key
+            self._register(uuid, 'install', key, owner, fields)
+
+    def wait(self, parent, uuid):
+        """Waits until a joined job ends and returns its status"""
+        with self._lock:
+            parent_job = self._active.get(parent)
+            owner = parent_job.owner if parent_job else parent
+            job = self._active.get(uuid)
+
+        try:
+            if job:
+                job.done.wait()
+                return job.status
+            return self._get_status(uuid)
+        finally:
+            with self._lock:
+                self._waits[owner].remove(uuid)
+                if not self._waits[owner]:
+                    del self._waits[owner]
+
+    def _get_status(self, uuid):
+        try:
+            return self.get(uuid)['status']
+        except JobNotFoundException:
+            return None
+
+    def discard(self, uuid):
+        """Forgets a job that was queued but will not run"""
+        with self._lock:
+            job = self._active.pop(uuid, None)
+            if job:
+                self._release(job)
+
+    def _register(self, uuid, type_, key, owner, fields):
+        job = self._active[uuid] = _Job(uuid, type_, **fields)
+        job.key = key
+        job.owner = owner or uuid
+        if key:
+            self._keys[key] = uuid
+
+    def _release(self, job):
+        if job.key and self._keys.get(job.key) == job.uuid:
+            del self._keys[job.key]
+        job.done.set()
+
+    def _running(self, key):
+        """Returns the uuid of the active job of key, the key of an ended job is removed"""
+        uuid = self._keys.get(key) if key else None
+        if not uuid:
+            return None
+
+        job = self._active.get(uuid)
+        if not job or job.done.is_set():
+            logger.info('forgetting the ended job %s', uuid)
+            del self._keys[key]
+            return None
+        return uuid
+
+    def _is_started(self, uuid):
+        """Returns True if the owner of a job runs in a thread"""
+        owner = self._active.get(self._active[uuid].owner)
+        return owner is not None and owner.started_at is not None
+
+    def _waits_for(self, owner, target):
+        """Returns True if owner is target or waits, directly or not, for target"""
+        owners, seen = [owner], set()
+        while owners:
+            owner = owners.pop()
+            if owner == target:
+                return True
+            if owner in seen:
+                continue
+            seen.add(owner)
+            for uuid in self._waits.get(owner, []):
+                job = self._active.get(uuid)
+                if job:
+                    owners.append(job.owner)
+        return False
+
+    def update(self, uuid, type_, status, errors=None):
+        """Ends the current step of a job and starts the next one
+
+        A job reaching the `completed` or `error` status is moved to the history.
+        """
+        now = time.time()
+        with self._lock:
+            job = self._active.get(uuid)
+            if not job:
+                # Dependencies are not queued, they start at their first status
+                job = self._active[uuid] = _Job(uuid, type_, queued_at=now)
+
+            job.end_step(now)
+            if status not in _END_STATUSES:
+                job.start_step(status, now)
+                return
+
+            job.finish(status, now, errors)
+            del self._active[uuid]
+            self._history.append(job)
+            self._release(job)
+
+    def step_started(self, uuid):
+        """Records that the current step of a job got its turn to run"""
+        with self._lock:
+            job = self._active.get(uuid)
+            if job:
+                job.step_started(time.time())
+
+    def is_active(self, uuid):
+        with self._lock:
+            return uuid in self._active
+
+    def list_(self):
+        """Returns the active jobs, then the finished jobs, most recent first"""
+        with self._lock:
+            active = sorted(self._active.values(), key=lambda job: job.queued_at)
+            jobs = list(reversed(active)) + list(reversed(self._history))
+            return [job.to_dict() for job in jobs]
+
+    def get(self, uuid):
+        with self._lock:
+            job = self._active.get(uuid)
+            if not job:
+                job = next((job for job in self._history if job.uuid == uuid), None)
+            if not job:
+                raise JobNotFoundException(uuid)
+            return job.to_dict()
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(config['job_history_size'])
+
+
+class _Job:
+    def __init__(self, uuid, type_, queued_at=None, **fields):
+        self.uuid = uuid
+        self.type = type_
+        self.fields = fields
+        self.key = None
+        self.owner = uuid
+        self.done = Event()
+        self.status = 'queued'
+        self.queued_at = time.time() if queued_at is None else queued_at
+        self.started_at = None
+        self.ended_at = None
+        self.errors = None
+        self.steps = []
+
+    def start_step(self, name, now):
+        if self.started_at is None:
+            self.started_at = now
+        self.status = name
+        self.steps.append(
+            {'name': name, 'queued_at': now, 'started_at': now, 'ended_at': None}
+        )
+
+    def step_started(self, now):
+        if self.steps and self.steps[-1]['ended_at'] is None:
+            self.steps[-1]['started_at'] = now
+
+    def end_step(self, now):
+        if self.steps and self.steps[-1]['ended_at'] is None:
+            self.steps[-1]['ended_at'] = now
+
+    def finish(self, status, now, errors):
+        if self.started_at is None:
+            self.started_at = now
+        self.status = status
+        self.ended_at = now
+        self.errors = errors
+
+    def to_dict(self):
+        return dict(
+            self.fields,
+            uuid=self.uuid,
+            type=self.type,
+            status=self.status,
+            queued_at=_format_time(self.queued_at),
+            started_at=_format_time(self.started_at),
+            ended_at=_format_time(self.ended_at),
+            duration=_duration(self.started_at, self.ended_at),
+            errors=self.errors,
+            steps=[
+                {
+                    'name': step['name'],
+                    'queued_at': _format_time(step['queued_at']),
+                    'started_at': _format_time(step['started_at']),
+                    'ended_at': _format_time(step['ended_at']),
+                    'duration': _duration(step['started_at'], step['ended_at']),
+                }
+                for step in self.steps
+            ],
+        )
+
+
+def install_key(method, options, reinstall=False):
+    """Returns a key identifying identical installations
+
+    A reinstall is not identical to an install, the install could end without
+    reinstalling anything.
+    """
+    if method == 'git':
+        url, ref = options['url'].rstrip('/'), options.get('ref', 'master')
+        return method, url, ref, reinstall
+    if method == 'market':
+        namespace, name = options['namespace'], options['name']
+        return method, namespace, name, options.get('version'), reinstall
+
+
+def _format_time(timestamp):
+    if timestamp is None:
+        return None
+    return datetime.fromtimestamp(timestamp, timezone.utc).isoformat()
+
+
+def _duration(start, end):
+    if start is None or end is None:
+        return None
+    return round(end - start, 3)
+
+
+def get_job_registry(config):
+    global _job_registry
+    with _job_registry_lock:
+        if not _job_registry:
+            logger.debug('Creating a new job registry...')
+            _job_registry = JobRegistry.from_config(config)
+    return _job_registry
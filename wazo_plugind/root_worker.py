@@ -1,31 +1,55 @@
 # Copyright 2017-2020 The Wazo Authors  (see the AUTHORS file)
 # SPDX-License-Identifier: GPL-3.0-or-later
 
+import itertools
 import logging
+import pickle
 import signal
 import os
 import sys
-from multiprocessing import Event, Process, Queue
+import time
+from concurrent.futures import Future, TimeoutError
+from multiprocessing import Process, Queue
 from queue import Empty
-from threading import Lock
+from threading import Lock, Thread
 from .helpers import exec_and_log
 
 logger = logging.getLogger(__name__)
 
+# Sent on the command queue to stop the worker process
+_STOP = None
+
+
+class CommandError(Exception):
+    pass
+
 
 class BaseWorker:
+    """The BaseWorker sends commands to a worker process and dispatches its results
+
+    Each command gets a request ID and a Future. The results are read by a single
+    dispatcher thread and matched to their Future by request ID, callers never hold a
+    lock while the worker is busy.
+    """
 
     name = 'base'
 
-    def __init__(self):
+    def __init__(self, command_timeout=None):
+        self._command_timeout = command_timeout
         self._command_queue = Queue()
         self._result_queue = Queue()
-        self._stop_requested = Event()
-        self._command_queue_lock = Lock()
+        self._cancel_queue = Queue()
+        self._request_ids = itertools.count()
+        self._requests = {}
+        self._requests_lock = Lock()
         self._process = Process(
             target=_run,
-            args=(self._command_queue, self._result_queue, self._stop_requested),
+            args=(self._command_queue, self._result_queue, self._cancel_queue),
         )
+        self._result_thread = Thread(
+            target=self._dispatch_results, name='{}-results'.format(self.name)
+        )
+        self._result_thread.daemon = True
 
     def __enter__(self):
         self.run()
@@ -37,25 +61,37 @@ class BaseWorker:
     def run(self):
         logger.info('starting %s worker', self.name)
         self._process.start()
+        self._result_thread.start()
 
     def stop(self):
         logger.info('stopping %s worker', self.name)
-        # unblock the command_queue in the worker
-        self._stop_requested.set()
+        # the queued commands are skipped by the worker
+        with self._requests_lock:
+            requests = list(self._requests.values())
+        for future in requests:
+            self.cancel(future)
 
-        # close both queues
-        self._command_queue.close()
-        self._command_queue.join_thread()
-        self._result_queue.close()
-        self._result_queue.join_thread()
+        # unblock the command_queue in the worker
+        self._command_queue.put(_STOP)
 
         # wait for the worker process to stop
         if self._process.is_alive():
             self._process.join()
 
+        # unblock the result dispatcher
+        self._result_queue.put(None)
+        if self._result_thread.is_alive():
+            self._result_thread.join()
+
+        # close all queues
+        for queue in (self._command_queue, self._result_queue, self._cancel_queue):
+            queue.close()
+            queue.join_thread()
+
         logger.info('%s worker stopped', self.name)
 
-    def send_cmd_and_wait(self, cmd, *args, **kwargs):
+    def send_cmd(self, cmd, *args, **kwargs):
+        """Sends a command to the worker and returns a Future of its result"""
         if not self._process.is_alive():
             logger.info('%s process is dead quitting', self.name)
             # kill the main thread
@@ -63,21 +99,117 @@ class BaseWorker:
             # shutdown the current thread execution so that executor.shutdown does not block
             sys.exit(1)
 
-        with self._command_queue_lock:
-            self._command_queue.put((cmd, args, kwargs))
-            return self._result_queue.get()
+        # pickling errors are raised here instead of in the queue feeder thread
+        payload = pickle.dumps((cmd, args, kwargs))
+        future = Future()
+        with self._requests_lock:
+            future.request_id = next(self._request_ids)
+            self._requests[future.request_id] = future
+            # the worker relies on receiving the requests in order of request ID
+            self._command_queue.put((future.request_id, payload))
+        return future
+
+    def send_cmd_and_wait(self, cmd, *args, **kwargs):
+        future = self.send_cmd(cmd, *args, **kwargs)
+        try:
+            return future.result(timeout=self._command_timeout)
+        except TimeoutError:
+            logger.info(
+                '%s worker did not answer "%s" in %ss',
+                self.name,
+                cmd,
+                self._command_timeout,
+            )
+            self.cancel(future)
+            raise
+
+    def cancel(self, future):
+        """Cancels a command, returns False if the command is already done
+
+        A command that is already running in the worker completes but its result is
+        discarded.
+        """
+        if not future.cancel():
+            return False
+
+        with self._requests_lock:
+            self._requests.pop(future.request_id, None)
+        self._cancel_queue.put(future.request_id)
+        return True
+
+    def _dispatch_results(self):
+        while True:
+            result = self._result_queue.get()
+            if result is None:
+                break
+
+            request_id, error, value = result
+            with self._requests_lock:
+                future = self._requests.pop(request_id, None)
+            if future is None or not future.set_running_or_notify_cancel():
+                logger.debug('%s worker discarding result %s', self.name, request_id)
+                continue
+
+            if error:
+                future.set_exception(CommandError(error))
+            else:
+                future.set_result(value)
 
 
 class RootWorker(BaseWorker):
+    """The RootWorker runs the privileged commands in a separate process
+
+    Concurrent apt-get update requests are coalesced in a single run and all callers
+    get its result. An update is skipped if one succeeded less than
+    `apt_update_freshness` seconds ago.
+    """
 
     name = 'root'
 
-    def apt_get_update(self, *args, **kwargs):
-        return self.send_cmd_and_wait('update', *args, **kwargs)
+    def __init__(self, apt_update_freshness=0, command_timeout=None):
+        super().__init__(command_timeout)
+        self._apt_update_freshness = apt_update_freshness
+        self._update_lock = Lock()
+        self._pending_update = None
+        self._last_update = None
+
+    def apt_get_update(self, uuid_):
+        with self._update_lock:
+            if self._is_apt_cache_fresh():
+                logger.debug('[%s] apt cache is up to date', uuid_)
+                return True
+
+            pending_update = self._pending_update
+            running = pending_update is not None
+            if not running:
+                pending_update = self._pending_update = Future()
+
+        if running:
+            logger.debug('[%s] waiting for the running apt-get update', uuid_)
+            return pending_update.result()
+
+        result = None
+        try:
+            result = self.send_cmd_and_wait('update', uuid_)
+        finally:
+            with self._update_lock:
+                if result is True:
+                    self._last_update = time.monotonic()
+                self._pending_update = None
+            pending_update.set_result(result)
+        return result
+
+    def _is_apt_cache_fresh(self):
+        if self._last_update is None:
+            return False
+        return time.monotonic() - self._last_update < self._apt_update_freshness
 
     def install(self, *args, **kwargs):
         return self.send_cmd_and_wait('install', *args, **kwargs)
 
+    def install_batch(self, *args, **kwargs):
+        return self.send_cmd_and_wait('install_batch', *args, **kwargs)
+
     def uninstall(self, *args, **kwargs):
         return self.send_cmd_and_wait('uninstall', *args, **kwargs)
 
@@ -86,8 +218,8 @@ class _CommandExecutor:
     def execute(self, cmd, *args, **kwargs):
         fn = getattr(self, cmd, None)
         if not fn:
-            logger.info('root worker received an unknown command "%s"', cmd.name)
-            return
+            logger.info('root worker received an unknown command "%s"', cmd)
+            raise CommandError('unknown command "{}"'.format(cmd))
 
         try:
             return fn(*args, **kwargs)
@@ -100,36 +232,81 @@ class _CommandExecutor:
         p = exec_and_log(logger.debug, logger.error, cmd)
         return p.returncode == 0
 
-    def install(self, uuid_, deb):
+    def install(self, uuid_, deb, log_filename=None):
         logger.debug('[%s] installing %s...', uuid_, deb)
         cmd = ['gdebi', '-nq', deb]
-        p = exec_and_log(logger.debug, logger.error, cmd)
+        p = exec_and_log(logger.debug, logger.error, cmd, log_filename=log_filename)
+        return p.returncode == 0
+
+    def install_batch(self, uuid_, debs, log_filename=None):
+        logger.debug('[%s] installing %s...', uuid_, ', '.join(debs))
+        # --reinstall installs the given packages even if the same version is installed,
+        # as gdebi does
+        cmd = ['apt-get', 'install', '-y', '-q', '--reinstall'] + [
+            os.path.abspath(deb) for deb in debs
+        ]
+        p = exec_and_log(logger.debug, logger.error, cmd, log_filename=log_filename)
         return p.returncode == 0
 
-    def uninstall(self, uuid, package_name):
+    def uninstall(self, uuid, package_name, log_filename=None):
         logger.debug('[%s] uninstalling %s', uuid, package_name)
         cmd = ['apt-get', 'remove', '-y', package_name]
-        p = exec_and_log(logger.debug, logger.error, cmd)
+        p = exec_and_log(logger.debug, logger.error, cmd, log_filename=log_filename)
         return p.returncode == 0
 
 
+def _drain(queue, items):
+    while True:
+        try:
+            items.add(queue.get_nowait())
+        except Empty:
+            return
+
+
 def _ignore_sigterm(signum, frame):
     logger.info('root worker is ignoring a SIGTERM')
 
 
-def _run(command_queue, result_queue, stop_requested):
+def _run(command_queue, result_queue, cancel_queue):
     logger.info('root worker started')
     os.setsid()
     signal.signal(signal.SIGTERM, _ignore_sigterm)
 
-    executor = _CommandExecutor()
-    while not stop_requested.is_set():
+    _serve(_CommandExecutor(), command_queue, result_queue, cancel_queue)
+    logger.info('root worker done')
+
+
+def _serve(executor, command_queue, result_queue, cancel_queue):
+    cancelled = set()
+    while True:
         try:
-            cmd, args, kwargs = command_queue.get(timeout=0.1)
-        except (KeyboardInterrupt, Empty, Exception):
+            message = command_queue.get()
+        except KeyboardInterrupt:
             continue
 
-        result = executor.execute(cmd, *args, **kwargs)
-        result_queue.put(result)
+        if message is _STOP:
+            return
 
-    logger.info('root worker done')
+        request_id, payload = message
+        _drain(cancel_queue, cancelled)
+        if request_id in cancelled:
+            logger.debug('root worker skipping cancelled request %s', request_id)
+            error, result = None, None
+        else:
+            error, result = _execute(executor, payload)
+        # requests are received in order, older cancellations will not be used
+        cancelled = {id_ for id_ in cancelled if id_ > request_id}
+        result_queue.put((request_id, error, result))
+
+
+def _execute(executor, payload):
+    try:
+        cmd, args, kwargs = pickle.loads(payload)
+    except Exception as e:
+        logger.exception('root worker received an invalid command')
+        return 'invalid command: {}'.format(e), None
+
+    try:
+        return None, executor.execute(cmd, *args, **kwargs)
+    except CommandError as e:
+        return str(e), None
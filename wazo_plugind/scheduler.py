@@ -0,0 +1,103 @@
+# Copyright 2021 The Wazo Authors  (see the AUTHORS file)
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from threading import BoundedSemaphore, Lock, local
+
+from .exceptions import JobQueueFullException
+
+logger = logging.getLogger(__name__)
+
+_scheduler = None
+_scheduler_lock = Lock()
+
+# The stage class of the steps that are limited
+STEP_STAGES = {
+    'downloading': 'download',
+    'building': 'build',
+    'packaging': 'build',
+    'updating': 'install',
+    'installing': 'install',
+    'removing': 'install',
+}
+
+
+class JobScheduler:
+    """The JobScheduler runs the install and uninstall jobs
+
+    At most `max_jobs` jobs run at the same time and `max_queued_jobs` more wait for
+    their turn, a job submitted when the queue is full is refused. The steps of each
+    stage class are limited separately, whatever the job they belong to.
+    """
+
+    def __init__(self, max_jobs, max_queued_jobs, stages):
+        self._executor = ThreadPoolExecutor(max_workers=max_jobs)
+        self._max_admitted = max_jobs + max_queued_jobs
+        self._admitted = 0
+        self._lock = Lock()
+        self._stages = {
+            name: BoundedSemaphore(limit) for name, limit in stages.items() if limit
+        }
+        self._held_stages = local()
+
+    def submit(self, fn, *args, **kwargs):
+        with self._lock:
+            if self._admitted >= self._max_admitted:
+                raise JobQueueFullException()
+            self._admitted += 1
+
+        try:
+            future = self._executor.submit(fn, *args, **kwargs)
+        except Exception:
+            self._release()
+            raise
+        future.add_done_callback(self._release)
+        return future
+
+    def _release(self, future=None):
+        with self._lock:
+            self._admitted -= 1
+
+    @contextmanager
+    def stage(self, name):
+        """Waits for a slot of the stage class name, a None name is not limited
+
+        A thread that already has a slot of the stage class does not wait for another.
+        """
+        semaphore = self._stages.get(name)
+        if not hasattr(self._held_stages, 'names'):
+            self._held_stages.names = set()
+        held = self._held_stages.names
+        if not semaphore or name in held:
+            yield
+            return
+
+        with semaphore:
+            held.add(name)
+            try:
+                yield
+            finally:
+                held.discard(name)
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait)
+
+    @classmethod
+    def from_config(cls, config):
+        scheduler_config = config['scheduler']
+        return cls(
+            scheduler_config['max_jobs'],
+            scheduler_config['max_queued_jobs'],
+            scheduler_config['stages'],
+        )
+
+
+def get_scheduler(config):
+    global _scheduler
+    with _scheduler_lock:
+        if not _scheduler:
+            logger.debug('Creating a new job scheduler...')
+            _scheduler = JobScheduler.from_config(config)
+    return _scheduler
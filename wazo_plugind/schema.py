@@ -133,6 +133,24 @@ class PluginInstallSchema(Schema):
     options = OptionField(missing=dict, required=True)
 
 
+class PluginBulkInstallSchema(Schema):
+
+    plugins = fields.Nested(
+        PluginInstallSchema, many=True, required=True, validate=Length(min=1)
+    )
+
+
+class PluginInstallPlanSchema(Schema):
+
+    method = fields.String(validate=OneOf(['market']), required=True)
+    options = fields.Nested(MarketInstallOptionsSchema, required=True, unknown=EXCLUDE)
+
+
 class PluginInstallQueryStringSchema(Schema):
 
     reinstall = fields.Boolean(default=False, missing=False)
+
+
+class JobLogQueryStringSchema(Schema):
+
+    follow = fields.Boolean(default=False, missing=False)
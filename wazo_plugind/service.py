@@ -2,11 +2,22 @@
 # SPDX-License-Identifier: GPL-3.0-or-later
 
 import logging
-from . import db
-from .exceptions import PluginNotFoundException
+import requests
+from functools import partial
+from . import db, joblog, jobs
+from .download import already_satisfied
+from .dependency import DependencyPlanner
+from .exceptions import (
+    IncompatiblePluginException,
+    InvalidInstallPlanException,
+    JobQueueFullException,
+    PluginNotFoundException,
+    PluginValidationException,
+    PluginVersionNotFoundException,
+)
 from .helpers import exec_and_log, WazoVersionFinder
 from .context import Context
-from .tasks import PackageAndInstallTask, UninstallTask
+from .tasks import BulkInstallTask, PackageAndInstallTask, UninstallTask
 
 logger = logging.getLogger(__name__)
 
@@ -20,6 +31,7 @@ class PluginService:
         executor,
         plugin_db,
         wazo_version_finder,
+        market_cache,
     ):
         self._build_dir = config['build_dir']
         self._deb_file = '{}.deb'.format(self._build_dir)
@@ -29,19 +41,28 @@ class PluginService:
         self._root_worker = root_worker
         self._executor = executor
         self._wazo_version_finder = wazo_version_finder
+        self._market_cache = market_cache
+        self._job_registry = jobs.get_job_registry(config)
 
     def _exec(self, ctx, *args, **kwargs):
         log_debug = ctx.get_logger(logger.debug)
         log_error = ctx.get_logger(logger.error)
-        exec_and_log(log_debug, log_error, *args, **kwargs)
+        exec_and_log(
+            log_debug, log_error, *args, log_filename=ctx.log_filename, **kwargs
+        )
+
+    def _submit(self, fn, ctx, *args):
+        joblog.get_job_log_store(self._config).prune()
+        try:
+            self._executor.submit(fn, ctx, *args)
+        except JobQueueFullException:
+            ctx.log(logger.info, 'too many jobs are waiting, refusing the job')
+            self._job_registry.discard(ctx.uuid)
+            raise
 
     def count(self):
         return self._plugin_db.count()
 
-    def count_from_market(self, market_proxy, *args, **kwargs):
-        market_db = self._new_market_db(market_proxy)
-        return market_db.count(*args, **kwargs)
-
     def create(self, method, params, options):
         task = PackageAndInstallTask(self._config, self._root_worker)
         wazo_version = self._wazo_version_finder.get_version()
@@ -53,9 +74,128 @@ class PluginService:
             wazo_version=wazo_version,
         )
         ctx.log(logger.info, 'installing %s with params %s...', options, params)
-        self._executor.submit(task.execute, ctx)
+        uuid = self._job_registry.queue(
+            ctx.uuid,
+            'install',
+            key=jobs.install_key(method, options, params['reinstall']),
+            method=method,
+            options=options,
+        )
+        if uuid != ctx.uuid:
+            ctx.log(logger.info, 'joining the running job %s', uuid)
+            return uuid
+
+        try:
+            satisfied = method == 'market' and self._is_satisfied_by_market(ctx)
+        except Exception:
+            self._job_registry.discard(ctx.uuid)
+            raise
+
+        if satisfied:
+            ctx.log(logger.info, '%s is already satisfied', options)
+            self._status_publisher.install(ctx, 'completed')
+            return ctx.uuid
+
+        self._submit(task.execute, ctx)
         return ctx.uuid
 
+    def create_bulk(self, plugins, params):
+        """Installs many plugins in a single job
+
+        Returns the uuid of the job and the uuid of each plugin. Identical plugins get
+        the same uuid, the uuid of the running job if one is already installing it.
+        """
+        task = BulkInstallTask(self._config, self._root_worker)
+        wazo_version = self._wazo_version_finder.get_version()
+        ctx = Context(self._config, wazo_version=wazo_version)
+        ctx.log(logger.info, 'installing %s plugins in bulk...', len(plugins))
+        self._job_registry.queue(ctx.uuid, 'bulk_install')
+
+        item_contexts = {}
+        for plugin in plugins:
+            method, options = plugin['method'], plugin['options']
+            key = jobs.install_key(method, options, params['reinstall'])
+            if key not in item_contexts:
+                item_contexts[key] = Context(
+                    self._config,
+                    method=method,
+                    install_options=options,
+                    install_params=dict(params),
+                    wazo_version=wazo_version,
+                )
+
+        uuids = {}
+        pending_contexts = []
+        try:
+            for key, item_ctx in item_contexts.items():
+                uuids[key] = self._job_registry.queue(
+                    item_ctx.uuid,
+                    'install',
+                    key=key,
+                    owner=ctx.uuid,
+                    method=item_ctx.method,
+                    options=item_ctx.install_options,
+                )
+                if uuids[key] != item_ctx.uuid:
+                    item_ctx.log(logger.info, 'joining the running job %s', uuids[key])
+                    continue
+                if item_ctx.method == 'market' and self._is_satisfied_by_market(
+                    item_ctx
+                ):
+                    self._status_publisher.install(item_ctx, 'completed')
+                    continue
+                pending_contexts.append(item_ctx)
+
+            self._submit(task.execute, ctx, pending_contexts)
+        except Exception:
+            for item_ctx in item_contexts.values():
+                if item_ctx.uuid in uuids.values():
+                    self._job_registry.discard(item_ctx.uuid)
+            self._job_registry.discard(ctx.uuid)
+            raise
+
+        items = [
+            dict(
+                plugin,
+                uuid=uuids[
+                    jobs.install_key(
+                        plugin['method'], plugin['options'], params['reinstall']
+                    )
+                ],
+            )
+            for plugin in plugins
+        ]
+        return {'uuid': ctx.uuid, 'items': items}
+
+    def plan(self, market_proxy, options, params):
+        """Returns what would be installed for a market install without downloading"""
+        namespace, name = options['namespace'], options['name']
+        market_db = self._new_market_db(market_proxy)
+        try:
+            market_db.get(namespace, name)
+        except LookupError:
+            raise PluginNotFoundException(namespace, name)
+
+        planner = DependencyPlanner(market_db)
+        try:
+            return planner.install_plan(options, params['reinstall'])
+        except PluginValidationException as e:
+            raise InvalidInstallPlanException(e)
+
+    def list_jobs(self):
+        return self._job_registry.list_()
+
+    def get_job(self, uuid):
+        return self._job_registry.get(uuid)
+
+    def get_job_log(self, uuid):
+        return joblog.get_job_log_store(self._config).get_filename(uuid)
+
+    def follow_job_log(self, uuid, offset):
+        return joblog.get_job_log_store(self._config).follow(
+            uuid, offset, is_active=partial(self._job_registry.is_active, uuid)
+        )
+
     def get_plugin_metadata(self, namespace, name):
         plugin = self._plugin_db.get_plugin(namespace, name)
         if not plugin.is_installed():
@@ -63,7 +203,10 @@ class PluginService:
         return plugin.metadata()
 
     def new_market_proxy(self):
-        return db.MarketProxy(self._config['market'])
+        return db.MarketProxy(self._market_cache)
+
+    def invalidate_market_cache(self):
+        self._market_cache.invalidate()
 
     def list_(self):
         return self._plugin_db.list_()
@@ -75,9 +218,9 @@ class PluginService:
             return result
         raise PluginNotFoundException(namespace, name)
 
-    def list_from_market(self, market_proxy, *args, **kwargs):
+    def query_market(self, market_proxy, *args, **kwargs):
         market_db = self._new_market_db(market_proxy)
-        return market_db.list_(*args, **kwargs)
+        return market_db.query(*args, **kwargs)
 
     def delete(self, namespace, name):
         ctx = Context(self._config, namespace=namespace, name=name)
@@ -88,15 +231,52 @@ class PluginService:
 
         task = UninstallTask(self._config, self._root_worker)
         ctx = ctx.with_fields(package_name=plugin.debian_package_name)
-        self._executor.submit(task.execute, ctx)
+        self._job_registry.queue(ctx.uuid, 'uninstall', namespace=namespace, name=name)
+        self._submit(task.execute, ctx)
         return ctx.uuid
 
+    def _is_satisfied_by_market(self, ctx):
+        """Checks a market install before downloading anything
+
+        Raises an error if the plugin cannot be installed on this Wazo version and
+        returns True if there is nothing to install.
+        """
+        namespace, name = ctx.install_options['namespace'], ctx.install_options['name']
+        required_version = ctx.install_options.get('version')
+        market_db = self._new_market_db(self.new_market_proxy())
+        try:
+            plugin_info = market_db.get(namespace, name)
+        except LookupError:
+            raise PluginNotFoundException(namespace, name)
+        except requests.exceptions.RequestException:
+            ctx.log(
+                logger.info, 'market unavailable, the install will be checked later'
+            )
+            return False
+
+        reinstall = ctx.install_params['reinstall']
+        if already_satisfied(plugin_info, required_version, reinstall):
+            return True
+
+        versions = plugin_info.get('versions', [])
+        if required_version:
+            versions = [v for v in versions if v.get('version') == required_version]
+            if not versions:
+                raise PluginVersionNotFoundException(namespace, name, required_version)
+
+        if not any(db.is_compatible(v, ctx.wazo_version) for v in versions):
+            raise IncompatiblePluginException(namespace, name, ctx.wazo_version)
+
+        # A compatible version that is not upgradable would be ignored by the install
+        return not any(v['upgradable'] for v in versions)
+
     def _new_market_db(self, market_proxy):
         current_wazo_version = self._wazo_version_finder.get_version()
         return db.MarketDB(market_proxy, current_wazo_version, self._plugin_db)
 
     @classmethod
     def from_config(cls, config, *args, **kwargs):
-        kwargs['plugin_db'] = db.PluginDB(config)
+        kwargs['plugin_db'] = db.get_plugin_db(config)
         kwargs['wazo_version_finder'] = WazoVersionFinder(config)
+        kwargs['market_cache'] = db.get_market_cache(config)
         return cls(config, *args, **kwargs)
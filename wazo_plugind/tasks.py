@@ -5,10 +5,11 @@ import logging
 import os
 import shutil
 import yaml
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 from threading import Thread
-from marshmallow import ValidationError
 from .context import Context
-from . import bus, debian, download, schema
+from . import artifacts, bus, debian, dependency, download, jobs, scheduler
 from .exceptions import (
     CommandExecutionFailed,
     DependencyAlreadyInstalledException,
@@ -29,6 +30,7 @@ class UninstallTask:
         self._remover = _PackageRemover(config, root_worker)
         self._publisher = get_publisher(config)
         self._debug_enabled = config['debug']
+        self._config = config
 
     def execute(self, ctx):
         return self._uninstall_and_publish(ctx)
@@ -43,7 +45,7 @@ class UninstallTask:
             ]
             for step, fn in steps:
                 self._publisher.uninstall(ctx, step)
-                ctx = fn(ctx)
+                ctx = _run_step(self._config, step, [ctx], fn, ctx)
         except Exception:
             ctx.log(
                 logger.error,
@@ -58,9 +60,10 @@ class UninstallTask:
 
 class PackageAndInstallTask:
     def __init__(self, config, root_worker):
+        self._config = config
         self._root_worker = root_worker
         self._builder = _PackageBuilder(
-            config, self._root_worker, self._package_and_install_impl
+            config, self._root_worker, self.prepare, self.install_all
         )
         self._publisher = get_publisher(config)
 
@@ -68,26 +71,108 @@ class PackageAndInstallTask:
         return self._package_and_install_impl(ctx)
 
     def _package_and_install_impl(self, ctx):
+        steps = [
+            ('starting', lambda ctx: ctx),
+            ('downloading', self._builder.download),
+            ('extracting', self._builder.extract),
+            ('validating', self._builder.validate),
+            (
+                'installing dependencies',
+                partial(self._builder.install_dependencies, with_plugin=True),
+            ),
+            ('building', self._builder.build),
+            ('packaging', self._builder.package),
+            ('updating', self._builder.update),
+            ('installing', self._builder.install),
+            ('cleaning', self._builder.clean),
+            ('completed', lambda ctx: ctx),
+        ]
+        return self._execute_steps(ctx, steps)
+
+    def prepare(self, ctx):
+        """Executes the steps up to the packaging, returns None if it did not complete"""
+        steps = [
+            ('starting', lambda ctx: ctx),
+            ('downloading', self._builder.download),
+            ('extracting', self._builder.extract),
+            ('validating', self._builder.validate),
+            ('installing dependencies', self._builder.install_dependencies),
+            ('building', self._builder.build),
+            ('packaging', self._builder.package),
+        ]
+        return self._execute_steps(ctx, steps)
+
+    def install_all(self, ctx, contexts, plugin_deb_file=None):
+        """Installs the plugins returned by prepare in a single root worker transaction
+
+        A single apt-get update is done if one of the plugins needs it. The progress is
+        published for each plugin. The package of the plugin of ctx is included in the
+        transaction when plugin_deb_file is given. Returns True if the plugins were
+        installed.
+        """
+        if not contexts:
+            return True
+
+        debs = [c.package_deb_file for c in contexts]
+        if plugin_deb_file:
+            debs.append(plugin_deb_file)
+        step = 'updating'
+        try:
+            if any(c.metadata.get('debian_depends') for c in contexts):
+                self._publish_all(contexts, step)
+                result = _run_step(
+                    self._config,
+                    step,
+                    contexts,
+                    self._root_worker.apt_get_update,
+                    ctx.uuid,
+                )
+                if result is not True:
+                    raise Exception('apt-get update failed')
+
+            step = 'installing'
+            self._publish_all(contexts, step)
+            result = _run_step(
+                self._config,
+                step,
+                contexts,
+                self._root_worker.install_batch,
+                ctx.uuid,
+                debs,
+                log_filename=ctx.log_filename,
+            )
+            if result is not True:
+                raise Exception('Installation failed')
+        except Exception as e:
+            ctx.log(logger.info, 'failed to install %s: %s', debs, e)
+            for c in contexts:
+                self._builder.clean(c)
+                details = {'step': step, 'install_options': dict(c.install_options)}
+                self._publisher.install_error(
+                    c, 'install-error', 'Installation error', details=details
+                )
+            return False
+
+        for c in contexts:
+            self._builder.clean(c)
+        self._publish_all(contexts, 'completed')
+        return True
+
+    def _publish_all(self, contexts, step):
+        for ctx in contexts:
+            self._publisher.install(ctx, step)
+
+    def _execute_steps(self, ctx, steps):
+        """Executes each step and publishes its progress
+
+        Returns the resulting context or None if the execution did not complete.
+        """
         try:
             step = 'initializing'
-
-            steps = [
-                ('starting', lambda ctx: ctx),
-                ('downloading', self._builder.download),
-                ('extracting', self._builder.extract),
-                ('validating', self._builder.validate),
-                ('installing dependencies', self._builder.install_dependencies),
-                ('building', self._builder.build),
-                ('packaging', self._builder.package),
-                ('updating', self._builder.update),
-                ('installing', self._builder.install),
-                ('cleaning', self._builder.clean),
-                ('completed', lambda ctx: ctx),
-            ]
-
             for step, fn in steps:
                 self._publisher.install(ctx, step)
-                ctx = fn(ctx)
+                ctx = _run_step(self._config, step, [ctx], fn, ctx)
+            return ctx
 
         except CommandExecutionFailed as e:
             ctx.log(
@@ -95,6 +180,8 @@ class PackageAndInstallTask:
                 'an external command failed during the plugin installation: %s',
                 e,
             )
+            if e.output_tail:
+                ctx.log(logger.info, 'command output:\n%s', '\n'.join(e.output_tail))
             self._builder.clean(ctx)
             details = {'step': step}
             self._publisher.install_error(
@@ -129,6 +216,168 @@ class PackageAndInstallTask:
             self._builder.clean(ctx)
 
 
+class BulkInstallTask:
+    """Installs many plugins as a single job
+
+    The plugins and their dependencies are planned together, so a shared dependency is
+    only installed once. Everything is built before the installations start, and those
+    share a single apt-get update. The progress of each plugin is published with its own
+    uuid and the progress of the job with the uuid of the job. A dependency that is
+    already being installed by a running job is not built, the installation waits for
+    that job instead.
+    """
+
+    def __init__(self, config, root_worker):
+        self._config = config
+        self._task = PackageAndInstallTask(config, root_worker)
+        self._publisher = get_publisher(config)
+
+    def execute(self, ctx, item_contexts):
+        job_registry = jobs.get_job_registry(self._config)
+        dependency_uuids = []
+        try:
+            self._publisher.install(ctx, 'starting')
+            contexts, running = self._plan(ctx, item_contexts, dependency_uuids)
+
+            self._publisher.install(ctx, 'building')
+            prepared_contexts = []
+            for level in contexts:
+                prepared_contexts.extend(_prepare_all(self._task.prepare, level))
+
+            for uuid in running:
+                ctx.log(logger.info, 'waiting for the running job %s', uuid)
+                status = job_registry.wait(ctx.uuid, uuid)
+                ctx.log(
+                    logger.info, 'the job %s ended with the status %s', uuid, status
+                )
+
+            self._publisher.install(ctx, 'installing')
+            if not self._task.install_all(ctx, prepared_contexts):
+                raise Exception('Installation failed')
+
+            self._publisher.install(ctx, 'completed')
+        except PluginValidationException as e:
+            ctx.log(logger.info, 'Plugin validation exception %s', e.details)
+            self._publisher.install_error(ctx, e.error_id, e.message, details=e.details)
+            self._fail_pending(item_contexts, e.error_id, e.message, e.details)
+        except Exception:
+            ctx.log(logger.error, 'Unexpected error', exc_info=self._config['debug'])
+            self._publisher.install_error(ctx, 'bulk-install-error', 'Install Error')
+            self._fail_pending(item_contexts, 'bulk-install-error', 'Install Error')
+        finally:
+            # The dependencies that did not run must not be joined anymore
+            for uuid in dependency_uuids:
+                job_registry.discard(uuid)
+
+    def _fail_pending(self, item_contexts, error_id, message, details=None):
+        """Publishes the error of the job for the plugins that did not end"""
+        job_registry = jobs.get_job_registry(self._config)
+        for item_ctx in item_contexts:
+            if not job_registry.is_active(item_ctx.uuid):
+                continue
+            details = dict(
+                details or {}, install_options=dict(item_ctx.install_options)
+            )
+            self._publisher.install_error(item_ctx, error_id, message, details=details)
+            # The plugin must not be joined even if the status was not recorded
+            job_registry.discard(item_ctx.uuid)
+
+    def _plan(self, ctx, item_contexts, dependency_uuids):
+        """Returns the contexts to prepare by level, dependencies first, and the uuids of
+        the running jobs that install some of the dependencies
+
+        The uuid of each registered dependency is added to dependency_uuids.
+        """
+        job_registry = jobs.get_job_registry(self._config)
+        market_contexts = {}
+        other_contexts = []
+        for item_ctx in item_contexts:
+            if item_ctx.method != 'market':
+                other_contexts.append(item_ctx)
+                continue
+            options = item_ctx.install_options
+            key = options['namespace'], options['name']
+            if key in market_contexts:
+                # Two versions of the same plugin cannot be installed
+                details = {'install_options': dict(options)}
+                self._publisher.install_error(
+                    item_ctx, 'conflicting-install', 'Conflicting install', details
+                )
+                continue
+            market_contexts[key] = item_ctx
+
+        planner = dependency.DependencyPlanner.from_config(
+            self._config, ctx.wazo_version
+        )
+        plan = planner.plan_all(
+            [item_ctx.install_options for item_ctx in market_contexts.values()]
+        )
+        planned = {(dep['namespace'], dep['name']) for level in plan for dep in level}
+
+        contexts = []
+        running = []
+        for level in plan:
+            level_contexts = []
+            for dep in level:
+                dep_ctx = market_contexts.get((dep['namespace'], dep['name']))
+                if not dep_ctx:
+                    dep_ctx = _new_dependency_context(
+                        self._config, dep, ctx.wazo_version
+                    )
+                    uuid = job_registry.join(
+                        dep_ctx.uuid,
+                        jobs.install_key('market', dep),
+                        ctx.uuid,
+                        method='market',
+                        options=dep,
+                    )
+                    if uuid:
+                        running.append(uuid)
+                        continue
+                    dependency_uuids.append(dep_ctx.uuid)
+                level_contexts.append(dep_ctx.with_fields(planned_dependencies=planned))
+            contexts.append(level_contexts)
+
+        for item_ctx in other_contexts:
+            item_ctx.with_fields(planned_dependencies=planned)
+        if other_contexts:
+            contexts.append(other_contexts)
+        return contexts, running
+
+
+def _new_dependency_context(config, dependency, wazo_version, **kwargs):
+    return Context(
+        config,
+        method='market',
+        install_options=dependency,
+        install_params={'reinstall': False},
+        wazo_version=wazo_version,
+        **kwargs
+    )
+
+
+def _run_step(config, step, contexts, fn, *args, **kwargs):
+    """Calls fn once the stage of the step allows it
+
+    The step of each context is recorded as started when its turn comes.
+    """
+    with scheduler.get_scheduler(config).stage(scheduler.STEP_STAGES.get(step)):
+        job_registry = jobs.get_job_registry(config)
+        for ctx in contexts:
+            job_registry.step_started(ctx.uuid)
+        return fn(*args, **kwargs)
+
+
+def _prepare_all(prepare_fn, contexts, max_workers=4):
+    """Prepares the contexts concurrently and returns the ones that completed in order"""
+    if not contexts:
+        return []
+
+    with ThreadPoolExecutor(max_workers=min(len(contexts), max_workers)) as executor:
+        prepared_contexts = list(executor.map(prepare_fn, contexts))
+    return [ctx for ctx in prepared_contexts if ctx is not None]
+
+
 def get_publisher(config):
     global _publisher
     if not _publisher:
@@ -146,31 +395,49 @@ class _PackageRemover:
         self._root_worker = root_worker
 
     def remove(self, ctx):
-        result = self._root_worker.uninstall(ctx.uuid, ctx.package_name)
+        result = self._root_worker.uninstall(
+            ctx.uuid, ctx.package_name, log_filename=ctx.log_filename
+        )
         if result is not True:
             raise Exception('Uninstallation failed')
         return ctx
 
 
 class _PackageBuilder:
-    def __init__(self, config, root_worker, package_install_fn):
+
+    _max_dependency_workers = 4
+
+    def __init__(
+        self, config, root_worker, prepare_dependency_fn, install_dependency_fn
+    ):
         self._config = config
         self._downloader = download.Downloader(config)
         self._debian_file_generator = debian.Generator.from_config(config)
         self._root_worker = root_worker
-        self._package_install_fn = package_install_fn
+        self._prepare_dependency_fn = prepare_dependency_fn
+        self._install_dependency_fn = install_dependency_fn
+        self._artifact_store = None
+        if config['artifact_cache']['enabled']:
+            self._artifact_store = artifacts.get_artifact_store(config)
 
     def build(self, ctx):
         namespace, name = ctx.metadata['namespace'], ctx.metadata['name']
         installer_path = os.path.join(
             ctx.extract_path, self._config['default_install_filename']
         )
+        ctx = ctx.with_fields(
+            installer_path=installer_path, namespace=namespace, name=name
+        )
+        if not hasattr(ctx, 'artifact_found'):
+            ctx = self._fetch_artifact(ctx)
+        if ctx.artifact_found:
+            ctx.log(logger.info, 'reusing the package of %s/%s', namespace, name)
+            return ctx
+
         ctx.log(logger.debug, 'building %s/%s', namespace, name)
         cmd = [installer_path, 'build']
         self._exec(ctx, cmd, cwd=ctx.extract_path)
-        return ctx.with_fields(
-            installer_path=installer_path, namespace=namespace, name=name
-        )
+        return ctx
 
     def clean(self, ctx):
         extract_path = getattr(ctx, 'extract_path', None)
@@ -185,10 +452,7 @@ class _PackageBuilder:
         ctx = self._debian_file_generator.generate(ctx)
         cmd = ['dpkg-deb', '--build', ctx.pkgdir]
         self._exec(ctx, cmd, cwd=ctx.extract_path)
-        deb_path = os.path.join(
-            ctx.extract_path, '{}.deb'.format(self._config['build_dir'])
-        )
-        return ctx.with_fields(package_deb_file=deb_path)
+        return ctx.with_fields(package_deb_file=self._deb_path(ctx))
 
     def download(self, ctx):
         return self._downloader.download(ctx)
@@ -217,34 +481,88 @@ class _PackageBuilder:
         return ctx
 
     def install(self, ctx):
-        result = self._root_worker.install(ctx.uuid, ctx.package_deb_file)
+        dependency_contexts = getattr(ctx, 'dependency_contexts', None)
+        if dependency_contexts:
+            result = self._install_dependency_fn(
+                ctx, dependency_contexts, plugin_deb_file=ctx.package_deb_file
+            )
+        else:
+            result = self._root_worker.install(
+                ctx.uuid, ctx.package_deb_file, log_filename=ctx.log_filename
+            )
         if result is not True:
             raise Exception('Installation failed')
         return ctx
 
-    def install_dependencies(self, ctx):
-        dependencies = ctx.metadata.get('depends', [])
-        current_wazo_version = ctx.wazo_version
-        for dependency in dependencies:
-            ctx.log(logger.info, 'installing dependency %s', dependency)
-            self.install_dependency(ctx, dependency, current_wazo_version)
+    def install_dependencies(self, ctx, with_plugin=False):
+        """Builds the dependencies of the plugin and installs them in a single transaction
+
+        The build of the plugin may need its dependencies, they are installed before
+        it. When the package of the plugin is reused nothing is built and, if with_plugin
+        is True, the dependencies are installed with the plugin by the install step.
+        """
+        ctx = self._fetch_artifact(ctx)
+        planned = getattr(ctx, 'planned_dependencies', set())
+        metadata = dict(ctx.metadata)
+        metadata['depends'] = [
+            dependency
+            for dependency in metadata.get('depends') or []
+            if (dependency.get('namespace'), dependency.get('name')) not in planned
+        ]
+        if not metadata['depends']:
+            return ctx
+
+        planner = dependency.DependencyPlanner.from_config(
+            self._config, ctx.wazo_version
+        )
+        plan = planner.plan(metadata)
+        planned = planned | {(metadata['namespace'], metadata['name'])}
+        planned |= {(dep['namespace'], dep['name']) for level in plan for dep in level}
+
+        dependency_contexts = []
+        for level in plan:
+            ctx.log(logger.info, 'building dependencies %s', level)
+            dependency_contexts.extend(self._prepare_dependencies(ctx, level, planned))
+
+        if with_plugin and ctx.artifact_found:
+            return ctx.with_fields(dependency_contexts=dependency_contexts)
+
+        # The dependency tree is installed in a single transaction
+        if not self._install_dependency_fn(ctx, dependency_contexts):
+            ctx.log(logger.info, 'failed to install the dependencies')
         return ctx
 
-    def install_dependency(self, ctx, dep, current_wazo_version):
-        try:
-            schema.DependencyMetadataSchema().load(dep)
-        except ValidationError:
-            ctx.log(logger.info, 'invalid dependency %s skipping', dep)
-            return
+    def _prepare_dependencies(self, ctx, level, planned):
+        """Builds the dependencies of a level concurrently"""
+        dependency_contexts = [
+            _new_dependency_context(
+                self._config, dep, ctx.wazo_version, planned_dependencies=planned
+            )
+            for dep in level
+        ]
+        return _prepare_all(
+            partial(self._prepare_dependency, ctx),
+            dependency_contexts,
+            self._max_dependency_workers,
+        )
 
-        ctx = Context(
-            self._config,
+    def _prepare_dependency(self, ctx, dependency_ctx):
+        """Builds a dependency, or waits for the running job that already installs it"""
+        job_registry = jobs.get_job_registry(self._config)
+        options = dependency_ctx.install_options
+        running = job_registry.join(
+            dependency_ctx.uuid,
+            jobs.install_key('market', options),
+            ctx.uuid,
             method='market',
-            install_options=dep,
-            install_params={'reinstall': False},
-            wazo_version=current_wazo_version,
+            options=options,
         )
-        self._package_install_fn(ctx)
+        if not running:
+            return self._prepare_dependency_fn(dependency_ctx)
+
+        ctx.log(logger.info, 'waiting for the running job %s', running)
+        status = job_registry.wait(ctx.uuid, running)
+        ctx.log(logger.info, 'the job %s ended with the status %s', running, status)
 
     def update(self, ctx):
         if not ctx.metadata.get('debian_depends'):
@@ -256,6 +574,10 @@ class _PackageBuilder:
         return ctx
 
     def package(self, ctx):
+        if ctx.artifact_found:
+            # The debian depends are still required by the update step
+            return self._debian_file_generator.add_debian_depends_from_depends(ctx)
+
         ctx.log(logger.debug, 'packaging %s/%s', ctx.namespace, ctx.name)
         pkgdir = os.path.join(ctx.extract_path, self._config['build_dir'])
         os.makedirs(pkgdir)
@@ -270,9 +592,43 @@ class _PackageBuilder:
         )
         cmd = ['fakeroot', 'cp', '-R', plugin_data_path, installed_plugin_data_path]
         self._exec(ctx, cmd, cwd=ctx.extract_path)
-        return self._debianize(ctx.with_fields(pkgdir=pkgdir))
+        ctx = self._debianize(ctx.with_fields(pkgdir=pkgdir))
+        self._store_artifact(ctx)
+        return ctx
+
+    def _fetch_artifact(self, ctx):
+        ctx = ctx.with_fields(artifact_key=None, artifact_found=False)
+        source_commit = getattr(ctx, 'source_commit', None)
+        if not self._artifact_store or not source_commit:
+            return ctx
+
+        key = artifacts.make_key(
+            source_commit, ctx.metadata, ctx.wazo_version, self._config
+        )
+        deb_path = self._deb_path(ctx)
+        found = self._artifact_store.fetch(key, deb_path)
+        ctx = ctx.with_fields(artifact_key=key, artifact_found=found)
+        if found:
+            ctx = ctx.with_fields(package_deb_file=deb_path)
+        return ctx
+
+    def _store_artifact(self, ctx):
+        if not ctx.artifact_key:
+            return
+
+        try:
+            self._artifact_store.add(ctx.artifact_key, ctx.package_deb_file)
+        except OSError as e:
+            ctx.log(logger.info, 'failed to store the package: %s', e)
+
+    def _deb_path(self, ctx):
+        return os.path.join(
+            ctx.extract_path, '{}.deb'.format(self._config['build_dir'])
+        )
 
     def _exec(self, ctx, *args, **kwargs):
         log_debug = ctx.get_logger(logger.debug)
         log_error = ctx.get_logger(logger.error)
-        exec_and_log(log_debug, log_error, *args, **kwargs)
+        exec_and_log(
+            log_debug, log_error, *args, log_filename=ctx.log_filename, **kwargs
+        )
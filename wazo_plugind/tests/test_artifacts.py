@@ -0,0 +1,64 @@
+# Copyright 2021 The Wazo Authors  (see the AUTHORS file)
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+import os
+import tempfile
+
+from hamcrest import assert_that, equal_to, is_not
+from unittest import TestCase
+
+from ..artifacts import ArtifactStore, make_key
+from ..config import _DEFAULT_CONFIG
+
+TEMPLATE_DIR = os.path.join(os.path.dirname(__file__), '..', '..', 'templates')
+
+
+class TestArtifactStore(TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.directory = os.path.join(self.tmp_dir.name, 'artifacts')
+        self.store = ArtifactStore(self.directory, max_size_mb=1)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_fetch(self):
+        filename = os.path.join(self.tmp_dir.name, 'fetched.deb')
+
+        assert_that(self.store.fetch('abc', filename), equal_to(False))
+
+        self.store.add('abc', self.new_file('built.deb', b'content'))
+
+        assert_that(self.store.fetch('abc', filename), equal_to(True))
+        with open(filename, 'rb') as f:
+            assert_that(f.read(), equal_to(b'content'))
+
+    def test_that_the_least_recently_used_artifacts_are_evicted(self):
+        content = b'x' * 400 * 1024
+        self.store.add('a', self.new_file('a.deb', content))
+        self.store.add('b', self.new_file('b.deb', content))
+        os.utime(os.path.join(self.directory, 'a.deb'), (0, 0))
+        os.utime(os.path.join(self.directory, 'b.deb'), (1, 1))
+        self.store.fetch('a', os.path.join(self.tmp_dir.name, 'fetched.deb'))
+
+        self.store.add('c', self.new_file('c.deb', content))
+
+        assert_that(sorted(os.listdir(self.directory)), equal_to(['a.deb', 'c.deb']))
+
+    def new_file(self, name, content):
+        filename = os.path.join(self.tmp_dir.name, name)
+        with open(filename, 'wb') as f:
+            f.write(content)
+        return filename
+
+
+class TestMakeKey(TestCase):
+    def test_that_each_input_changes_the_key(self):
+        config = dict(_DEFAULT_CONFIG, template_dir=TEMPLATE_DIR)
+        metadata = {'namespace': 'foo', 'name': 'bar'}
+        key = make_key('1234', metadata, '21.02', config)
+
+        assert_that(make_key('1234', dict(metadata), '21.02', config), equal_to(key))
+        assert_that(make_key('5678', metadata, '21.02', config), is_not(key))
+        assert_that(make_key('1234', {'name': 'bar'}, '21.02', config), is_not(key))
+        assert_that(make_key('1234', metadata, '21.03', config), is_not(key))
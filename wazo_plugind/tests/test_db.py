@@ -1,6 +1,13 @@
 # Copyright 2017-2020 The Wazo Authors  (see the AUTHORS file)
 # SPDX-License-Identifier: GPL-3.0-or-later
 
+import copy
+import os
+import requests
+import tempfile
+import time
+import yaml
+
 from contextlib import contextmanager
 from unittest import TestCase
 from hamcrest import (
@@ -10,17 +17,26 @@ from hamcrest import (
     empty,
     equal_to,
     has_entries,
+    has_key,
+    less_than,
+    not_,
     raises,
+    same_instance,
 )
+from marshmallow import ValidationError
 from mock import Mock, patch
 
 from ..config import _DEFAULT_CONFIG
 from ..db import (
+    LAST_ITEM,
     iin,
     normalize_caseless,
+    MarketCache,
     MarketDB,
     MarketPluginUpdater,
     MarketProxy,
+    MarketSearchIndex,
+    MarketSnapshot,
     Plugin,
     PluginDB,
 )
@@ -29,6 +45,214 @@ from ..exceptions import InvalidSortParamException
 CURRENT_WAZO_VERSION = '17.12'
 
 
+def market_response(items=None, status_code=200, headers=None):
+    response = Mock(status_code=status_code, headers=headers or {})
+    response.json.return_value = {'items': items or []}
+    return response
+
+
+class TestMarketCache(TestCase):
+    def setUp(self):
+        with patch('wazo_plugind.db.MarketClient') as MarketClient:
+            self.client = MarketClient.return_value
+            self.cache = MarketCache({'host': 'market'}, ttl=60)
+        self.market_get = self.client.session.return_value.get
+        self.market_get.return_value = market_response([{'name': 'foo'}])
+
+    def test_that_the_market_is_fetched_once(self):
+        self.cache.get_content()
+        result = self.cache.get_content()
+
+        assert_that(result, contains(has_entries(name='foo')))
+        self.market_get.assert_called_once()
+
+    def test_that_expired_content_is_served_while_refreshing(self):
+        self.cache.get_content()
+        self.cache._snapshot.fetched_at = time.time() - 120
+        self.market_get.return_value = market_response([{'name': 'bar'}])
+
+        with patch('wazo_plugind.db.Thread') as Thread:
+            result = self.cache.get_content()
+
+        assert_that(result, contains(has_entries(name='foo')))
+        Thread.assert_called_once_with(
+            target=self.cache._refresh, name='market-cache-refresh'
+        )
+
+        self.cache._refresh()
+
+        assert_that(self.cache.get_content(), contains(has_entries(name='bar')))
+
+    def test_invalidate(self):
+        self.cache.get_content()
+        self.market_get.return_value = market_response([{'name': 'bar'}])
+
+        self.cache.invalidate()
+        result = self.cache.get_content()
+
+        assert_that(result, contains(has_entries(name='bar')))
+
+    def test_that_an_http_error_is_raised_without_content(self):
+        response = market_response(status_code=500)
+        response.raise_for_status.side_effect = requests.exceptions.HTTPError(
+            response=response
+        )
+        self.market_get.return_value = response
+
+        assert_that(
+            calling(self.cache.get_snapshot),
+            raises(requests.exceptions.HTTPError),
+        )
+
+    def test_that_a_failed_refresh_is_not_retried_before_the_ttl(self):
+        snapshot = self.cache.get_snapshot()
+        snapshot.fetched_at = time.time() - 120
+        self.market_get.side_effect = requests.exceptions.ConnectionError
+        self.cache._refresh()
+
+        with patch('wazo_plugind.db.Thread') as Thread:
+            result = self.cache.get_snapshot()
+
+        assert_that(result.stale, equal_to(True))
+        Thread.assert_not_called()
+
+        self.cache._refresh_failed_at -= 60
+        with patch('wazo_plugind.db.Thread') as Thread:
+            self.cache.get_snapshot()
+
+        Thread.assert_called_once_with(
+            target=self.cache._refresh, name='market-cache-refresh'
+        )
+
+    def test_that_the_stale_content_is_served_on_http_errors(self):
+        snapshot = self.cache.get_snapshot()
+        snapshot.fetched_at = time.time() - 120
+        response = market_response(status_code=503)
+        response.raise_for_status.side_effect = requests.exceptions.HTTPError(
+            response=response
+        )
+        self.market_get.return_value = response
+
+        self.cache._refresh()
+
+        result = self.cache.get_snapshot()
+        assert_that(result.items, contains(has_entries(name='foo')))
+        assert_that(result.stale, equal_to(True))
+
+    def test_that_the_snapshot_is_kept_when_not_modified(self):
+        self.market_get.return_value = market_response(
+            [{'name': 'foo'}], headers={'ETag': '"v1"'}
+        )
+        snapshot = self.cache.get_snapshot()
+        snapshot.fetched_at = time.time() - 120
+        self.market_get.return_value = market_response(status_code=304)
+
+        self.cache._refresh()
+
+        result = self.cache.get_snapshot()
+        assert_that(result, same_instance(snapshot))
+        assert_that(result.age(), less_than(60))
+        _, kwargs = self.market_get.call_args
+        assert_that(kwargs['headers'], has_entries({'If-None-Match': '"v1"'}))
+
+    def test_that_invalidate_does_not_send_a_conditional_request(self):
+        self.market_get.return_value = market_response(
+            [{'name': 'foo'}], headers={'ETag': '"v1"'}
+        )
+        self.cache.get_content()
+
+        self.cache.invalidate()
+        self.cache.get_content()
+
+        _, kwargs = self.market_get.call_args
+        assert_that(kwargs['headers'], not_(has_key('If-None-Match')))
+
+
+class TestMarketCacheSnapshotFile(TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.snapshot_file = os.path.join(self.tmp_dir.name, 'market.json')
+        self.client = Mock()
+        self.market_get = self.client.session.return_value.get
+        self.market_get.return_value = market_response([{'name': 'foo'}])
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_that_the_fetched_content_is_loaded_at_startup(self):
+        self.new_cache().get_content()
+        self.market_get.side_effect = requests.exceptions.ConnectionError
+
+        cache = self.new_cache()
+        with patch('wazo_plugind.db.Thread') as Thread:
+            result = cache.get_snapshot()
+
+        assert_that(result.items, contains(has_entries(name='foo')))
+        assert_that(result.stale, equal_to(True))
+        Thread.assert_called_once_with(
+            target=cache._refresh, name='market-cache-refresh'
+        )
+
+    def test_that_the_loaded_content_is_refreshed_with_a_conditional_request(self):
+        headers = {'ETag': '"v1"', 'Last-Modified': 'Wed, 21 Oct 2020 07:28:00 GMT'}
+        self.market_get.return_value = market_response(
+            [{'name': 'foo'}], headers=headers
+        )
+        self.new_cache().get_content()
+        self.market_get.return_value = market_response(status_code=304)
+
+        cache = self.new_cache()
+        cache._refresh()
+
+        _, kwargs = self.market_get.call_args
+        assert_that(
+            kwargs['headers'],
+            has_entries(
+                {
+                    'If-None-Match': '"v1"',
+                    'If-Modified-Since': 'Wed, 21 Oct 2020 07:28:00 GMT',
+                }
+            ),
+        )
+        assert_that(cache.get_snapshot().stale, equal_to(False))
+
+    def test_that_the_stale_content_is_served_when_the_market_is_unreachable(self):
+        cache = self.new_cache()
+        cache.get_content()
+        cache.invalidate()
+        self.market_get.side_effect = requests.exceptions.ConnectionError
+
+        result = cache.get_snapshot()
+
+        assert_that(result.items, contains(has_entries(name='foo')))
+        assert_that(result.stale, equal_to(True))
+
+    def test_that_the_error_is_raised_without_content(self):
+        cache = self.new_cache()
+        self.market_get.side_effect = requests.exceptions.ConnectionError
+
+        assert_that(
+            calling(cache.get_snapshot),
+            raises(requests.exceptions.ConnectionError),
+        )
+
+    def test_that_an_invalid_snapshot_file_is_ignored(self):
+        with open(self.snapshot_file, 'w') as f:
+            f.write('{"items"')
+
+        result = self.new_cache().get_snapshot()
+
+        assert_that(result.items, contains(has_entries(name='foo')))
+        assert_that(result.stale, equal_to(False))
+
+    def new_cache(self):
+        with patch('wazo_plugind.db.MarketClient') as MarketClient:
+            MarketClient.return_value = self.client
+            return MarketCache(
+                {'host': 'market'}, ttl=60, snapshot_file=self.snapshot_file
+            )
+
+
 class TestMarketPluginUpdater(TestCase):
     def setUp(self):
         self.uninstalled_plugin = Mock()
@@ -158,6 +382,68 @@ class TestMarketPluginUpdater(TestCase):
         self.plugin_db.get_plugin.return_value = self.uninstalled_plugin
 
 
+class TestMarketPluginUpdaterWithASnapshot(TestCase):
+    def setUp(self):
+        self.content = [
+            {
+                'namespace': 'foobar',
+                'name': 'foo',
+                'versions': [
+                    {'version': '0.0.3', 'min_wazo_version': '17.13'},
+                    {'version': '0.0.2'},
+                    {'version': '0.0.1'},
+                ],
+            },
+        ]
+        self.snapshot = MarketSnapshot(self.content)
+        self.market_proxy = Mock(MarketProxy)
+        self.market_proxy.get_snapshot.return_value = self.snapshot
+        self.plugin_db = Mock(PluginDB)
+        self.plugin_db.installed_versions.return_value = {('foobar', 'foo'): '0.0.1'}
+
+    def test_update(self):
+        updater = self.new_updater()
+
+        result = updater.update(copy.deepcopy(self.content[0]))
+
+        assert_that(
+            result,
+            has_entries(
+                installed_version='0.0.1',
+                versions=contains(
+                    has_entries(upgradable=False),
+                    has_entries(upgradable=True),
+                    has_entries(upgradable=False),
+                ),
+            ),
+        )
+        self.plugin_db.get_plugin.assert_not_called()
+
+    def test_that_the_snapshot_values_are_reused(self):
+        self.new_updater().update(copy.deepcopy(self.content[0]))
+
+        with patch('wazo_plugind.db.MarketUpgradability') as MarketUpgradability:
+            self.new_updater().update(copy.deepcopy(self.content[0]))
+
+            MarketUpgradability.assert_not_called()
+
+        self.plugin_db.installed_versions.return_value = {}
+
+        result = self.new_updater().update(copy.deepcopy(self.content[0]))
+
+        assert_that(result, has_entries(installed_version=None))
+
+    def test_upgradable_versions(self):
+        result = self.new_updater().upgradable_versions('foobar', 'foo')
+
+        assert_that(result, contains(has_entries(version='0.0.2')))
+
+    def new_updater(self):
+        return MarketPluginUpdater(
+            self.plugin_db, CURRENT_WAZO_VERSION, self.market_proxy
+        )
+
+
 class TestPlugin(TestCase):
     def test_is_installed_no_arguments(self):
         namespace, name = 'foo', 'bar'
@@ -188,6 +474,93 @@ class TestPlugin(TestCase):
             assert_that(plugin.is_installed('0.0.1-5'), equal_to(False))
 
 
+class TestPluginDB(TestCase):
+    def setUp(self):
+        self.metadata_dir = tempfile.TemporaryDirectory()
+        self.dpkg_status_file = os.path.join(self.metadata_dir.name, 'status')
+        with open(self.dpkg_status_file, 'w'):
+            pass
+        self.config = dict(
+            _DEFAULT_CONFIG,
+            metadata_dir=self.metadata_dir.name,
+            dpkg_status_file=self.dpkg_status_file,
+        )
+        self.db = PluginDB(self.config)
+        self.db._debian_package_db = Mock()
+        self.db._debian_package_db.list_installed_packages.return_value = [
+            'wazo-plugind-foo-bar',
+        ]
+
+    def tearDown(self):
+        self.metadata_dir.cleanup()
+
+    def test_list_and_count(self):
+        self.add_metadata('bar', 'foo', 'version: 0.0.1')
+
+        assert_that(self.db.list_(), contains(has_entries(version='0.0.1')))
+        assert_that(self.db.count(), equal_to(1))
+
+    def test_that_the_index_is_reused_when_nothing_changed(self):
+        self.add_metadata('bar', 'foo', 'version: 0.0.1')
+
+        with patch('wazo_plugind.db.yaml.safe_load', wraps=yaml.safe_load) as load:
+            self.db.list_()
+            self.db.count()
+            self.db.get_plugin('bar', 'foo').metadata()
+
+        load.assert_called_once()
+        self.db._debian_package_db.list_installed_packages.assert_called_once()
+
+    def test_that_the_index_is_rebuilt_when_dpkg_status_changes(self):
+        self.add_metadata('bar', 'foo', 'version: 0.0.1')
+        self.db.list_()
+
+        self.db._debian_package_db.list_installed_packages.return_value = []
+        self.touch(self.dpkg_status_file)
+
+        assert_that(self.db.list_(), empty())
+        assert_that(self.db.installed_plugins(), empty())
+
+    def test_that_modified_metadata_are_reloaded(self):
+        filename = self.add_metadata('bar', 'foo', 'version: 0.0.1')
+        self.db.list_()
+
+        with open(filename, 'w') as f:
+            f.write('version: 0.0.2')
+        self.touch(filename)
+
+        assert_that(self.db.is_installed('bar', 'foo', '0.0.2'), equal_to(True))
+
+    def test_installed_plugins(self):
+        self.db._debian_package_db.list_installed_packages.return_value = [
+            'wazo-plugind-foo-bar',
+            'wazo-plugind-removed-bar',
+            'not-a-plugin',
+        ]
+        self.add_metadata('bar', 'foo', 'version: 0.0.1')
+
+        result = self.db.installed_plugins()
+
+        assert_that(result, equal_to({('bar', 'foo')}))
+
+    def add_metadata(self, namespace, name, content):
+        filename = os.path.join(
+            self.metadata_dir.name,
+            namespace,
+            name,
+            self.config['default_metadata_filename'],
+        )
+        os.makedirs(os.path.dirname(filename))
+        with open(filename, 'w') as f:
+            f.write(content)
+        return filename
+
+    @staticmethod
+    def touch(filename):
+        mtime = os.stat(filename).st_mtime_ns + 1000000000
+        os.utime(filename, ns=(mtime, mtime))
+
+
 class TestIIn(TestCase):
     def test_iin(self):
         truth = [
@@ -206,6 +579,54 @@ class TestIIn(TestCase):
             assert_that(result, equal_to(False))
 
 
+class TestMarketSearchIndex(TestCase):
+    def setUp(self):
+        self.items = [
+            {'name': 'François', 'tags': ['foobar', ['nested']], 'd': {'key': 'v'}},
+            {'name': 'pépé', 'versions': [{'version': '0.1.1'}], 'size': 42},
+            {'name': 'abc', 'description': 'Ça marche', 'tags': ('tuple',)},
+        ]
+        self.index = MarketSearchIndex(self.items)
+
+    def test_search_matches_iin_on_every_value(self):
+        searches = [
+            'fran',
+            'FRAN',
+            'ç',
+            'ca m',
+            'pe',
+            'PÉPÉ',
+            'foobar',
+            'obar',
+            'nested',
+            'key',
+            'version',
+            '0.1',
+            '42',
+            'tuple',
+            'a',
+            'zzz',
+            'v',
+        ]
+
+        for search in searches:
+            expected = [item for item in self.items if self.iin_filter(search, item)]
+            result = self.index.search(search)
+            assert_that(result, equal_to(expected), search)
+
+    @staticmethod
+    def iin_filter(search, item):
+        for value in item.values():
+            if iin(search, value):
+                return True
+            if not isinstance(value, (list, tuple)):
+                continue
+            for element in value:
+                if iin(search, element):
+                    return True
+        return False
+
+
 class TestNormalizeCaseless(TestCase):
     def test_normalize_caseless(self):
         data = [
@@ -258,8 +679,10 @@ class TestMarketDB(TestCase):
             },
         ]
         self.market_proxy = Mock(MarketProxy)
-        self.market_proxy.get_content.return_value = self.content
-        self.db = MarketDB(self.market_proxy, CURRENT_WAZO_VERSION)
+        self.market_proxy.get_snapshot.return_value = MarketSnapshot(self.content)
+        self.plugin_db = Mock(PluginDB)
+        self.plugin_db.installed_plugins.return_value = {('c', 'a'), ('a', None)}
+        self.db = MarketDB(self.market_proxy, CURRENT_WAZO_VERSION, self.plugin_db)
         self.db._updater = Mock(MarketPluginUpdater)
 
     def test_the_installed_param(self):
@@ -268,6 +691,33 @@ class TestMarketDB(TestCase):
         results = self.db.list_(installed=True)
         assert_that(results, contains(a, c))
 
+        results = self.db.list_(installed=False)
+        assert_that(results, contains(b))
+
+    def test_that_only_the_returned_items_are_updated(self):
+        a, b, c = self.content
+
+        results = self.db.list_(limit=1)
+        assert_that(results, contains(a))
+        self.db._updater.update.assert_called_once_with(a)
+
+        self.db._updater.update.reset_mock()
+
+        result = self.db.get('c', 'a')
+        assert_that(result, equal_to(a))
+        self.db._updater.update.assert_called_once_with(a)
+
+    def test_that_the_market_content_is_not_modified(self):
+        def update(metadata):
+            metadata['installed_version'] = '42'
+
+        self.db._updater.update.side_effect = update
+
+        results = self.db.list_(limit=1)
+
+        assert_that(results, contains(has_entries(installed_version='42')))
+        assert_that(self.content[0], has_entries(installed_version='0.0.1'))
+
     def test_list_with_strict_filter(self):
         a, b, c = self.content
 
@@ -282,8 +732,43 @@ class TestMarketDB(TestCase):
         )  # Not full match on author
         assert_that(results, empty())
 
+    def test_query(self):
+        content = [
+            {'namespace': 'foo', 'name': 'bar', 'extra': 1, 'versions': []},
+            {'namespace': 'foo', 'name': 'baz', 'versions': [{'version': '0.0.1'}]},
+            {'namespace': 'other', 'name': 'bar', 'versions': []},
+        ]
+        self.market_proxy.get_snapshot.return_value = MarketSnapshot(content)
+
+        result = self.db.query(namespace='foo', order='name', limit=1, offset=1)
+
+        assert_that(
+            result,
+            has_entries(
+                total=3,
+                filtered=2,
+                items=contains(
+                    equal_to(
+                        {
+                            'namespace': 'foo',
+                            'name': 'baz',
+                            'installed_version': None,
+                            'versions': [{'version': '0.0.1', 'upgradable': False}],
+                        }
+                    )
+                ),
+            ),
+        )
+        self.db._updater.update.assert_called_once()
+
+    def test_query_invalid_item(self):
+        content = [{'namespace': 'foo', 'name': 'BAR', 'versions': []}]
+        self.market_proxy.get_snapshot.return_value = MarketSnapshot(content)
+
+        assert_that(calling(self.db.query), raises(ValidationError))
+
     def test_get(self):
-        self.market_proxy.get_content.return_value = expected_result = [
+        expected_result = [
             {
                 'namespace': 'foo',
                 'name': 'bar',
@@ -294,6 +779,7 @@ class TestMarketDB(TestCase):
                 ],
             },
         ]
+        self.market_proxy.get_snapshot.return_value = MarketSnapshot(expected_result)
 
         result = self.db.get('foo', 'bar')
         assert_that(result, expected_result)
@@ -336,6 +822,46 @@ class TestMarketDB(TestCase):
             raises(InvalidSortParamException),
         )
 
+    def test_partial_sort(self):
+        content = [{'name': 'plugin-{}'.format(i % 7)} for i in range(40)]
+        content += [{'namespace': 'no-name-{}'.format(i)} for i in range(10)]
+        self.market_proxy.get_snapshot.return_value = MarketSnapshot(content)
+
+        for order in ('name', 'namespace', 'tags'):
+            for direction in ('asc', 'desc'):
+                for offset, limit in ((0, 1), (0, 5), (3, 5)):
+                    expected = sorted(
+                        content,
+                        key=lambda item: item.get(order, LAST_ITEM),
+                        reverse=direction == 'desc',
+                    )[offset:][:limit]
+
+                    results = self.db.list_(
+                        order=order, direction=direction, limit=limit, offset=offset
+                    )
+
+                    assert_that(results, equal_to(expected))
+
+    def test_sort_with_values_that_are_not_orderable(self):
+        content = [{'name': 'a'}, {'name': 42}] + [{'name': 'b'}] * 10
+        self.market_proxy.get_snapshot.return_value = MarketSnapshot(content)
+
+        assert_that(
+            calling(self.db.list_).with_args(order='name', limit=1),
+            raises(InvalidSortParamException),
+        )
+
+    def test_partial_sort_with_values_that_are_not_orderable(self):
+        content = [{'version': 2}, {}, {'version': 'b'}, {'version': 'a'}, {}, {}]
+        self.market_proxy.get_snapshot.return_value = MarketSnapshot(content)
+
+        assert_that(
+            calling(self.db.list_).with_args(
+                order='version', direction='desc', limit=1
+            ),
+            raises(InvalidSortParamException),
+        )
+
     def test_limit(self):
         a, b, c = self.content
 
@@ -7,11 +7,11 @@ import tempfile
 from unittest import TestCase
 from string import ascii_lowercase
 from operator import itemgetter
-from hamcrest import assert_that, contains_inanyorder, equal_to
-from mock import sentinel as s
+from hamcrest import assert_that, contains, contains_inanyorder, empty, equal_to
+from mock import patch, sentinel as s
 from jinja2 import DictLoader, Environment
 from ..context import Context
-from ..debian import Generator, PackageDB
+from ..debian import DpkgStatusReader, Generator, PackageDB
 from ..config import _DEFAULT_CONFIG
 
 
@@ -62,6 +62,99 @@ class TestPackageDB(TestCase):
         assert_that(installed_packages_and_sections, contains_inanyorder(*expected))
 
 
+DPKG_STATUS = '''\
+Package: adduser
+Status: install ok installed
+Priority: important
+Section: admin
+Version: 3.118
+Description: add and remove users and groups
+ Package: not-a-field
+ Section: wazo-plugind-plugin
+
+Package: wazo-plugind-foo-bar
+Status: install ok installed
+Section: wazo-plugind-plugin
+Version: 0.0.1
+Depends: wazo-plugind-baz-bar
+
+Package: wazo-plugind-removed-bar
+Status: deinstall ok config-files
+Section: wazo-plugind-plugin
+Version: 0.0.1
+
+Package: wazo-plugind-baz-bar
+Status: install ok installed
+Section: wazo-plugind-plugin
+Version: 1.0.0
+'''
+
+
+class TestDpkgStatusReader(TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.status_file = os.path.join(self.tmp_dir.name, 'status')
+        with open(self.status_file, 'w') as f:
+            f.write(DPKG_STATUS)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_all_sections(self):
+        reader = DpkgStatusReader(self.status_file)
+
+        result = list(reader())
+
+        assert_that(
+            result,
+            contains(
+                'adduser admin',
+                'wazo-plugind-foo-bar wazo-plugind-plugin',
+                'wazo-plugind-baz-bar wazo-plugind-plugin',
+            ),
+        )
+
+    def test_selected_section(self):
+        reader = DpkgStatusReader(self.status_file, 'wazo-plugind-plugin')
+
+        result = list(reader())
+
+        assert_that(
+            result,
+            contains(
+                'wazo-plugind-foo-bar wazo-plugind-plugin',
+                'wazo-plugind-baz-bar wazo-plugind-plugin',
+            ),
+        )
+
+    def test_that_the_status_file_is_only_read_when_modified(self):
+        reader = DpkgStatusReader(self.status_file, 'wazo-plugind-plugin')
+        list(reader())
+
+        with patch.object(reader, '_read') as read:
+            list(reader())
+            read.assert_not_called()
+
+        with open(self.status_file, 'w') as f:
+            f.write('')
+        mtime = os.stat(self.status_file).st_mtime_ns + 1000000000
+        os.utime(self.status_file, ns=(mtime, mtime))
+
+        assert_that(list(reader()), empty())
+
+    def test_missing_status_file(self):
+        reader = DpkgStatusReader(os.path.join(self.tmp_dir.name, 'missing'))
+
+        assert_that(list(reader()), empty())
+
+    def test_with_the_package_db(self):
+        db = PackageDB(DpkgStatusReader(self.status_file))
+
+        result = db.list_installed_packages('wazo-plugind-plugin')
+
+        assert_that(result, contains('wazo-plugind-foo-bar', 'wazo-plugind-baz-bar'))
+
+
 class TestDebianGenerator(TestCase):
     def test_make_template_ctx_adds_all_necessary_fields(self):
         depends = [
@@ -0,0 +1,136 @@
+# Copyright 2021 The Wazo Authors  (see the AUTHORS file)
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+from hamcrest import (
+    assert_that,
+    contains,
+    contains_inanyorder,
+    empty,
+    has_entries,
+)
+from mock import Mock
+from unittest import TestCase
+
+from ..db import MarketDB
+from ..dependency import DependencyPlanner
+from ..exceptions import DependencyCycleException
+
+
+def dep(name, **kwargs):
+    return dict(namespace='foo', name=name, **kwargs)
+
+
+class TestDependencyPlanner(TestCase):
+    def setUp(self):
+        self.market = {}
+        self.market_db = Mock(MarketDB)
+        self.market_db.get.side_effect = self.get
+        self.planner = DependencyPlanner(self.market_db)
+
+    def get(self, namespace, name):
+        try:
+            return self.market[name]
+        except KeyError:
+            raise LookupError(name)
+
+    def test_that_dependencies_are_planned_by_level(self):
+        self.market['a'] = {'depends': [dep('c')]}
+        self.market['b'] = {'depends': [dep('c'), dep('d')]}
+        self.market['c'] = {'depends': [dep('d')]}
+
+        result = self.planner.plan(dep('root', depends=[dep('a'), dep('b')]))
+
+        assert_that(
+            result,
+            contains(
+                contains(has_entries(name='d')),
+                contains(has_entries(name='c')),
+                contains_inanyorder(has_entries(name='a'), has_entries(name='b')),
+            ),
+        )
+
+    def test_that_the_depends_of_the_required_version_are_used(self):
+        self.market['a'] = {
+            'depends': [dep('b')],
+            'versions': [
+                {'version': '2.0.0', 'depends': [dep('b')]},
+                {'version': '1.0.0', 'depends': []},
+            ],
+        }
+
+        result = self.planner.plan(dep('root', depends=[dep('a', version='1.0.0')]))
+
+        assert_that(result, contains(contains(has_entries(name='a'))))
+
+    def test_that_invalid_and_unknown_dependencies_are_leaves(self):
+        self.market['a'] = {'depends': [{'name': 'invalid'}]}
+
+        result = self.planner.plan(dep('root', depends=[dep('a'), dep('unknown')]))
+
+        assert_that(
+            result,
+            contains(
+                contains_inanyorder(has_entries(name='a'), has_entries(name='unknown'))
+            ),
+        )
+
+    def test_plan_all(self):
+        self.market['a'] = {'depends': [dep('c')]}
+        self.market['b'] = {'depends': [dep('c')]}
+
+        result = self.planner.plan_all([dep('a'), dep('b'), dep('c')])
+
+        assert_that(
+            result,
+            contains(
+                contains(has_entries(name='c')),
+                contains(has_entries(name='a'), has_entries(name='b')),
+            ),
+        )
+
+    def test_no_dependencies(self):
+        assert_that(self.planner.plan(dep('root')), empty())
+
+    def test_that_cycles_are_detected(self):
+        self.market['a'] = {'depends': [dep('b')]}
+        self.market['b'] = {'depends': [dep('root')]}
+
+        try:
+            self.planner.plan(dep('root', depends=[dep('a')]))
+        except DependencyCycleException as e:
+            assert_that(
+                e.details['depends'],
+                has_entries(cycle=contains('foo/root', 'foo/a', 'foo/b', 'foo/root')),
+            )
+        else:
+            self.fail('DependencyCycleException not raised')
+
+    def test_install_plan(self):
+        self.market['root'] = {
+            'depends': [dep('a'), dep('b')],
+            'versions': [{'version': '1.1.0', 'upgradable': True}],
+        }
+        self.market['a'] = {
+            'installed_version': '1.0.0',
+            'versions': [{'version': '1.0.0', 'upgradable': False}],
+        }
+        self.market['b'] = {
+            'debian_depends': ['curl'],
+            'versions': [{'version': '2.0.0', 'upgradable': True}],
+        }
+
+        result = self.planner.install_plan(dep('root'), reinstall=False)
+
+        assert_that(
+            result,
+            has_entries(
+                items=contains(
+                    has_entries(name='a', satisfied=True, version=None),
+                    has_entries(name='b', satisfied=False, version='2.0.0'),
+                    has_entries(name='root', satisfied=False, version='1.1.0'),
+                ),
+                total=3,
+                debian_depends=contains('curl'),
+                apt_get_update=True,
+            ),
+        )
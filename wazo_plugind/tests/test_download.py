@@ -1,14 +1,92 @@
 # Copyright 2018-2020 The Wazo Authors  (see the AUTHORS file)
 # SPDX-License-Identifier: GPL-3.0-or-later
 
+import os
+import subprocess
+import tempfile
+
 from hamcrest import assert_that, equal_to
-from mock import Mock
+from mock import Mock, patch
 from unittest import TestCase
 
 from wazo_plugind import context, download
 from wazo_plugind.config import _DEFAULT_CONFIG
 
 
+class TestGitCache(TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.cache_dir = os.path.join(self.tmp_dir.name, 'cache')
+        self.cache = download.GitCache(self.cache_dir, max_size_mb=1)
+        self.upstream = self.new_repository('upstream', 'v1')
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_clone(self):
+        filename = os.path.join(self.tmp_dir.name, 'first')
+
+        self.cache.clone(self.upstream, 'master', filename)
+
+        assert_that(self.read(filename), equal_to('v1'))
+
+        self.write(self.upstream, 'v2')
+        filename = os.path.join(self.tmp_dir.name, 'second')
+
+        self.cache.clone(self.upstream, 'master', filename)
+
+        assert_that(self.read(filename), equal_to('v2'))
+        mirror = self.cache._mirror_path(self.upstream)
+        assert_that(os.listdir(self.cache_dir), equal_to([os.path.basename(mirror)]))
+
+    def test_that_a_fetch_is_shared_by_waiting_installs(self):
+        filename = os.path.join(self.tmp_dir.name, 'first')
+        self.cache.clone(self.upstream, 'master', filename)
+        mirror = self.cache._mirror_path(self.upstream)
+
+        with patch.object(self.cache, '_fetch') as fetch:
+            self.cache._fetched_at[mirror] = float('inf')
+            self.cache.clone(self.upstream, 'master', filename + '2')
+
+        fetch.assert_not_called()
+
+    def test_that_the_least_recently_used_mirrors_are_evicted(self):
+        self.cache = download.GitCache(self.cache_dir, max_size_mb=0)
+        other = self.new_repository('other', 'other')
+
+        self.cache.clone(self.upstream, 'master', os.path.join(self.tmp_dir.name, 'a'))
+        self.cache.clone(other, 'master', os.path.join(self.tmp_dir.name, 'b'))
+
+        mirror = self.cache._mirror_path(other)
+        assert_that(os.listdir(self.cache_dir), equal_to([os.path.basename(mirror)]))
+
+    def new_repository(self, name, content):
+        path = os.path.join(self.tmp_dir.name, name)
+        self.git(self.tmp_dir.name, 'init', '-q', '-b', 'master', name)
+        self.write(path, content)
+        return path
+
+    def write(self, path, content):
+        with open(os.path.join(path, 'content'), 'w') as f:
+            f.write(content)
+        self.git(path, 'add', 'content')
+        self.git(path, 'commit', '-q', '-m', content)
+
+    def read(self, path):
+        with open(os.path.join(path, 'content')) as f:
+            return f.read()
+
+    def git(self, cwd, *args):
+        env = dict(
+            os.environ,
+            GIT_AUTHOR_NAME='test',
+            GIT_AUTHOR_EMAIL='test@example.com',
+            GIT_COMMITTER_NAME='test',
+            GIT_COMMITTER_EMAIL='test@example.com',
+        )
+        subprocess.check_call(['git'] + list(args), cwd=cwd, env=env)
+
+
 class TestMarketDownloader(TestCase):
     def setUp(self):
         self._main_downloader = Mock()
@@ -2,13 +2,15 @@
 # SPDX-License-Identifier: GPL-3.0-or-later
 
 import json
+import os
+import tempfile
 
 from functools import wraps
 from hamcrest import assert_that, equal_to, has_entries
 from mock import ANY, Mock, patch, sentinel
 from unittest import TestCase
 
-from ..exceptions import PluginNotFoundException
+from ..exceptions import JobNotFoundException, PluginNotFoundException
 from ..service import PluginService
 
 API_VERSION = '0.2'
@@ -60,36 +62,113 @@ class HTTPAppTestCase(TestCase):
         return result.status_code, json.loads(result.data.decode(encoding='utf-8'))
 
 
+class TestJobs(HTTPAppTestCase):
+
+    uuid = '4b0ab5e6-4d2a-4b55-9e4b-2f0b0d1c2f3e'
+
+    def setUp(self):
+        super().setUp()
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.log_filename = os.path.join(self.tmp_dir.name, 'job.log')
+        with open(self.log_filename, 'wb') as f:
+            f.write(b'0123456789')
+        self.plugin_service.get_job_log.return_value = self.log_filename
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_get_log(self):
+        result = self.app.get(self.url)
+
+        assert_that(result.status_code, equal_to(200))
+        assert_that(result.data, equal_to(b'0123456789'))
+
+    def test_get_log_range(self):
+        result = self.app.get(self.url, headers={'Range': 'bytes=4-'})
+
+        assert_that(result.status_code, equal_to(206))
+        assert_that(result.data, equal_to(b'456789'))
+
+    def test_follow_log_from_range(self):
+        self.plugin_service.follow_job_log.return_value = iter([b'456789', b'more'])
+
+        result = self.app.get(
+            self.url, query_string={'follow': True}, headers={'Range': 'bytes=4-'}
+        )
+
+        assert_that(result.status_code, equal_to(200))
+        assert_that(result.data, equal_to(b'456789more'))
+        self.plugin_service.follow_job_log.assert_called_once_with(self.uuid, 4)
+
+    def test_get_log_not_found(self):
+        self.plugin_service.get_job_log.side_effect = JobNotFoundException(self.uuid)
+
+        result = self.app.get(self.url)
+
+        assert_that(result.status_code, equal_to(404))
+
+    def test_get_log_invalid_uuid(self):
+        result = self.app.get('/0.2/jobs/../log')
+
+        assert_that(result.status_code, equal_to(404))
+        self.plugin_service.get_job_log.assert_not_called()
+
+    def test_list_jobs(self):
+        self.plugin_service.list_jobs.return_value = [{'uuid': self.uuid}]
+
+        result = self.app.get('/0.2/jobs')
+
+        assert_that(result.status_code, equal_to(200))
+        assert_that(
+            json.loads(result.data.decode('utf-8')),
+            equal_to({'items': [{'uuid': self.uuid}], 'total': 1}),
+        )
+
+    def test_get_job(self):
+        self.plugin_service.get_job.return_value = {'uuid': self.uuid}
+
+        result = self.app.get('/0.2/jobs/{}'.format(self.uuid))
+
+        assert_that(result.status_code, equal_to(200))
+        self.plugin_service.get_job.assert_called_once_with(self.uuid)
+
+    def test_get_job_not_found(self):
+        self.plugin_service.get_job.side_effect = JobNotFoundException(self.uuid)
+
+        result = self.app.get('/0.2/jobs/{}'.format(self.uuid))
+
+        assert_that(result.status_code, equal_to(404))
+
+    @property
+    def url(self):
+        return '/0.2/jobs/{}/log'.format(self.uuid)
+
+
 class TestMarket(HTTPAppTestCase):
     def test_that_get_returns_results_from_the_service(self):
-        self.plugin_service.count_from_market.return_value = 0
-        self.plugin_service.list_from_market.return_value = []
+        expected = {'total': 0, 'filtered': 0, 'items': []}
+        self.plugin_service.query_market.return_value = expected
 
         status_code, body = self.get()
 
-        expected = {
-            'total': self.plugin_service.count_from_market.return_value,
-            'filtered': self.plugin_service.count_from_market.return_value,
-            'items': self.plugin_service.list_from_market.return_value,
-        }
         assert_that(body, equal_to(expected))
         assert_that(status_code, equal_to(200))
 
     def test_errors_on_invalid_limit(self):
-        self.plugin_service.count_from_market.return_value = 0
-        self.plugin_service.list_from_market.return_value = []
-
         status_code, body = self.get(limit=-1)
 
         assert_that(status_code, equal_to(400))
 
     def test_that_extra_fields_are_used(self):
-        self.plugin_service.list_from_market.return_value = []
-        self.plugin_service.count_from_market.return_value = 0
+        self.plugin_service.query_market.return_value = {
+            'total': 0,
+            'filtered': 0,
+            'items': [],
+        }
 
         status_code, body = self.get(namespace='foobar')
 
-        self.plugin_service.list_from_market.assert_called_once_with(
+        self.plugin_service.query_market.assert_called_once_with(
             ANY,
             namespace='foobar',
             direction=ANY,
@@ -108,6 +187,12 @@ class TestMarket(HTTPAppTestCase):
 
         assert_that(status_code, equal_to(404))
 
+    def test_delete_cache(self):
+        result = self.app.delete('/0.2/market/cache')
+
+        assert_that(result.status_code, equal_to(204))
+        self.plugin_service.invalidate_market_cache.assert_called_once_with()
+
     def get(self, *args, **kwargs):
         base_url = '/0.2/market'
         headers = {'content-type': 'application/json'}
@@ -338,3 +423,47 @@ class TestPlugindAPI(TestCase):
         resource.add_resource.assert_called_once_with(
             restful_api, sentinel.config, sentinel.args, sentinel=sentinel.kwargs
         )
+
+
+class TestPluginsBulk(HTTPAppTestCase):
+    def test_bulk_install(self):
+        self.plugin_service.create_bulk.return_value = {'uuid': 'job', 'items': []}
+        plugins = [
+            {'method': 'market', 'options': {'name': 'foo', 'namespace': 'bar'}},
+            {'method': 'market', 'options': {'name': 'baz', 'namespace': 'bar'}},
+        ]
+
+        result = self.app.post(
+            '/{}/plugins/bulk'.format(API_VERSION),
+            data=json.dumps({'plugins': plugins}),
+            headers={'content-type': 'application/json'},
+        )
+
+        assert_that(result.status_code, equal_to(200))
+        self.plugin_service.create_bulk.assert_called_once_with(
+            plugins, {'reinstall': False}
+        )
+
+
+class TestPluginsPlan(HTTPAppTestCase):
+    def test_plan(self):
+        self.plugin_service.plan.return_value = {'items': [], 'total': 0}
+        options = {'name': 'foo', 'namespace': 'bar'}
+
+        status_code, response = self.post_plan({'method': 'market', 'options': options})
+
+        assert_that(status_code, equal_to(200))
+        assert_that(response, equal_to({'items': [], 'total': 0}))
+        self.plugin_service.plan.assert_called_once_with(
+            self.plugin_service.new_market_proxy.return_value,
+            options,
+            {'reinstall': False},
+        )
+
+    def post_plan(self, body):
+        result = self.app.post(
+            '/{}/plugins/plan'.format(API_VERSION),
+            data=json.dumps(body),
+            headers={'content-type': 'application/json'},
+        )
+        return result.status_code, json.loads(result.data.decode(encoding='utf-8'))
@@ -0,0 +1,61 @@
+# Copyright 2021 The Wazo Authors  (see the AUTHORS file)
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+import os
+import tempfile
+
+from hamcrest import assert_that, contains_inanyorder, ends_with, equal_to
+from unittest import TestCase
+
+from ..exceptions import JobNotFoundException
+from ..joblog import JobLogStore
+
+
+class TestJobLogStore(TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.directory = os.path.join(self.tmp_dir.name, 'jobs')
+        self.store = JobLogStore(self.directory, max_files=2, follow_timeout=0)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_write(self):
+        self.store.write('abc', 'step %s', 'downloading')
+
+        with open(self.store.get_filename('abc')) as f:
+            assert_that(f.read(), ends_with(' step downloading\n'))
+
+    def test_get_filename_unknown_job(self):
+        try:
+            self.store.get_filename('unknown')
+        except JobNotFoundException:
+            pass
+        else:
+            self.fail('JobNotFoundException not raised')
+
+    def test_follow(self):
+        os.makedirs(self.directory)
+        with open(self.store.filename('abc'), 'wb') as f:
+            f.write(b'0123456789')
+
+        content = self.store.follow('abc', offset=4)
+
+        assert_that(b''.join(content), equal_to(b'456789'))
+
+    def test_that_follow_stops_when_the_job_is_not_active(self):
+        store = JobLogStore(self.directory, max_files=2, follow_timeout=60)
+        store.write('abc', 'completed')
+
+        content = store.follow('abc', is_active=lambda: False)
+
+        assert_that(b''.join(content).decode('utf8'), ends_with(' completed\n'))
+
+    def test_that_the_oldest_logs_are_pruned(self):
+        for i, uuid in enumerate(['a', 'b', 'c']):
+            self.store.write(uuid, 'starting')
+            os.utime(self.store.filename(uuid), (i, i))
+
+        self.store.prune()
+
+        assert_that(os.listdir(self.directory), contains_inanyorder('b.log', 'c.log'))
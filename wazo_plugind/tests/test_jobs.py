@@ -0,0 +1,159 @@
+# Copyright 2021 The Wazo Authors  (see the AUTHORS file)
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+from hamcrest import (
+    assert_that,
+    contains,
+    equal_to,
+    has_entries,
+    none,
+    not_none,
+)
+from threading import Thread
+from unittest import TestCase
+
+from ..exceptions import JobNotFoundException
+from ..jobs import JobRegistry, install_key
+
+GIT_KEY = install_key('git', {'url': 'http://foo', 'ref': 'master'})
+MARKET_KEY = install_key('market', {'namespace': 'foo', 'name': 'bar'})
+
+
+class TestJobRegistry(TestCase):
+    def setUp(self):
+        self.registry = JobRegistry(history_size=2)
+
+    def test_that_steps_are_timed(self):
+        self.registry.queue('a', 'install', method='git')
+
+        assert_that(
+            self.registry.get('a'),
+            has_entries(status='queued', method='git', started_at=none(), steps=[]),
+        )
+
+        self.registry.update('a', 'install', 'starting')
+        self.registry.update('a', 'install', 'downloading')
+
+        assert_that(
+            self.registry.get('a'),
+            has_entries(
+                status='downloading',
+                started_at=not_none(),
+                ended_at=none(),
+                steps=contains(
+                    has_entries(
+                        name='starting', ended_at=not_none(), duration=not_none()
+                    ),
+                    has_entries(name='downloading', ended_at=none(), duration=none()),
+                ),
+            ),
+        )
+        assert_that(self.registry.is_active('a'), equal_to(True))
+
+    def test_that_an_ended_job_is_moved_to_the_history(self):
+        self.registry.queue('a', 'uninstall')
+        self.registry.update('a', 'uninstall', 'starting')
+        errors = {'error_id': 'removing-error'}
+
+        self.registry.update('a', 'uninstall', 'error', errors)
+
+        assert_that(
+            self.registry.get('a'),
+            has_entries(
+                status='error',
+                errors=errors,
+                ended_at=not_none(),
+                steps=contains(has_entries(name='starting', ended_at=not_none())),
+            ),
+        )
+        assert_that(self.registry.is_active('a'), equal_to(False))
+
+    def test_that_jobs_that_were_not_queued_are_registered(self):
+        self.registry.update('dependency', 'install', 'starting')
+
+        assert_that(
+            self.registry.get('dependency'),
+            has_entries(type='install', queued_at=not_none(), status='starting'),
+        )
+
+    def test_that_the_history_is_bounded(self):
+        for uuid in ('a', 'b', 'c'):
+            self.registry.queue(uuid, 'install')
+            self.registry.update(uuid, 'install', 'completed')
+        self.registry.queue('d', 'install')
+
+        jobs = self.registry.list_()
+
+        assert_that([job['uuid'] for job in jobs], equal_to(['d', 'c', 'b']))
+        try:
+            self.registry.get('a')
+        except JobNotFoundException:
+            pass
+        else:
+            self.fail('JobNotFoundException not raised')
+
+    def test_that_identical_installs_are_queued_once(self):
+        uuid = self.registry.queue('a', 'install', key=GIT_KEY)
+        joined = self.registry.queue('b', 'install', key=GIT_KEY)
+
+        assert_that(uuid, equal_to('a'))
+        assert_that(joined, equal_to('a'))
+        assert_that(self.registry.is_active('b'), equal_to(False))
+
+    def test_that_an_ended_job_is_not_joined(self):
+        self.registry.queue('a', 'install', key=GIT_KEY)
+        # the job ended without its key being released
+        self.registry._active.pop('a').done.set()
+
+        uuid = self.registry.queue('b', 'install', key=GIT_KEY)
+
+        assert_that(uuid, equal_to('b'))
+        assert_that(self.registry.is_active('b'), equal_to(True))
+
+    def test_that_a_dependency_waits_for_the_identical_job(self):
+        self.registry.queue('direct', 'install', key=MARKET_KEY)
+        self.registry.queue('parent', 'install', key=GIT_KEY)
+        self.registry.update('direct', 'install', 'starting')
+
+        running = self.registry.join('dependency', MARKET_KEY, 'parent')
+        assert_that(running, equal_to('direct'))
+
+        statuses = []
+        waiter = Thread(
+            target=lambda: statuses.append(self.registry.wait('parent', running))
+        )
+        waiter.start()
+        self.registry.update('direct', 'install', 'completed')
+        waiter.join(timeout=1)
+
+        assert_that(statuses, contains('completed'))
+        assert_that(self.registry.is_active('dependency'), equal_to(False))
+
+    def test_that_a_job_waiting_for_the_parent_is_not_joined(self):
+        self.registry.queue('a', 'install', key=GIT_KEY)
+        self.registry.queue('b', 'install', key=MARKET_KEY)
+        dependency_of_a = install_key('market', {'namespace': 'foo', 'name': 'dep'})
+        self.registry.queue('c', 'install', key=dependency_of_a, owner='b')
+        self.registry.update('a', 'install', 'starting')
+        self.registry.update('b', 'install', 'starting')
+        # a waits for c, which runs in the thread of b
+        assert_that(self.registry.join('a-dep', dependency_of_a, 'a'), equal_to('c'))
+
+        running = self.registry.join('b-dep', GIT_KEY, 'b')
+
+        assert_that(running, none())
+        assert_that(self.registry.is_active('b-dep'), equal_to(True))
+
+    def test_that_a_job_that_did_not_start_is_not_joined(self):
+        self.registry.queue('queued', 'install', key=MARKET_KEY)
+        self.registry.queue('parent', 'install', key=GIT_KEY)
+        self.registry.update('parent', 'install', 'starting')
+
+        running = self.registry.join('dependency', MARKET_KEY, 'parent')
+
+        assert_that(running, none())
+        assert_that(self.registry.is_active('dependency'), equal_to(True))
+        assert_that(
+            self.registry.queue('other', 'install', key=MARKET_KEY),
+            equal_to('queued'),
+        )
@@ -0,0 +1,239 @@
+# Copyright 2021 The Wazo Authors  (see the AUTHORS file)
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+import pickle
+import time
+
+from concurrent.futures import TimeoutError
+from hamcrest import assert_that, calling, contains, equal_to, has_length, raises
+from mock import Mock, patch
+from queue import Queue
+from threading import Event, Thread
+from unittest import TestCase
+
+from ..root_worker import (
+    BaseWorker,
+    CommandError,
+    RootWorker,
+    _CommandExecutor,
+    _serve,
+    _STOP,
+)
+
+
+class TestBaseWorker(TestCase):
+    def setUp(self):
+        self.worker = BaseWorker(command_timeout=0.1)
+        self.worker._process = Mock(is_alive=Mock(return_value=True))
+        self.worker._command_queue = Queue()
+        self.worker._result_queue = Queue()
+        self.worker._cancel_queue = Queue()
+        self.worker._result_thread.start()
+
+    def tearDown(self):
+        self.worker._result_queue.put(None)
+        self.worker._result_thread.join()
+
+    def test_that_results_are_matched_by_request_id(self):
+        first = self.worker.send_cmd('update', 'a')
+        second = self.worker.send_cmd('install', 'b', 'b.deb')
+
+        self.answer(second, 'second')
+        self.answer(first, 'first')
+
+        assert_that(first.result(timeout=1), equal_to('first'))
+        assert_that(second.result(timeout=1), equal_to('second'))
+
+    def test_that_the_command_is_sent_with_its_request_id(self):
+        future = self.worker.send_cmd('install', 'uuid', deb='b.deb')
+
+        request_id, payload = self.worker._command_queue.get_nowait()
+        assert_that(request_id, equal_to(future.request_id))
+        assert_that(
+            pickle.loads(payload), equal_to(('install', ('uuid',), {'deb': 'b.deb'}))
+        )
+
+    def test_that_commands_are_queued_in_order_of_request_id(self):
+        put = self.worker._command_queue.put
+
+        def slow_put(message):
+            time.sleep(0.001)
+            put(message)
+
+        self.worker._command_queue.put = slow_put
+        senders = [
+            Thread(target=lambda: [self.worker.send_cmd('update') for _ in range(10)])
+            for _ in range(4)
+        ]
+        for sender in senders:
+            sender.start()
+        for sender in senders:
+            sender.join()
+
+        queue = self.worker._command_queue
+        request_ids = [queue.get_nowait()[0] for _ in range(queue.qsize())]
+        assert_that(request_ids, equal_to(sorted(request_ids)))
+        assert_that(request_ids, has_length(40))
+
+    def test_that_errors_are_raised_to_the_caller(self):
+        future = self.worker.send_cmd('unknown')
+
+        self.worker._result_queue.put((future.request_id, 'unknown command', None))
+
+        assert_that(calling(future.result).with_args(timeout=1), raises(CommandError))
+
+    def test_that_a_cancelled_result_is_discarded(self):
+        cancelled = self.worker.send_cmd('update', 'a')
+        other = self.worker.send_cmd('update', 'b')
+
+        assert_that(self.worker.cancel(cancelled), equal_to(True))
+        assert_that(
+            self.worker._cancel_queue.get_nowait(), equal_to(cancelled.request_id)
+        )
+
+        self.answer(cancelled, 'cancelled')
+        self.answer(other, 'other')
+
+        assert_that(other.result(timeout=1), equal_to('other'))
+        assert_that(cancelled.cancelled(), equal_to(True))
+
+    def test_that_a_done_command_cannot_be_cancelled(self):
+        future = self.worker.send_cmd('update', 'a')
+        self.answer(future, True)
+        future.result(timeout=1)
+
+        assert_that(self.worker.cancel(future), equal_to(False))
+
+    def test_that_a_timeout_cancels_the_command(self):
+        assert_that(
+            calling(self.worker.send_cmd_and_wait).with_args('update', 'a'),
+            raises(TimeoutError),
+        )
+
+        request_id, _ = self.worker._command_queue.get_nowait()
+        assert_that(self.worker._cancel_queue.get_nowait(), equal_to(request_id))
+
+    def answer(self, future, result):
+        self.worker._result_queue.put((future.request_id, None, result))
+
+
+class TestServe(TestCase):
+    def setUp(self):
+        self.executor = Mock(_CommandExecutor)
+        self.command_queue = Queue()
+        self.result_queue = Queue()
+        self.cancel_queue = Queue()
+
+    def serve(self, *messages):
+        for message in messages:
+            self.command_queue.put(message)
+        self.command_queue.put(_STOP)
+        _serve(self.executor, self.command_queue, self.result_queue, self.cancel_queue)
+        return [
+            self.result_queue.get_nowait() for _ in range(self.result_queue.qsize())
+        ]
+
+    def test_that_commands_are_executed_until_stopped(self):
+        self.executor.execute.return_value = True
+
+        results = self.serve((0, command('update', 'a')), (1, command('update', 'b')))
+
+        assert_that(results, contains((0, None, True), (1, None, True)))
+        assert_that(self.command_queue.qsize(), equal_to(0))
+
+    def test_that_nothing_is_executed_after_stop(self):
+        self.command_queue.put(_STOP)
+
+        results = self.serve((0, command('update', 'a')))
+
+        assert_that(results, has_length(0))
+        self.executor.execute.assert_not_called()
+
+    def test_that_cancelled_commands_are_skipped(self):
+        self.cancel_queue.put(0)
+
+        results = self.serve((0, command('update', 'a')))
+
+        assert_that(results, contains((0, None, None)))
+        self.executor.execute.assert_not_called()
+
+    def test_that_invalid_commands_are_reported(self):
+        results = self.serve((0, b'invalid'))
+
+        ((request_id, error, _),) = results
+        assert_that(request_id, equal_to(0))
+        assert_that(error.startswith('invalid command'), equal_to(True))
+
+    def test_that_unknown_commands_are_reported(self):
+        self.executor.execute.side_effect = CommandError('unknown command "foo"')
+
+        results = self.serve((0, command('foo')))
+
+        assert_that(results, contains((0, 'unknown command "foo"', None)))
+
+
+def command(cmd, *args, **kwargs):
+    return pickle.dumps((cmd, args, kwargs))
+
+
+class TestRootWorkerUpdate(TestCase):
+    def setUp(self):
+        self.worker = RootWorker(apt_update_freshness=60)
+        self.send_cmd_and_wait = self.worker.send_cmd_and_wait = Mock(return_value=True)
+
+    def test_that_concurrent_updates_are_coalesced(self):
+        started, done = Event(), Event()
+
+        def update(*args):
+            started.set()
+            done.wait()
+            return True
+
+        self.send_cmd_and_wait.side_effect = update
+        results = []
+        first = Thread(target=lambda: results.append(self.worker.apt_get_update('a')))
+        first.start()
+        started.wait()
+        second = Thread(target=lambda: results.append(self.worker.apt_get_update('b')))
+        second.start()
+        done.set()
+        first.join()
+        second.join()
+
+        assert_that(results, contains(True, True))
+        self.send_cmd_and_wait.assert_called_once_with('update', 'a')
+
+    def test_that_a_fresh_update_is_reused(self):
+        self.worker.apt_get_update('a')
+        result = self.worker.apt_get_update('b')
+
+        assert_that(result, equal_to(True))
+        self.send_cmd_and_wait.assert_called_once_with('update', 'a')
+
+    def test_that_a_failed_update_is_not_reused(self):
+        self.send_cmd_and_wait.return_value = False
+
+        self.worker.apt_get_update('a')
+        self.worker.apt_get_update('b')
+
+        assert_that(self.send_cmd_and_wait.call_count, equal_to(2))
+
+
+class TestCommandExecutor(TestCase):
+    def setUp(self):
+        self.executor = _CommandExecutor()
+
+    @patch('wazo_plugind.root_worker.exec_and_log')
+    def test_install_batch(self, exec_and_log):
+        exec_and_log.return_value = Mock(returncode=0)
+
+        result = self.executor.execute('install_batch', 'uuid', ['/a.deb', '/b.deb'])
+
+        assert_that(result, equal_to(True))
+        (_, _, cmd), _ = exec_and_log.call_args
+        assert_that(
+            cmd,
+            equal_to(
+                ['apt-get', 'install', '-y', '-q', '--reinstall', '/a.deb', '/b.deb']
+            ),
+        )
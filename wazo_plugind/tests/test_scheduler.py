@@ -0,0 +1,85 @@
+# Copyright 2021 The Wazo Authors  (see the AUTHORS file)
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+import time
+
+from hamcrest import assert_that, calling, equal_to, raises
+from threading import Event, Lock, Thread
+from unittest import TestCase
+
+from ..exceptions import JobQueueFullException
+from ..scheduler import JobScheduler
+
+
+class TestJobScheduler(TestCase):
+    def setUp(self):
+        self.scheduler = JobScheduler(
+            max_jobs=1, max_queued_jobs=1, stages={'build': 2, 'download': 0}
+        )
+        self.done = Event()
+
+    def tearDown(self):
+        self.done.set()
+        self.scheduler.shutdown()
+
+    def test_that_jobs_are_refused_when_the_queue_is_full(self):
+        self.scheduler.submit(self.done.wait)
+        self.scheduler.submit(self.done.wait)
+
+        assert_that(
+            calling(self.scheduler.submit).with_args(self.done.wait),
+            raises(JobQueueFullException),
+        )
+
+    def test_that_finished_jobs_free_the_queue(self):
+        self.scheduler.submit(lambda: None).result(timeout=1)
+        self.scheduler.submit(lambda: None).result(timeout=1)
+        # the slots are released by a done callback that may run after result()
+        deadline = time.monotonic() + 1
+        while self.scheduler._admitted and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+        future = self.scheduler.submit(lambda: 'done')
+
+        assert_that(future.result(timeout=1), equal_to('done'))
+
+    def test_that_stages_are_limited(self):
+        lock = Lock()
+        running = []
+        started = []
+
+        def build():
+            with self.scheduler.stage('build'):
+                with lock:
+                    running.append(1)
+                    started.append(len(running))
+                self.done.wait(0.1)
+                with lock:
+                    running.pop()
+
+        threads = [Thread(target=build) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert_that(max(started), equal_to(2))
+
+    def test_that_unknown_and_unlimited_stages_do_not_block(self):
+        with self.scheduler.stage(None):
+            with self.scheduler.stage('download'):
+                pass
+
+    def test_that_a_stage_is_not_waited_for_twice_by_a_thread(self):
+        scheduler = JobScheduler(max_jobs=1, max_queued_jobs=0, stages={'install': 1})
+
+        def install():
+            with scheduler.stage('install'):
+                with scheduler.stage('install'):
+                    return 'installed'
+
+        try:
+            future = scheduler.submit(install)
+            assert_that(future.result(timeout=1), equal_to('installed'))
+        finally:
+            scheduler.shutdown()
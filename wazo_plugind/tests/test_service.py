@@ -1,14 +1,31 @@
 # Copyright 2017-2020 The Wazo Authors  (see the AUTHORS file)
 # SPDX-License-Identifier: GPL-3.0-or-later
 
+import requests
+from contextlib import contextmanager
 from unittest import TestCase
-from hamcrest import assert_that, calling, equal_to, has_properties
+from hamcrest import (
+    assert_that,
+    calling,
+    contains,
+    equal_to,
+    has_entries,
+    has_length,
+    has_properties,
+    is_not,
+)
 from mock import Mock, patch, sentinel as s
 from xivo_test_helpers.hamcrest.raises import raises
 
-from ..db import MarketDB, Plugin
+from ..db import MarketDB, MarketSnapshot, Plugin
 from ..config import _DEFAULT_CONFIG
-from ..exceptions import APIException, PluginNotFoundException
+from ..exceptions import (
+    APIException,
+    JobNotFoundException,
+    JobQueueFullException,
+    PluginNotFoundException,
+)
+from ..jobs import JobRegistry
 from ..service import PluginService
 
 
@@ -19,14 +36,19 @@ class TestPluginService(TestCase):
         self._executor = Mock()
         self._plugin_db = Mock()
         self._version_finder = Mock()
-        self._service = PluginService(
-            _DEFAULT_CONFIG,
-            self._publisher,
-            self._worker,
-            self._executor,
-            plugin_db=self._plugin_db,
-            wazo_version_finder=self._version_finder,
-        )
+        self._market_cache = Mock()
+        self._job_registry = JobRegistry(history_size=10)
+        with patch('wazo_plugind.service.jobs.get_job_registry') as get_job_registry:
+            get_job_registry.return_value = self._job_registry
+            self._service = PluginService(
+                _DEFAULT_CONFIG,
+                self._publisher,
+                self._worker,
+                self._executor,
+                plugin_db=self._plugin_db,
+                wazo_version_finder=self._version_finder,
+                market_cache=self._market_cache,
+            )
 
     def test_get_from_market(self):
         market_db = Mock(MarketDB)
@@ -50,6 +72,191 @@ class TestPluginService(TestCase):
                 raises(PluginNotFoundException),
             )
 
+    def test_new_market_proxy_uses_the_market_cache(self):
+        self._market_cache.get_snapshot.return_value = MarketSnapshot([s.plugin])
+
+        market_proxy = self._service.new_market_proxy()
+
+        assert_that(market_proxy.get_content(), equal_to([s.plugin]))
+        assert_that(market_proxy.get_content(), equal_to([s.plugin]))
+        self._market_cache.get_snapshot.assert_called_once_with()
+
+    def test_invalidate_market_cache(self):
+        self._service.invalidate_market_cache()
+
+        self._market_cache.invalidate.assert_called_once_with()
+
+    def test_create_market_incompatible(self):
+        plugin_info = {'versions': [{'max_wazo_version': '17.01', 'upgradable': False}]}
+
+        with self.market_plugin(plugin_info):
+            assert_that(
+                calling(self._service.create).with_args(
+                    'market', {'reinstall': False}, {'namespace': 'a', 'name': 'b'}
+                ),
+                raises(APIException).matching(
+                    has_properties('status_code', 400, 'id_', 'incompatible-plugin')
+                ),
+            )
+
+        self._executor.submit.assert_not_called()
+
+    def test_create_market_unknown_version(self):
+        plugin_info = {'versions': [{'version': '1.0.0', 'upgradable': True}]}
+        options = {'namespace': 'a', 'name': 'b', 'version': '2.0.0'}
+
+        with self.market_plugin(plugin_info):
+            assert_that(
+                calling(self._service.create).with_args(
+                    'market', {'reinstall': False}, options
+                ),
+                raises(APIException).matching(
+                    has_properties(
+                        'status_code', 404, 'id_', 'plugin-version-not-found'
+                    )
+                ),
+            )
+
+    def test_create_market_already_installed(self):
+        plugin_info = {
+            'installed_version': '1.0.0',
+            'versions': [{'version': '1.0.0', 'upgradable': False}],
+        }
+
+        with self.market_plugin(plugin_info):
+            uuid = self._service.create(
+                'market', {'reinstall': False}, {'namespace': 'a', 'name': 'b'}
+            )
+
+        self._executor.submit.assert_not_called()
+        (ctx, status), _ = self._publisher.install.call_args
+        assert_that(ctx, has_properties(uuid=uuid))
+        assert_that(status, equal_to('completed'))
+
+    def test_create_market_upgradable(self):
+        plugin_info = {
+            'installed_version': '1.0.0',
+            'versions': [{'version': '1.1.0', 'upgradable': True}],
+        }
+
+        with self.market_plugin(plugin_info):
+            self._service.create(
+                'market', {'reinstall': True}, {'namespace': 'a', 'name': 'b'}
+            )
+
+        self._executor.submit.assert_called_once()
+
+    def test_create_market_unavailable(self):
+        market_db = Mock(MarketDB)
+        errors = [
+            requests.exceptions.ConnectionError,
+            requests.exceptions.ReadTimeout,
+            requests.exceptions.HTTPError,
+        ]
+        for error in errors:
+            market_db.get.side_effect = error
+            with patch.object(self._service, '_new_market_db', return_value=market_db):
+                with patch('wazo_plugind.service.PackageAndInstallTask'):
+                    uuid = self._service.create(
+                        'market',
+                        {'reinstall': False},
+                        {'namespace': 'a', 'name': error.__name__},
+                    )
+
+            assert_that(self._executor.submit.call_args[0][1].uuid, equal_to(uuid))
+
+    def test_create_when_the_job_queue_is_full(self):
+        self._executor.submit.side_effect = JobQueueFullException()
+        options = {'url': 'http://foo', 'ref': 'master'}
+
+        with patch('wazo_plugind.service.PackageAndInstallTask'):
+            try:
+                self._service.create('git', {'reinstall': False}, options)
+            except JobQueueFullException:
+                pass
+            else:
+                self.fail('JobQueueFullException not raised')
+
+        uuid = self._executor.submit.call_args[0][1].uuid
+        assert_that(
+            calling(self._service.get_job).with_args(uuid),
+            raises(JobNotFoundException),
+        )
+
+    def test_that_an_identical_install_joins_the_running_job(self):
+        options = {'url': 'http://foo/', 'ref': 'master'}
+
+        with patch('wazo_plugind.service.PackageAndInstallTask'):
+            uuid = self._service.create('git', {'reinstall': False}, options)
+            result = self._service.create(
+                'git', {'reinstall': False}, {'url': 'http://foo', 'ref': 'master'}
+            )
+            other = self._service.create(
+                'git', {'reinstall': False}, {'url': 'http://foo', 'ref': 'v2'}
+            )
+            reinstall = self._service.create('git', {'reinstall': True}, options)
+
+        assert_that(result, equal_to(uuid))
+        assert_that(other, is_not(uuid))
+        assert_that(reinstall, is_not(uuid))
+        assert_that(self._executor.submit.call_count, equal_to(3))
+
+    def test_that_an_install_is_not_joined_once_ended(self):
+        options = {'url': 'http://foo', 'ref': 'master'}
+
+        with patch('wazo_plugind.service.PackageAndInstallTask'):
+            uuid = self._service.create('git', {'reinstall': False}, options)
+            self._job_registry.update(uuid, 'install', 'completed')
+            result = self._service.create('git', {'reinstall': False}, options)
+
+        assert_that(result, is_not(uuid))
+
+    def test_create_bulk_joins_the_running_jobs(self):
+        git = {'method': 'git', 'options': {'url': 'http://foo', 'ref': 'master'}}
+
+        with patch('wazo_plugind.service.PackageAndInstallTask'):
+            uuid = self._service.create('git', {'reinstall': False}, git['options'])
+        with patch('wazo_plugind.service.BulkInstallTask'):
+            result = self._service.create_bulk([git], {'reinstall': False})
+
+        assert_that(result['items'], contains(has_entries(uuid=uuid)))
+        (_, _, item_contexts), _ = self._executor.submit.call_args
+        assert_that(item_contexts, has_length(0))
+
+    def test_create_bulk(self):
+        plugin_info = {'versions': [{'version': '1.0.0', 'upgradable': True}]}
+        git = {'method': 'git', 'options': {'url': 'http://foo', 'ref': 'master'}}
+        market = {'method': 'market', 'options': {'namespace': 'a', 'name': 'b'}}
+
+        with self.market_plugin(plugin_info):
+            with patch('wazo_plugind.service.BulkInstallTask') as BulkInstallTask:
+                result = self._service.create_bulk(
+                    [git, market, git], {'reinstall': False}
+                )
+
+        git_uuid = result['items'][0]['uuid']
+        assert_that(
+            result['items'],
+            contains(
+                has_entries(method='git', uuid=git_uuid),
+                has_entries(method='market', uuid=is_not(git_uuid)),
+                has_entries(method='git', uuid=git_uuid),
+            ),
+        )
+        (fn, ctx, item_contexts), _ = self._executor.submit.call_args
+        assert_that(fn, equal_to(BulkInstallTask.return_value.execute))
+        assert_that(ctx, has_properties(uuid=result['uuid'], wazo_version='21.02'))
+        assert_that(item_contexts, has_length(2))
+
+    @contextmanager
+    def market_plugin(self, plugin_info):
+        market_db = Mock(MarketDB)
+        market_db.get.return_value = dict(plugin_info, namespace='a', name='b')
+        self._version_finder.get_version.return_value = '21.02'
+        with patch.object(self._service, '_new_market_db', return_value=market_db):
+            with patch('wazo_plugind.service.PackageAndInstallTask'):
+                yield
+
     def test_get_plugin_metadata(self):
         namespace, name = 'foobar', 'someplugin'
         valid_plugin = Plugin(_DEFAULT_CONFIG, namespace, name)
@@ -0,0 +1,383 @@
+# Copyright 2021 The Wazo Authors  (see the AUTHORS file)
+# SPDX-License-Identifier: GPL-3.0-or-later
+
+from threading import Thread
+from unittest import TestCase
+from hamcrest import assert_that, calling, contains, equal_to, has_properties
+from mock import ANY, Mock, call, patch
+from xivo_test_helpers.hamcrest.raises import raises
+
+from ..config import _DEFAULT_CONFIG
+from ..context import Context
+from ..jobs import JobRegistry, install_key
+from ..tasks import BulkInstallTask, PackageAndInstallTask, _PackageBuilder
+
+
+def _dependency(name):
+    return {'namespace': 'foo', 'name': name}
+
+
+class _TaskTestCase(TestCase):
+    def setUp(self):
+        self.config = dict(_DEFAULT_CONFIG)
+        self.job_registry = JobRegistry(history_size=10)
+        self.publisher = Mock()
+        self.planner = Mock()
+        self.root_worker = Mock()
+        patchers = [
+            patch(
+                'wazo_plugind.tasks.jobs.get_job_registry',
+                return_value=self.job_registry,
+            ),
+            patch('wazo_plugind.tasks.get_publisher', return_value=self.publisher),
+            patch(
+                'wazo_plugind.tasks.dependency.DependencyPlanner.from_config',
+                return_value=self.planner,
+            ),
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def new_context(self, **kwargs):
+        kwargs.setdefault('wazo_version', '21.02')
+        kwargs.setdefault('install_options', {})
+        return Context(self.config, **kwargs)
+
+
+class TestPackageBuilderInstallDependencies(_TaskTestCase):
+    def setUp(self):
+        super().setUp()
+        self.prepare = Mock(side_effect=lambda ctx: ctx)
+        self.install = Mock(return_value=True)
+        self.builder = _PackageBuilder(
+            self.config, self.root_worker, self.prepare, self.install
+        )
+
+    def test_that_nothing_is_done_without_dependencies(self):
+        ctx = self.new_context(metadata={'namespace': 'foo', 'name': 'bar'})
+
+        result = self.builder.install_dependencies(ctx)
+
+        assert_that(result, equal_to(ctx))
+        self.planner.plan.assert_not_called()
+        self.install.assert_not_called()
+
+    def test_that_the_dependency_tree_is_installed_at_once(self):
+        metadata = {
+            'namespace': 'foo',
+            'name': 'bar',
+            'depends': [_dependency('a'), _dependency('b')],
+        }
+        self.planner.plan.return_value = [[_dependency('c')], [_dependency('a')]]
+        ctx = self.new_context(metadata=metadata)
+
+        result = self.builder.install_dependencies(ctx)
+
+        assert_that(result, equal_to(ctx))
+        self.install.assert_called_once_with(ctx, ANY)
+        _, dependency_contexts = self.install.call_args[0]
+        assert_that(
+            dependency_contexts,
+            contains(
+                has_properties(
+                    method='market',
+                    install_options=_dependency('c'),
+                    planned_dependencies={
+                        ('foo', 'a'),
+                        ('foo', 'bar'),
+                        ('foo', 'c'),
+                    },
+                ),
+                has_properties(install_options=_dependency('a')),
+            ),
+        )
+
+    def test_that_planned_dependencies_are_skipped(self):
+        metadata = {
+            'namespace': 'foo',
+            'name': 'bar',
+            'depends': [_dependency('a'), _dependency('b')],
+        }
+        self.planner.plan.return_value = [[_dependency('b')]]
+        ctx = self.new_context(metadata=metadata, planned_dependencies={('foo', 'a')})
+
+        self.builder.install_dependencies(ctx)
+
+        planned_metadata = self.planner.plan.call_args[0][0]
+        assert_that(planned_metadata['depends'], contains(_dependency('b')))
+        assert_that(metadata['depends'], contains(_dependency('a'), _dependency('b')))
+
+    def test_that_a_queued_identical_job_is_not_joined(self):
+        metadata = {'namespace': 'foo', 'name': 'bar', 'depends': [_dependency('a')]}
+        self.planner.plan.return_value = [[_dependency('a')]]
+        key = install_key('market', _dependency('a'))
+        self.job_registry.queue('queued', 'install', key=key)
+        ctx = self.new_context(metadata=metadata)
+        self.job_registry.queue(ctx.uuid, 'install')
+        self.job_registry.update(ctx.uuid, 'install', 'starting')
+
+        self.builder.install_dependencies(ctx)
+
+        self.prepare.assert_called_once_with(ANY)
+        assert_that(
+            self.prepare.call_args[0][0],
+            has_properties(install_options=_dependency('a')),
+        )
+
+    def test_that_the_dependencies_of_a_reused_package_are_installed_with_it(self):
+        metadata = {'namespace': 'foo', 'name': 'bar', 'depends': [_dependency('a')]}
+        self.planner.plan.return_value = [[_dependency('a')]]
+        ctx = self.new_context(metadata=metadata, package_deb_file='bar.deb')
+        reused = ctx.with_fields(artifact_key='key', artifact_found=True)
+
+        with patch.object(self.builder, '_fetch_artifact', return_value=reused):
+            ctx = self.builder.install_dependencies(ctx, with_plugin=True)
+        self.install.assert_not_called()
+
+        self.builder.install(ctx)
+
+        self.install.assert_called_once_with(ctx, ANY, plugin_deb_file='bar.deb')
+        _, dependency_contexts = self.install.call_args[0]
+        assert_that(
+            dependency_contexts,
+            contains(has_properties(install_options=_dependency('a'))),
+        )
+        self.root_worker.install.assert_not_called()
+
+    def test_that_the_dependencies_of_a_built_package_are_installed_first(self):
+        metadata = {'namespace': 'foo', 'name': 'bar', 'depends': [_dependency('a')]}
+        self.planner.plan.return_value = [[_dependency('a')]]
+        ctx = self.new_context(metadata=metadata, package_deb_file='bar.deb')
+        self.root_worker.install.return_value = True
+
+        ctx = self.builder.install_dependencies(ctx, with_plugin=True)
+        self.install.assert_called_once_with(ctx, ANY)
+
+        self.builder.install(ctx)
+
+        self.root_worker.install.assert_called_once_with(
+            ctx.uuid, 'bar.deb', log_filename=ctx.log_filename
+        )
+
+    def test_that_unprepared_dependencies_are_not_installed(self):
+        metadata = {'namespace': 'foo', 'name': 'bar', 'depends': [_dependency('a')]}
+        self.planner.plan.return_value = [[_dependency('a'), _dependency('b')]]
+        self.prepare.side_effect = lambda ctx: (
+            None if ctx.install_options['name'] == 'a' else ctx
+        )
+        ctx = self.new_context(metadata=metadata)
+
+        self.builder.install_dependencies(ctx)
+
+        _, dependency_contexts = self.install.call_args[0]
+        assert_that(
+            dependency_contexts,
+            contains(has_properties(install_options=_dependency('b'))),
+        )
+
+
+class TestPackageAndInstallTaskInstallAll(_TaskTestCase):
+    def setUp(self):
+        super().setUp()
+        self.task = PackageAndInstallTask(self.config, self.root_worker)
+        self.root_worker.apt_get_update.return_value = True
+        self.root_worker.install_batch.return_value = True
+        self.ctx = self.new_context()
+
+    def new_prepared_context(self, debian_depends=None):
+        return self.new_context(
+            metadata={'debian_depends': debian_depends},
+            package_deb_file='/tmp/{}.deb'.format(len(self.root_worker.mock_calls)),
+            extract_path=None,
+        )
+
+    def test_that_no_contexts_is_a_success(self):
+        assert_that(self.task.install_all(self.ctx, []), equal_to(True))
+
+        self.root_worker.install_batch.assert_not_called()
+
+    def test_that_the_packages_are_installed_in_a_single_transaction(self):
+        contexts = [self.new_prepared_context(), self.new_prepared_context()]
+
+        result = self.task.install_all(self.ctx, contexts)
+
+        assert_that(result, equal_to(True))
+        self.root_worker.apt_get_update.assert_not_called()
+        self.root_worker.install_batch.assert_called_once_with(
+            self.ctx.uuid,
+            [c.package_deb_file for c in contexts],
+            log_filename=self.ctx.log_filename,
+        )
+        for c in contexts:
+            self.publisher.install.assert_any_call(c, 'completed')
+
+    def test_that_the_plugin_package_is_installed_in_the_same_transaction(self):
+        contexts = [self.new_prepared_context()]
+
+        self.task.install_all(self.ctx, contexts, plugin_deb_file='plugin.deb')
+
+        self.root_worker.install_batch.assert_called_once_with(
+            self.ctx.uuid,
+            [contexts[0].package_deb_file, 'plugin.deb'],
+            log_filename=self.ctx.log_filename,
+        )
+
+    def test_that_a_single_update_is_done(self):
+        contexts = [
+            self.new_prepared_context(['curl']),
+            self.new_prepared_context(['vim']),
+        ]
+
+        self.task.install_all(self.ctx, contexts)
+
+        self.root_worker.apt_get_update.assert_called_once_with(self.ctx.uuid)
+
+    def test_that_a_failed_install_is_published_for_each_plugin(self):
+        self.root_worker.install_batch.return_value = False
+        contexts = [self.new_prepared_context(), self.new_prepared_context()]
+
+        result = self.task.install_all(self.ctx, contexts)
+
+        assert_that(result, equal_to(False))
+        self.publisher.install_error.assert_has_calls(
+            [
+                call(c, 'install-error', 'Installation error', details=ANY)
+                for c in contexts
+            ]
+        )
+        self.publisher.install.assert_has_calls(
+            [call(c, 'installing') for c in contexts]
+        )
+
+
+class TestBulkInstallTask(_TaskTestCase):
+    def setUp(self):
+        super().setUp()
+        self.task = BulkInstallTask(self.config, self.root_worker)
+        self.prepare = patch.object(
+            self.task._task, 'prepare', side_effect=lambda ctx: ctx
+        ).start()
+        self.install_all = patch.object(
+            self.task._task, 'install_all', return_value=True
+        ).start()
+        self.addCleanup(patch.stopall)
+        self.ctx = self.new_context()
+
+    def new_item_context(self, method='market', **install_options):
+        return self.new_context(method=method, install_options=install_options)
+
+    def test_that_dependencies_are_planned_once(self):
+        items = [
+            self.new_item_context(namespace='foo', name='a'),
+            self.new_item_context(namespace='foo', name='b'),
+        ]
+        self.planner.plan_all.return_value = [
+            [_dependency('c')],
+            [_dependency('a'), _dependency('b')],
+        ]
+
+        self.task.execute(self.ctx, items)
+
+        self.planner.plan_all.assert_called_once_with(
+            [{'namespace': 'foo', 'name': 'a'}, {'namespace': 'foo', 'name': 'b'}]
+        )
+        _, prepared_contexts = self.install_all.call_args[0]
+        assert_that(
+            prepared_contexts,
+            contains(
+                has_properties(install_options=_dependency('c')),
+                items[0],
+                items[1],
+            ),
+        )
+        planned = {('foo', 'a'), ('foo', 'b'), ('foo', 'c')}
+        for c in prepared_contexts:
+            assert_that(c.planned_dependencies, equal_to(planned))
+        self.publisher.install.assert_called_with(self.ctx, 'completed')
+
+    def test_that_other_methods_are_prepared_last(self):
+        git_item = self.new_item_context('git', url='https://example.com/a')
+        market_item = self.new_item_context(namespace='foo', name='a')
+        self.planner.plan_all.return_value = [[_dependency('a')]]
+
+        self.task.execute(self.ctx, [git_item, market_item])
+
+        _, prepared_contexts = self.install_all.call_args[0]
+        assert_that(prepared_contexts, contains(market_item, git_item))
+        assert_that(git_item.planned_dependencies, equal_to({('foo', 'a')}))
+
+    def test_that_a_dependency_installed_by_a_running_job_is_waited_for(self):
+        item = self.new_item_context(namespace='foo', name='a')
+        self.planner.plan_all.return_value = [[_dependency('c')], [_dependency('a')]]
+        key = install_key('market', _dependency('c'))
+        self.job_registry.queue('running', 'install', key=key)
+        self.job_registry.update('running', 'install', 'starting')
+        self.job_registry.queue(self.ctx.uuid, 'bulk_install')
+        self.job_registry.update(self.ctx.uuid, 'bulk_install', 'starting')
+
+        execution = Thread(target=self.task.execute, args=(self.ctx, [item]))
+        execution.start()
+        execution.join(timeout=0.1)
+        self.install_all.assert_not_called()
+
+        self.job_registry.update('running', 'install', 'completed')
+        execution.join(timeout=1)
+
+        self.prepare.assert_called_once_with(item)
+        self.install_all.assert_called_once_with(self.ctx, [item])
+
+    def test_that_the_dependencies_are_released_after_the_job(self):
+        self.planner.plan_all.return_value = [[_dependency('c')]]
+        self.install_all.side_effect = Exception('failed')
+
+        self.task.execute(self.ctx, [])
+
+        key = install_key('market', _dependency('c'))
+        assert_that(
+            self.job_registry.queue('other', 'install', key=key), equal_to('other')
+        )
+
+    def test_that_the_plugins_are_released_when_the_planning_fails(self):
+        item = self.new_item_context(namespace='foo', name='a')
+        key = install_key('market', item.install_options)
+        self.job_registry.queue(item.uuid, 'install', key=key, owner=self.ctx.uuid)
+        self.planner.plan_all.side_effect = Exception('market unavailable')
+
+        self.task.execute(self.ctx, [item])
+
+        self.publisher.install_error.assert_any_call(
+            item, 'bulk-install-error', 'Install Error', details=ANY
+        )
+        assert_that(
+            self.job_registry.queue('other', 'install', key=key), equal_to('other')
+        )
+
+    def test_that_conflicting_versions_are_refused(self):
+        first = self.new_item_context(namespace='foo', name='a', version='1')
+        second = self.new_item_context(namespace='foo', name='a', version='2')
+        self.planner.plan_all.return_value = [[first.install_options]]
+
+        self.task.execute(self.ctx, [first, second])
+
+        self.publisher.install_error.assert_called_once_with(
+            second, 'conflicting-install', 'Conflicting install', ANY
+        )
+        _, prepared_contexts = self.install_all.call_args[0]
+        assert_that(prepared_contexts, contains(first))
+
+    def test_that_a_failed_install_fails_the_job(self):
+        self.install_all.return_value = False
+        self.planner.plan_all.return_value = []
+
+        self.task.execute(self.ctx, [])
+
+        self.publisher.install_error.assert_called_once_with(
+            self.ctx, 'bulk-install-error', 'Install Error'
+        )
+        assert_that(
+            calling(self.publisher.install.assert_any_call).with_args(
+                self.ctx, 'completed'
+            ),
+            raises(AssertionError),
+        )